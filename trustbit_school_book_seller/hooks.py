@@ -28,7 +28,10 @@ required_apps = ["frappe", "erpnext"]
 
 # include js in doctype views
 doctype_js = {
-    "Book Item Creator": "public/js/book_item_creator.js"
+    "Book Item Creator": "public/js/book_item_creator.js",
+    "Publication": "public/js/publication.js",
+    "School Book Order": "public/js/school_book_order.js",
+    "Book Stock Take": "public/js/book_stock_take.js"
 }
 
 # doctype_list_js = {"doctype" : "public/js/doctype_list.js"}
@@ -57,6 +60,7 @@ doctype_js = {
 
 # before_install = "trustbit_school_book_seller.install.before_install"
 after_install = "trustbit_school_book_seller.install.after_install"
+after_migrate = "trustbit_school_book_seller.install.after_migrate"
 
 # Uninstallation
 # ------------
@@ -102,6 +106,42 @@ after_install = "trustbit_school_book_seller.install.after_install"
 #	}
 # }
 
+doc_events = {
+    "Stock Ledger Entry": {
+        "on_submit": "trustbit_school_book_seller.trustbit_school_book.report_cache.on_stock_ledger_entry"
+    },
+    "Item Price": {
+        "on_update": "trustbit_school_book_seller.trustbit_school_book.report_cache.on_item_price_change",
+        "on_trash": "trustbit_school_book_seller.trustbit_school_book.report_cache.on_item_price_change"
+    },
+    "Item": {
+        "validate": "trustbit_school_book_seller.trustbit_school_book.purchase_import.on_item_validate",
+        "on_update": [
+            "trustbit_school_book_seller.trustbit_school_book.search_index.on_item_update",
+            "trustbit_school_book_seller.trustbit_school_book.title_index.on_item_update"
+        ],
+        "on_trash": [
+            "trustbit_school_book_seller.trustbit_school_book.search_index.on_item_trash",
+            "trustbit_school_book_seller.trustbit_school_book.title_index.on_item_trash"
+        ]
+    },
+    "Publication": {
+        "on_update": [
+            "trustbit_school_book_seller.trustbit_school_book.search_index.on_master_update",
+            "trustbit_school_book_seller.trustbit_school_book.title_index.on_master_update"
+        ]
+    },
+    "Subject": {
+        "on_update": "trustbit_school_book_seller.trustbit_school_book.search_index.on_master_update"
+    },
+    "Class Master": {
+        "on_update": [
+            "trustbit_school_book_seller.trustbit_school_book.search_index.on_master_update",
+            "trustbit_school_book_seller.trustbit_school_book.title_index.on_master_update"
+        ]
+    }
+}
+
 # Scheduled Tasks
 # ---------------
 
@@ -123,6 +163,26 @@ after_install = "trustbit_school_book_seller.install.after_install"
 # 	],
 # }
 
+scheduler_events = {
+    "all": [
+        "trustbit_school_book_seller.trustbit_school_book.creation_queue.dispatch"
+    ],
+    "cron": {
+        "*/10 * * * *": [
+            "trustbit_school_book_seller.trustbit_school_book.sales_aggregate.update_sales_daily"
+        ],
+        "*/5 * * * *": [
+            "trustbit_school_book_seller.trustbit_school_book.creation_queue.recover_stalled_jobs"
+        ]
+    },
+    "daily_long": [
+        "trustbit_school_book_seller.trustbit_school_book.pricing.switch_over_season_prices"
+    ],
+    "weekly_long": [
+        "trustbit_school_book_seller.trustbit_school_book.archive.archive_book_item_creators"
+    ]
+}
+
 # Testing
 # -------
 
@@ -177,33 +237,6 @@ after_install = "trustbit_school_book_seller.install.after_install"
 # 	"trustbit_school_book_seller.auth.validate"
 # ]
 
-# Fixtures - Export these doctypes when running bench export-fixtures
-fixtures = [
-    {
-        "doctype": "Subject",
-        "filters": []
-    },
-    {
-        "doctype": "Class Master",
-        "filters": []
-    },
-    {
-        "doctype": "Custom Field",
-        "filters": [
-            ["name", "in", [
-                "Item-custom_book_details_section",
-                "Item-custom_publication",
-                "Item-custom_subject",
-                "Item-custom_class",
-                "Item-custom_author",
-                "Item-custom_edition",
-                "Item-custom_publication_year",
-                "Item-custom_isbn_barcode",
-                "Item-custom_discount_section",
-                "Item-custom_sales_discount_percent",
-                "Item-custom_purchase_discount_percent",
-                "Item-custom_book_item_creator"
-            ]]
-        ]
-    }
-]
+# Default Subjects, Class Masters and the custom fields on Item are synced by
+# install.sync_seed_data (after_install / after_migrate) from the files in
+# data/, and only when their content hash changes, instead of fixtures
@@ -1,26 +1,118 @@
 # Copyright (c) 2024, Trustbit and contributors
 # For license information, please see license.txt
 
+import hashlib
+import json
+import time
+from contextlib import contextmanager
+
 import frappe
-from frappe import _
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields as make_custom_fields
+from frappe.utils import now_datetime
+
+
+SEED_HASH_KEY = "trustbit_school_book_seller_seed_hash"
+
+# Default masters shipped with the app, synced by sync_seed_data
+SEED_DATA_FILES = {
+    "Class Master": "class_master.json",
+    "Subject": "subject.json",
+}
 
 
 def after_install():
     """Run after app installation"""
-    create_custom_fields()
-    create_default_classes()
-    create_default_subjects()
-    frappe.db.commit()
+    sync_seed_data(force=True)
     print("Trustbit School Book Seller App installed successfully!")
 
 
-def create_custom_fields():
-    """Create custom fields on Item doctype"""
+def after_migrate():
+    """Run after every migrate, skipped when the seed data has not changed"""
+    sync_seed_data()
+
+
+def sync_seed_data(force=False):
+    """Create missing custom fields and default masters in one pass per doctype"""
+    custom_fields = get_custom_fields()
+    records = {doctype: load_seed_records(file_name) for doctype, file_name in SEED_DATA_FILES.items()}
+    
+    seed_hash = get_seed_hash(custom_fields, records)
+    if not force and frappe.db.get_global(SEED_HASH_KEY) == seed_hash:
+        print("School book seed data unchanged, skipping sync")
+        return
+    
+    with timed("Custom fields") as step:
+        step.count = create_custom_fields(custom_fields)
+    
+    for doctype, doctype_records in records.items():
+        with timed(doctype) as step:
+            step.count = insert_missing_records(doctype, doctype_records)
+    
+    frappe.db.set_global(SEED_HASH_KEY, seed_hash)
+    frappe.db.commit()
+
+
+@contextmanager
+def timed(label):
+    """Print the number of records created by a step and how long it took"""
+    step = frappe._dict(count=0)
+    start = time.monotonic()
+    yield step
+    print(f"{label}: {step.count} created ({time.monotonic() - start:.2f}s)")
+
+
+def get_seed_hash(custom_fields, records):
+    content = json.dumps({"custom_fields": custom_fields, "records": records}, sort_keys=True)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def load_seed_records(file_name):
+    with open(frappe.get_app_path("trustbit_school_book_seller", "data", file_name)) as f:
+        return json.load(f)
+
+
+def insert_missing_records(doctype, records):
+    """Bulk insert the records whose name does not exist yet"""
+    existing = set(frappe.get_all(doctype, pluck="name"))
+    missing = [record for record in records if record["name"] not in existing]
+    if not missing:
+        return 0
+    
+    now = now_datetime()
+    user = frappe.session.user
+    fields = [key for key in missing[0] if key != "doctype"]
+    values = [
+        [record.get(field) for field in fields] + [now, now, user, user]
+        for record in missing
+    ]
+    
+    frappe.db.bulk_insert(doctype, fields + ["creation", "modified", "owner", "modified_by"], values)
+    frappe.clear_cache(doctype=doctype)
+    
+    return len(missing)
+
+
+def create_custom_fields(custom_fields):
+    """Create the missing custom fields on Item, updating the table schema once"""
+    existing = set(frappe.get_all(
+        "Custom Field",
+        filters={"dt": "Item", "fieldname": ["in", [field["fieldname"] for field in custom_fields]]},
+        pluck="fieldname"
+    ))
+    missing = [field for field in custom_fields if field["fieldname"] not in existing]
+    if not missing:
+        return 0
+    
+    make_custom_fields({"Item": missing}, update=False)
+    
+    return len(missing)
+
+
+def get_custom_fields():
+    """Custom fields on Item doctype"""
     custom_fields = [
         # Book Details Section
         {
-            "doctype": "Custom Field",
-            "dt": "Item",
             "fieldname": "custom_book_details_section",
             "fieldtype": "Section Break",
             "label": "Book Details",
@@ -28,8 +120,6 @@ def create_custom_fields():
             "collapsible": 1
         },
         {
-            "doctype": "Custom Field",
-            "dt": "Item",
             "fieldname": "custom_publication",
             "fieldtype": "Link",
             "label": "Publication",
@@ -37,8 +127,6 @@ def create_custom_fields():
             "insert_after": "custom_book_details_section"
         },
         {
-            "doctype": "Custom Field",
-            "dt": "Item",
             "fieldname": "custom_subject",
             "fieldtype": "Link",
             "label": "Subject",
@@ -46,8 +134,6 @@ def create_custom_fields():
             "insert_after": "custom_publication"
         },
         {
-            "doctype": "Custom Field",
-            "dt": "Item",
             "fieldname": "custom_class",
             "fieldtype": "Link",
             "label": "Class",
@@ -55,32 +141,24 @@ def create_custom_fields():
             "insert_after": "custom_subject"
         },
         {
-            "doctype": "Custom Field",
-            "dt": "Item",
             "fieldname": "custom_author",
             "fieldtype": "Data",
             "label": "Author",
             "insert_after": "custom_class"
         },
         {
-            "doctype": "Custom Field",
-            "dt": "Item",
             "fieldname": "custom_edition",
             "fieldtype": "Data",
             "label": "Edition",
             "insert_after": "custom_author"
         },
         {
-            "doctype": "Custom Field",
-            "dt": "Item",
             "fieldname": "custom_publication_year",
             "fieldtype": "Data",
             "label": "Publication Year",
             "insert_after": "custom_edition"
         },
         {
-            "doctype": "Custom Field",
-            "dt": "Item",
             "fieldname": "custom_isbn_barcode",
             "fieldtype": "Data",
             "label": "ISBN/Barcode",
@@ -89,8 +167,6 @@ def create_custom_fields():
         },
         # Discount Section
         {
-            "doctype": "Custom Field",
-            "dt": "Item",
             "fieldname": "custom_discount_section",
             "fieldtype": "Section Break",
             "label": "Discount",
@@ -98,100 +174,35 @@ def create_custom_fields():
             "collapsible": 1
         },
         {
-            "doctype": "Custom Field",
-            "dt": "Item",
             "fieldname": "custom_sales_discount_percent",
             "fieldtype": "Percent",
             "label": "Sales Discount %",
             "insert_after": "custom_discount_section"
         },
         {
-            "doctype": "Custom Field",
-            "dt": "Item",
             "fieldname": "custom_purchase_discount_percent",
             "fieldtype": "Percent",
             "label": "Purchase Discount %",
             "insert_after": "custom_sales_discount_percent"
         },
         {
-            "doctype": "Custom Field",
-            "dt": "Item",
             "fieldname": "custom_book_item_creator",
             "fieldtype": "Link",
             "label": "Created From",
             "options": "Book Item Creator",
             "insert_after": "custom_purchase_discount_percent",
             "read_only": 1
+        },
+        # ISBN without separators in its ISBN-13 form, to match invoices on an index
+        {
+            "fieldname": "custom_isbn_normalized",
+            "fieldtype": "Data",
+            "label": "Normalized ISBN",
+            "insert_after": "custom_book_item_creator",
+            "read_only": 1,
+            "hidden": 1,
+            "search_index": 1
         }
     ]
     
-    for field in custom_fields:
-        if not frappe.db.exists("Custom Field", {"dt": field["dt"], "fieldname": field["fieldname"]}):
-            doc = frappe.get_doc(field)
-            doc.insert(ignore_permissions=True)
-            print(f"Created custom field: {field['fieldname']}")
-
-
-def create_default_classes():
-    """Create default class master entries"""
-    classes = [
-        {"name": "Nursery", "class_name": "Nursery", "short_code": "NUR", "sort_order": 1},
-        {"name": "LKG", "class_name": "LKG", "short_code": "LKG", "sort_order": 2},
-        {"name": "UKG", "class_name": "UKG", "short_code": "UKG", "sort_order": 3},
-        {"name": "Class 1", "class_name": "Class 1", "short_code": "C1", "sort_order": 4},
-        {"name": "Class 2", "class_name": "Class 2", "short_code": "C2", "sort_order": 5},
-        {"name": "Class 3", "class_name": "Class 3", "short_code": "C3", "sort_order": 6},
-        {"name": "Class 4", "class_name": "Class 4", "short_code": "C4", "sort_order": 7},
-        {"name": "Class 5", "class_name": "Class 5", "short_code": "C5", "sort_order": 8},
-        {"name": "Class 6", "class_name": "Class 6", "short_code": "C6", "sort_order": 9},
-        {"name": "Class 7", "class_name": "Class 7", "short_code": "C7", "sort_order": 10},
-        {"name": "Class 8", "class_name": "Class 8", "short_code": "C8", "sort_order": 11},
-        {"name": "Class 9", "class_name": "Class 9", "short_code": "C9", "sort_order": 12},
-        {"name": "Class 10", "class_name": "Class 10", "short_code": "C10", "sort_order": 13},
-        {"name": "Class 11", "class_name": "Class 11", "short_code": "C11", "sort_order": 14},
-        {"name": "Class 12", "class_name": "Class 12", "short_code": "C12", "sort_order": 15},
-    ]
-    
-    for cls in classes:
-        if not frappe.db.exists("Class Master", cls["name"]):
-            doc = frappe.get_doc({
-                "doctype": "Class Master",
-                **cls
-            })
-            doc.insert(ignore_permissions=True)
-            print(f"Created class: {cls['name']}")
-
-
-def create_default_subjects():
-    """Create default subject entries"""
-    subjects = [
-        {"name": "Mathematics", "subject_name": "Mathematics", "short_code": "MATH", "sort_order": 1},
-        {"name": "English", "subject_name": "English", "short_code": "ENG", "sort_order": 2},
-        {"name": "Hindi", "subject_name": "Hindi", "short_code": "HIN", "sort_order": 3},
-        {"name": "Science", "subject_name": "Science", "short_code": "SCI", "sort_order": 4},
-        {"name": "Social Science", "subject_name": "Social Science", "short_code": "SST", "sort_order": 5},
-        {"name": "Physics", "subject_name": "Physics", "short_code": "PHY", "sort_order": 6},
-        {"name": "Chemistry", "subject_name": "Chemistry", "short_code": "CHEM", "sort_order": 7},
-        {"name": "Biology", "subject_name": "Biology", "short_code": "BIO", "sort_order": 8},
-        {"name": "Computer Science", "subject_name": "Computer Science", "short_code": "CS", "sort_order": 9},
-        {"name": "Economics", "subject_name": "Economics", "short_code": "ECO", "sort_order": 10},
-        {"name": "Accountancy", "subject_name": "Accountancy", "short_code": "ACC", "sort_order": 11},
-        {"name": "Business Studies", "subject_name": "Business Studies", "short_code": "BST", "sort_order": 12},
-        {"name": "Geography", "subject_name": "Geography", "short_code": "GEO", "sort_order": 13},
-        {"name": "History", "subject_name": "History", "short_code": "HIST", "sort_order": 14},
-        {"name": "Political Science", "subject_name": "Political Science", "short_code": "POL", "sort_order": 15},
-        {"name": "Sanskrit", "subject_name": "Sanskrit", "short_code": "SANS", "sort_order": 16},
-        {"name": "Physical Education", "subject_name": "Physical Education", "short_code": "PE", "sort_order": 17},
-        {"name": "Art & Craft", "subject_name": "Art & Craft", "short_code": "ART", "sort_order": 18},
-        {"name": "Music", "subject_name": "Music", "short_code": "MUS", "sort_order": 19},
-        {"name": "General Knowledge", "subject_name": "General Knowledge", "short_code": "GK", "sort_order": 20},
-    ]
-    
-    for subj in subjects:
-        if not frappe.db.exists("Subject", subj["name"]):
-            doc = frappe.get_doc({
-                "doctype": "Subject",
-                **subj
-            })
-            doc.insert(ignore_permissions=True)
-            print(f"Created subject: {subj['name']}")
+    return custom_fields
@@ -0,0 +1,9 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+
+
+def execute():
+    """Index Item Prices on (item_code, price_list, valid_from) for point-in-time price lookups"""
+    frappe.db.add_index("Item Price", ["item_code", "price_list", "valid_from"], "book_price_validity_index")
@@ -0,0 +1,9 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+
+
+def execute():
+    """Index the Stock Ledger on (creation, name) for the incremental sales aggregation"""
+    frappe.db.add_index("Stock Ledger Entry", ["creation", "name"], "book_sales_watermark_index")
@@ -0,0 +1,18 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+
+
+def execute():
+    """Reserve the ISBNs of existing draft and submitted Book Item Creators"""
+    # Submitted documents are inserted first so they win over drafts
+    frappe.db.sql("""
+        INSERT IGNORE INTO `tabBook ISBN Reservation`
+            (name, isbn_barcode, book_item_creator, class, creation, modified, owner, modified_by)
+        SELECT bcd.isbn_barcode, bcd.isbn_barcode, bic.name, bcd.class, NOW(), NOW(), 'Administrator', 'Administrator'
+        FROM `tabBook Class Detail` bcd
+        INNER JOIN `tabBook Item Creator` bic ON bcd.parent = bic.name
+        WHERE bic.docstatus < 2 AND IFNULL(bcd.isbn_barcode, '') != ''
+        ORDER BY bic.docstatus DESC, bic.creation
+    """)
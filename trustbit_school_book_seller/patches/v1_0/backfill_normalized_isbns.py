@@ -0,0 +1,24 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from trustbit_school_book_seller.install import create_custom_fields, get_custom_fields
+from trustbit_school_book_seller.trustbit_school_book.purchase_import import normalize_isbn
+
+
+def execute():
+    """Store the normalized ISBN of existing items so invoices match them on an index"""
+    # Custom fields are otherwise only created after migrate, once patches have run
+    create_custom_fields(get_custom_fields())
+    
+    items = frappe.get_all(
+        "Item",
+        filters={"custom_isbn_barcode": ["is", "set"]},
+        fields=["name", "custom_isbn_barcode"]
+    )
+    frappe.db.bulk_update(
+        "Item",
+        {item.name: {"custom_isbn_normalized": normalize_isbn(item.custom_isbn_barcode) or None} for item in items},
+        chunk_size=1000,
+        update_modified=False
+    )
@@ -0,0 +1,9 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+from trustbit_school_book_seller.trustbit_school_book.search_index import rebuild_search_index
+
+
+def execute():
+    """Index book items created before the search index existed"""
+    rebuild_search_index()
@@ -0,0 +1,9 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+from trustbit_school_book_seller.trustbit_school_book.title_index import rebuild_title_index
+
+
+def execute():
+    """Key the titles of book items created before the title index existed"""
+    rebuild_title_index()
@@ -0,0 +1,11 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+from trustbit_school_book_seller.trustbit_school_book.pricing import get_season_validity, rebase_open_prices
+from trustbit_school_book_seller.trustbit_school_book.season import find_season
+
+
+def execute():
+    """Make open-ended book prices created this season before prices were versioned the season's price"""
+    if find_season():
+        rebase_open_prices(get_season_validity())
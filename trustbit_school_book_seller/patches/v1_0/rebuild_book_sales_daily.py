@@ -0,0 +1,9 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+from trustbit_school_book_seller.trustbit_school_book.sales_aggregate import rebuild_sales_daily
+
+
+def execute():
+    """Rebuild daily sales so received quantities net out cancelled receipts"""
+    rebuild_sales_daily()
@@ -26,6 +26,18 @@ frappe.ui.form.on('Book Item Creator', {
                 download_csv_template();
             }, __('Import/Export'));
             
+            // Fill rate and valuation rate of every row from its MRP
+            frm.add_custom_button(__('Derive Rates from MRP'), function() {
+                derive_rates(frm);
+            }, __('Actions'));
+            
+            // Dry run - validate and estimate without creating anything
+            if (!frm.is_new()) {
+                frm.add_custom_button(__('Dry Run'), function() {
+                    dry_run(frm);
+                }, __('Actions'));
+            }
+            
             // Custom submit button with progress dialog
             frm.page.set_primary_action(__('Submit & Create Items'), function() {
                 submit_with_progress(frm);
@@ -36,6 +48,11 @@ frappe.ui.form.on('Book Item Creator', {
         if (frm.doc.docstatus === 1) {
             render_progress_bar(frm);
             
+            // Items are still being created, cancelling now would miss them in the rollback
+            if (['Queued', 'In Progress'].includes(frm.doc.status)) {
+                frm.page.clear_secondary_action();
+            }
+            
             // Export to Excel button
             if (frm.doc.items_created > 0) {
                 frm.add_custom_button(__('Export to Excel'), function() {
@@ -55,6 +72,13 @@ frappe.ui.form.on('Book Item Creator', {
                 }, __('Actions'));
             }
             
+            // Shelf/price labels of the created items
+            if (frm.doc.items_created > 0) {
+                frm.add_custom_button(__('Print Labels'), function() {
+                    print_labels({ book_item_creator: frm.doc.name });
+                }, __('Actions'));
+            }
+            
             // View Items button
             if (frm.doc.items_created > 0) {
                 frm.add_custom_button(__('View Created Items'), function() {
@@ -72,6 +96,18 @@ frappe.ui.form.on('Book Item Creator', {
             }, __('Actions'));
         }
         
+        // Creation and retries wait for a free slot in the creation queue
+        if (frm.doc.docstatus === 1 && ['Queued', 'In Progress', 'Partially Created', 'Failed'].includes(frm.doc.status)) {
+            show_queue_status(frm);
+        }
+        
+        // Cancelled - rollback runs in the background
+        if (frm.doc.status === 'Rolling Back') {
+            frm.dashboard.set_headline_alert(
+                __('Rolling back created items, prices and opening stock in the background...'), 'orange'
+            );
+        }
+        
         setup_realtime_listener(frm);
     },
     
@@ -93,6 +129,15 @@ frappe.ui.form.on('Book Item Creator', {
         frm.set_query('class', 'class_details', function() {
             return { filters: { 'disabled': 0 } };
         });
+        
+        // Distribution lines only for classes already in the grid
+        frm.set_query('class', 'stock_distribution', function() {
+            return { filters: { 'name': ['in', (frm.doc.class_details || []).map(d => d['class'])] } };
+        });
+        
+        frm.set_query('warehouse', 'stock_distribution', function() {
+            return { filters: { 'is_group': 0, 'disabled': 0 } };
+        });
     }
 });
 
@@ -123,6 +168,18 @@ frappe.ui.form.on('Book Class Detail', {
     }
 });
 
+frappe.ui.form.on('Book Stock Distribution', {
+    'class': function(frm) {
+        calculate_totals(frm);
+    },
+    qty: function(frm) {
+        calculate_totals(frm);
+    },
+    stock_distribution_remove: function(frm) {
+        calculate_totals(frm);
+    }
+});
+
 // ========== EXPORT TO EXCEL ==========
 function export_to_excel(frm) {
     frappe.call({
@@ -219,7 +276,12 @@ function process_csv_import(frm, file_url, dialog) {
     frappe.call({
         // BUG FIX: Correct API path
         method: 'trustbit_school_book_seller.trustbit_school_book.doctype.book_item_creator.book_item_creator.parse_csv_file',
-        args: { file_url: file_url },
+        args: {
+            file_url: file_url,
+            publication: frm.doc.publication,
+            subject: frm.doc.subject,
+            book_name: frm.doc.book_name
+        },
         freeze: true,
         freeze_message: __('Processing CSV...'),
         callback: function(r) {
@@ -255,10 +317,17 @@ function process_csv_import(frm, file_url, dialog) {
                     msg += `<br><br><strong>Skipped:</strong><br>` + errors.join('<br>');
                 }
                 
+                let similar = r.message.similar_titles || [];
+                if (similar.length > 0) {
+                    msg += `<br><br><strong>${__('Possible duplicates already in the catalog:')}</strong><br>` + similar.map(
+                        d => `${d.class}: ${d.item_name} (${d.item_code}), ${Math.round(d.score * 100)}%`
+                    ).join('<br>');
+                }
+                
                 frappe.msgprint({
                     title: __('Import Complete'),
                     message: msg,
-                    indicator: added > 0 ? 'green' : 'orange'
+                    indicator: added > 0 && !similar.length ? 'green' : 'orange'
                 });
             } else {
                 frappe.msgprint({
@@ -271,6 +340,133 @@ function process_csv_import(frm, file_url, dialog) {
     });
 }
 
+// ========== DRY RUN ==========
+function dry_run(frm) {
+    let run = function() {
+        frappe.call({
+            method: 'trustbit_school_book_seller.trustbit_school_book.doctype.book_item_creator.book_item_creator.dry_run',
+            args: { docname: frm.doc.name },
+            freeze: true,
+            freeze_message: __('Checking...'),
+            callback: function(r) {
+                if (!r.message) return;
+                let plan = r.message;
+                let msg = `
+                    <table class="table table-bordered table-sm">
+                        <tr><td>${__('Items to Create')}</td><td>${plan.items_to_create}</td></tr>
+                        <tr><td>${__('Existing Items to Sync')}</td><td>${plan.items_to_sync}</td></tr>
+                        <tr><td>${__('Item Prices')}</td><td>${plan.item_prices}</td></tr>
+                        <tr><td>${__('Stock Entries')}</td><td>${plan.stock_entries} (${plan.stock_lines} ${__('lines')})</td></tr>
+                        <tr><td><strong>${__('Total Writes')}</strong></td><td><strong>${plan.total_writes}</strong></td></tr>
+                        <tr><td>${__('Estimated Duration')}</td><td>${plan.estimated_seconds} ${__('seconds')}</td></tr>
+                    </table>
+                `;
+                if (plan.errors.length) {
+                    msg = `<div class="alert alert-danger">${plan.errors.join('<br>')}</div>` + msg;
+                }
+                frappe.msgprint({
+                    title: plan.ok ? __('Ready to Create') : __('Submission Would Fail'),
+                    message: msg,
+                    indicator: plan.ok ? 'green' : 'red'
+                });
+            }
+        });
+    };
+    
+    if (frm.is_dirty()) {
+        frm.save().then(run);
+    } else {
+        run();
+    }
+}
+
+// ========== DERIVE RATES ==========
+function derive_rates(frm) {
+    frappe.call({
+        method: 'trustbit_school_book_seller.trustbit_school_book.rate_engine.preview_rates',
+        args: { doc: frm.doc },
+        callback: function(r) {
+            let changes = r.message || [];
+            if (!changes.length) {
+                frappe.msgprint(__('Rates already match the MRP and discounts, or no row has an MRP.'));
+                return;
+            }
+            
+            frappe.confirm(get_rate_changes_html(changes), function() {
+                changes.forEach(function(change) {
+                    let row = frm.doc.class_details.find(d => d.idx === change.idx);
+                    if (row) {
+                        row.rate = change.rate;
+                        row.valuation_rate = change.valuation_rate;
+                        row.amount = flt(row.opening_stock) * flt(row.valuation_rate);
+                    }
+                });
+                frm.refresh_field('class_details');
+                calculate_totals(frm);
+                frm.dirty();
+            });
+        }
+    });
+}
+
+function get_rate_changes_html(changes) {
+    let rows = changes.map(c => `
+        <tr>
+            <td>#${c.idx}</td>
+            <td>${c['class'] || ''}</td>
+            <td>${format_currency(c.mrp)}</td>
+            <td>${format_currency(c.old_rate)} &rarr; ${format_currency(c.rate)}</td>
+            <td>${format_currency(c.old_valuation_rate)} &rarr; ${format_currency(c.valuation_rate)}</td>
+        </tr>
+    `).join('');
+    
+    return `
+        <p>${__('{0} rows will change:', [changes.length])}</p>
+        <div style="max-height: 300px; overflow-y: auto;">
+            <table class="table table-bordered table-sm">
+                <thead><tr>
+                    <th>${__('Row')}</th><th>${__('Class')}</th><th>${__('MRP')}</th>
+                    <th>${__('Rate')}</th><th>${__('Valuation Rate')}</th>
+                </tr></thead>
+                <tbody>${rows}</tbody>
+            </table>
+        </div>
+    `;
+}
+
+// ========== PRINT LABELS ==========
+function print_labels(args) {
+    frappe.prompt({
+        fieldname: 'copies',
+        fieldtype: 'Int',
+        label: __('Copies per Item'),
+        default: 1,
+        reqd: 1
+    }, function(values) {
+        frappe.call({
+            method: 'trustbit_school_book_seller.trustbit_school_book.labels.print_labels',
+            args: Object.assign({ copies: values.copies }, args),
+            callback: function(r) {
+                frappe.show_alert({ message: r.message.message, indicator: 'blue' });
+            }
+        });
+    }, __('Print Labels'), __('Generate'));
+    
+    frappe.realtime.off('book_labels_ready');
+    frappe.realtime.on('book_labels_ready', function(data) {
+        if (!data.files.length) {
+            frappe.msgprint(__('No items found to print labels for.'));
+            return;
+        }
+        let links = data.files.map(f => `<a href="${f.file_url}" target="_blank">${f.file_name}</a>`).join('<br>');
+        frappe.msgprint({
+            title: __('{0} Labels Ready', [data.labels]),
+            message: links,
+            indicator: 'green'
+        });
+    });
+}
+
 // ========== DUPLICATE ENTRY ==========
 function duplicate_entry(frm) {
     frappe.confirm(
@@ -349,7 +545,8 @@ function submit_with_progress(frm) {
     
     // Now submit
     frm.save('Submit').then(() => {
-        // Realtime will update the dialog
+        // Realtime will update the dialog; creation may wait in the queue, so allow closing
+        progress_dialog.get_primary_btn().prop('disabled', false);
     }).catch((err) => {
         progress_dialog.hide();
         frappe.msgprint(__('Error submitting document'));
@@ -442,18 +639,32 @@ function update_progress_dialog(success, failed, total) {
 
 function calculate_row_amount(frm, cdt, cdn) {
     let row = locals[cdt][cdn];
-    row.amount = flt(row.opening_stock) * flt(row.valuation_rate);
+    row.amount = get_row_stock_qty(frm, row) * flt(row.valuation_rate);
     frm.refresh_field('class_details');
 }
 
+// Opening stock of a class row across the default and distribution warehouses
+function get_row_stock_qty(frm, row) {
+    let qty = flt(row.opening_stock);
+    (frm.doc.stock_distribution || []).forEach(function(line) {
+        if (line['class'] === row['class']) {
+            qty += flt(line.qty);
+        }
+    });
+    return qty;
+}
+
 function calculate_totals(frm) {
     let total_opening_stock = 0;
     let total_stock_value = 0;
     
     (frm.doc.class_details || []).forEach(function(row) {
-        total_opening_stock += flt(row.opening_stock);
-        total_stock_value += flt(row.opening_stock) * flt(row.valuation_rate);
+        let qty = get_row_stock_qty(frm, row);
+        row.amount = qty * flt(row.valuation_rate);
+        total_opening_stock += qty;
+        total_stock_value += row.amount;
     });
+    frm.refresh_field('class_details');
     
     frm.set_value('total_opening_stock', total_opening_stock);
     frm.set_value('total_stock_value', total_stock_value);
@@ -519,6 +730,14 @@ function check_isbn_duplicate(frm, row) {
         },
         callback: function(r) {
             if (r.message && r.message.exists) {
+                if (frm.doc.update_existing_items && r.message.type === 'Item') {
+                    frappe.show_alert({
+                        message: __('ISBN {0} matches Item {1}, which will be updated on submit',
+                            [row.isbn_barcode, r.message.name]),
+                        indicator: 'blue'
+                    });
+                    return;
+                }
                 frappe.show_alert({
                     message: __('ISBN {0} already exists in {1}: {2}', 
                         [row.isbn_barcode, r.message.type, r.message.name]),
@@ -541,7 +760,7 @@ function render_progress_bar(frm) {
     let created = 0, failed = 0, pending = 0;
     
     (frm.doc.class_details || []).forEach(function(row) {
-        if (row.creation_status === 'Created') created++;
+        if (['Created', 'Updated', 'Unchanged'].includes(row.creation_status)) created++;
         else if (row.creation_status === 'Failed') failed++;
         else pending++;
     });
@@ -579,7 +798,9 @@ function get_status_color(status) {
         case 'Completed': return 'green';
         case 'Partially Created': return 'orange';
         case 'Failed': return 'red';
+        case 'Queued': return 'yellow';
         case 'In Progress': return 'blue';
+        case 'Rolling Back': return 'orange';
         default: return 'grey';
     }
 }
@@ -587,6 +808,30 @@ function get_status_color(status) {
 function setup_realtime_listener(frm) {
     // BUG FIX: Remove existing listener to prevent duplicates
     frappe.realtime.off('book_item_creation_progress');
+    frappe.realtime.off('book_item_rollback_complete');
+    frappe.realtime.off('book_creation_job_complete');
+    
+    frappe.realtime.on('book_creation_job_complete', function(data) {
+        if (data.docname === frm.doc.name) {
+            if (data.failed) {
+                frappe.show_alert({ message: __('{0} job failed, see Error Log', [data.job_type]), indicator: 'red' });
+            }
+            if (!(progress_dialog && progress_dialog.$wrapper.is(':visible'))) {
+                frm.reload_doc();
+            }
+        }
+    });
+    
+    frappe.realtime.on('book_item_rollback_complete', function(data) {
+        if (data.docname === frm.doc.name) {
+            frappe.show_alert({
+                message: __('Rollback complete: {0} deleted, {1} disabled, {2} failed',
+                    [data.deleted, data.disabled, data.failed]),
+                indicator: data.failed ? 'orange' : 'green'
+            });
+            frm.reload_doc();
+        }
+    });
     
     frappe.realtime.on('book_item_creation_progress', function(data) {
         if (data.docname === frm.doc.name) {
@@ -597,32 +842,40 @@ function setup_realtime_listener(frm) {
 }
 
 function retry_failed_items(frm) {
-    let failed_count = (frm.doc.class_details || []).filter(r => r.creation_status === 'Failed').length;
-    
-    progress_dialog = new frappe.ui.Dialog({
-        title: __('🔄 Retrying Failed Items'),
-        size: 'large',
-        static: true,
-        fields: [{ fieldtype: 'HTML', fieldname: 'progress_html', options: get_progress_html(0, 0, failed_count) }],
-        primary_action_label: __('Close'),
-        primary_action: function() { progress_dialog.hide(); frm.reload_doc(); }
-    });
-    
-    progress_dialog.get_primary_btn().prop('disabled', true);
-    progress_dialog.show();
-    
     frappe.call({
         // BUG FIX: Correct API path
         method: 'trustbit_school_book_seller.trustbit_school_book.doctype.book_item_creator.book_item_creator.retry_failed_items',
         args: { docname: frm.doc.name },
         callback: function(r) {
             if (r.message) {
-                update_progress_dialog(r.message.success, r.message.total_failed - r.message.success, r.message.total_failed);
-                progress_dialog.get_primary_btn().prop('disabled', false);
+                frappe.show_alert({
+                    message: __('Retry of {0} failed items queued', [r.message.total_failed]),
+                    indicator: 'blue'
+                });
+                frm.reload_doc();
             }
         }
     });
 }
 
+function show_queue_status(frm) {
+    frappe.call({
+        method: 'trustbit_school_book_seller.trustbit_school_book.creation_queue.get_queue_status',
+        args: { docname: frm.doc.name },
+        callback: function(r) {
+            let status = r.message;
+            if (!status || !status.status) return;
+            
+            let waited = frappe.utils.seconds_to_duration(status.waited_seconds);
+            let waited_text = [waited.hours && `${waited.hours}h`, `${waited.minutes || 0}m`, `${waited.seconds || 0}s`].filter(Boolean).join(' ');
+            let message = status.status === 'Queued'
+                ? __('{0} queued: position {1} of {2}, waiting {3}. {4} of {5} creation slots in use.',
+                    [status.job_type, status.position, status.queued, waited_text, status.running, status.limit])
+                : __('{0} running after {1} in the queue.', [status.job_type, waited_text]);
+            frm.dashboard.set_headline_alert(message, status.status === 'Queued' ? 'yellow' : 'blue');
+        }
+    });
+}
+
 // Make template download function global for HTML onclick
 window.download_csv_template = download_csv_template;
@@ -0,0 +1,187 @@
+// Copyright (c) 2024, Trustbit and contributors
+// For license information, please see license.txt
+
+const STOCK_TAKE_METHOD = 'trustbit_school_book_seller.trustbit_school_book.doctype.book_stock_take.book_stock_take';
+
+// Scans are sent in batches of this size, or when scanning pauses
+const SCAN_BATCH_SIZE = 50;
+const SCAN_FLUSH_MS = 3000;
+
+frappe.ui.form.on('Book Stock Take', {
+    setup: function(frm) {
+        frm.set_query('default_warehouse', function() {
+            return { filters: { 'is_group': 0, 'company': frm.doc.company } };
+        });
+    },
+    
+    refresh: function(frm) {
+        if (frm.doc.docstatus === 0 && !frm.is_new()) {
+            frm.add_custom_button(__('Scan Books'), function() {
+                show_scan_dialog(frm);
+            }).addClass('btn-primary');
+            
+            frm.add_custom_button(__('Count Summary'), function() {
+                show_count_summary(frm);
+            });
+        }
+        
+        if (frm.doc.docstatus === 1 && ['Partially Posted', 'Failed'].includes(frm.doc.status)) {
+            frm.add_custom_button(__('Retry Posting'), function() {
+                frappe.call({
+                    method: `${STOCK_TAKE_METHOD}.retry_posting`,
+                    args: { docname: frm.doc.name },
+                    callback: function() { frm.reload_doc(); }
+                });
+            });
+        }
+        
+        if (frm.doc.docstatus > 0 || frm.doc.total_scans) {
+            frm.add_custom_button(__('Variance Report'), function() {
+                frappe.set_route('query-report', 'Stock Take Variance', { stock_take: frm.doc.name });
+            }, __('View'));
+        }
+        
+        if (frm.doc.status === 'Queued') {
+            frm.dashboard.set_headline_alert(__('Posting Stock Reconciliations in the background...'), 'blue');
+        }
+        
+        frappe.realtime.off('book_stock_take_complete');
+        frappe.realtime.on('book_stock_take_complete', function(data) {
+            if (data.docname !== frm.doc.name) return;
+            frappe.show_alert({
+                message: __('{0} Stock Reconciliations posted', [data.stock_reconciliations.length]),
+                indicator: data.failed.length ? 'orange' : 'green'
+            });
+            frm.reload_doc();
+        });
+    }
+});
+
+function show_scan_dialog(frm) {
+    let buffer = [];
+    let sent = 0;
+    let timer = null;
+    
+    let dialog = new frappe.ui.Dialog({
+        title: __('Scan Books'),
+        fields: [
+            {
+                fieldname: 'warehouse',
+                fieldtype: 'Link',
+                label: __('Warehouse'),
+                options: 'Warehouse',
+                default: frm.doc.default_warehouse,
+                get_query: function() {
+                    return { filters: { 'is_group': 0, 'company': frm.doc.company } };
+                }
+            },
+            { fieldname: 'barcode', fieldtype: 'Data', label: __('Barcode'), options: 'Barcode' },
+            { fieldname: 'status', fieldtype: 'HTML' }
+        ],
+        primary_action_label: __('Done'),
+        primary_action: function() {
+            dialog.hide();
+        }
+    });
+    
+    let show_status = function() {
+        dialog.fields_dict.status.$wrapper.html(
+            `<p class="text-muted">${__('{0} scans saved, {1} waiting', [sent, buffer.length])}</p>`
+        );
+    };
+    
+    let flush = function() {
+        clearTimeout(timer);
+        if (!buffer.length) return;
+        
+        let scans = buffer;
+        buffer = [];
+        frappe.call({
+            method: `${STOCK_TAKE_METHOD}.add_scans`,
+            args: { docname: frm.doc.name, scans: scans, device: get_device_id() },
+            callback: function(r) {
+                sent += r.message.accepted;
+                show_status();
+            },
+            error: function() {
+                // Keep the scans for the next batch
+                buffer = scans.concat(buffer);
+                show_status();
+            }
+        });
+    };
+    
+    dialog.fields_dict.barcode.$input.on('keydown', function(e) {
+        if (e.which !== 13) return;
+        e.preventDefault();
+        
+        let barcode = (dialog.get_value('barcode') || '').trim();
+        dialog.set_value('barcode', '');
+        if (!barcode) return;
+        
+        buffer.push({ barcode: barcode, warehouse: dialog.get_value('warehouse') });
+        show_status();
+        
+        if (buffer.length >= SCAN_BATCH_SIZE) {
+            flush();
+        } else {
+            clearTimeout(timer);
+            timer = setTimeout(flush, SCAN_FLUSH_MS);
+        }
+    });
+    
+    dialog.onhide = function() {
+        flush();
+        frm.reload_doc();
+    };
+    
+    dialog.show();
+    show_status();
+    dialog.fields_dict.barcode.$input.focus();
+}
+
+function get_device_id() {
+    let device = localStorage.getItem('book_stock_take_device');
+    if (!device) {
+        device = frappe.session.user + ':' + frappe.utils.get_random(6);
+        localStorage.setItem('book_stock_take_device', device);
+    }
+    return device;
+}
+
+function show_count_summary(frm) {
+    frappe.call({
+        method: `${STOCK_TAKE_METHOD}.get_stock_take_summary`,
+        args: { docname: frm.doc.name },
+        callback: function(r) {
+            let data = r.message;
+            let rows = data.warehouses.map(w => `
+                <tr>
+                    <td>${w.warehouse}</td>
+                    <td class="text-right">${w.items}</td>
+                    <td class="text-right">${w.counted_qty}</td>
+                    <td class="text-right">${w.variance_qty}</td>
+                </tr>
+            `).join('');
+            
+            let msg = `
+                <p>${__('{0} scans, {1} items counted, {2} unknown barcodes', [data.total_scans, data.items_counted, data.unknown_barcodes])}</p>
+                <table class="table table-bordered table-sm">
+                    <thead><tr>
+                        <th>${__('Warehouse')}</th>
+                        <th class="text-right">${__('Items')}</th>
+                        <th class="text-right">${__('Counted')}</th>
+                        <th class="text-right">${__('Variance')}</th>
+                    </tr></thead>
+                    <tbody>${rows}</tbody>
+                </table>
+            `;
+            if (data.unknown.length) {
+                msg += `<p><strong>${__('Unknown Barcodes')}:</strong> ` +
+                    data.unknown.map(d => `${d.barcode} (${d.qty})`).join(', ') + '</p>';
+            }
+            
+            frappe.msgprint({ title: __('Count Summary'), message: msg, wide: true });
+        }
+    });
+}
@@ -0,0 +1,210 @@
+// Copyright (c) 2024, Trustbit and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on('Publication', {
+    refresh: function(frm) {
+        if (frm.is_new()) return;
+        
+        // Derive rates of every draft Book Item Creator from MRP and discounts
+        frm.add_custom_button(__('Apply Discount Rates to Drafts'), function() {
+            apply_discount_rates(frm);
+        });
+        
+        frm.add_custom_button(__('Print Labels'), function() {
+            print_publication_labels(frm);
+        });
+        
+        frm.add_custom_button(__('Import Publisher Invoice'), function() {
+            import_publisher_invoice(frm);
+        });
+    }
+});
+
+function apply_discount_rates(frm) {
+    frappe.call({
+        method: 'trustbit_school_book_seller.trustbit_school_book.rate_engine.preview_publication_rates',
+        args: { publication: frm.doc.name },
+        freeze: true,
+        callback: function(r) {
+            let changes = r.message || [];
+            if (!changes.length) {
+                frappe.msgprint(__('No draft Book Item Creator of this publication needs a rate change.'));
+                return;
+            }
+            
+            frappe.confirm(get_rate_changes_html(changes), function() {
+                frappe.call({
+                    method: 'trustbit_school_book_seller.trustbit_school_book.rate_engine.apply_publication_rates',
+                    args: { publication: frm.doc.name },
+                    callback: function(r) {
+                        frappe.show_alert({ message: r.message.message, indicator: 'blue' });
+                    }
+                });
+            });
+        }
+    });
+    
+    frappe.realtime.off('book_rates_applied');
+    frappe.realtime.on('book_rates_applied', function(data) {
+        if (data.publication !== frm.doc.name) return;
+        frappe.show_alert({
+            message: __('Rates updated on {0} rows across {1} drafts', [data.updated, data.documents]),
+            indicator: data.skipped.length ? 'orange' : 'green'
+        });
+        if (data.skipped.length) {
+            frappe.msgprint({
+                title: __('Rows Not Updated'),
+                message: __('These rows would get a rate of 0 or less and were left unchanged:') + '<br>' +
+                    data.skipped.map(row => __('{0} Row {1} ({2})', [
+                        frappe.utils.get_form_link('Book Item Creator', row.parent, true), row.idx, row.class
+                    ])).join('<br>'),
+                indicator: 'orange'
+            });
+        }
+    });
+}
+
+function print_publication_labels(frm) {
+    frappe.prompt({
+        fieldname: 'copies',
+        fieldtype: 'Int',
+        label: __('Copies per Item'),
+        default: 1,
+        reqd: 1
+    }, function(values) {
+        frappe.call({
+            method: 'trustbit_school_book_seller.trustbit_school_book.labels.print_labels',
+            args: { publication: frm.doc.name, copies: values.copies },
+            callback: function(r) {
+                frappe.show_alert({ message: r.message.message, indicator: 'blue' });
+            }
+        });
+    }, __('Print Labels'), __('Generate'));
+    
+    frappe.realtime.off('book_labels_ready');
+    frappe.realtime.on('book_labels_ready', function(data) {
+        frm.reload_doc();
+        frappe.show_alert({
+            message: __('{0} labels attached in {1} file(s)', [data.labels || 0, data.files.length]),
+            indicator: data.files.length ? 'green' : 'orange'
+        });
+    });
+}
+
+function import_publisher_invoice(frm) {
+    let dialog = new frappe.ui.Dialog({
+        title: __('Import Publisher Invoice'),
+        fields: [
+            {
+                fieldname: 'file_url',
+                fieldtype: 'Attach',
+                label: __('Invoice File (CSV or Excel)'),
+                description: __('Columns: ISBN, Quantity, Rate and optionally Invoice No, Class and Title'),
+                reqd: 1
+            },
+            { fieldname: 'supplier', fieldtype: 'Link', label: __('Supplier'), options: 'Supplier', default: frm.doc.supplier, reqd: 1 },
+            { fieldname: 'company', fieldtype: 'Link', label: __('Company'), options: 'Company', default: frappe.defaults.get_user_default('Company'), reqd: 1 },
+            {
+                fieldname: 'warehouse',
+                fieldtype: 'Link',
+                label: __('Warehouse'),
+                options: 'Warehouse',
+                reqd: 1,
+                get_query: function() {
+                    return { filters: { 'is_group': 0, 'company': dialog.get_value('company') } };
+                }
+            },
+            { fieldname: 'invoice_no', fieldtype: 'Data', label: __('Invoice No'), description: __('Used when the file has no Invoice No column') },
+            { fieldname: 'submit', fieldtype: 'Check', label: __('Submit Purchase Receipts') },
+            { fieldname: 'create_draft_for_unknown', fieldtype: 'Check', label: __('Create Book Item Creator Drafts for Unknown ISBNs'), default: 1 }
+        ],
+        primary_action_label: __('Import'),
+        primary_action: function(values) {
+            dialog.hide();
+            frappe.call({
+                method: 'trustbit_school_book_seller.trustbit_school_book.purchase_import.import_publisher_invoice',
+                args: Object.assign({ publication: frm.doc.name }, values),
+                freeze: true,
+                freeze_message: __('Matching ISBNs...'),
+                callback: function(r) {
+                    if (r.message && r.message.queued) {
+                        frappe.show_alert({ message: r.message.message, indicator: 'blue' });
+                    }
+                }
+            });
+        }
+    });
+    dialog.show();
+    
+    frappe.realtime.off('book_invoice_import_complete');
+    frappe.realtime.on('book_invoice_import_complete', function(data) {
+        show_invoice_import_summary(data);
+    });
+}
+
+function show_invoice_import_summary(data) {
+    let msg = __('{0} lines matched into Purchase Receipts: {1}', [
+        data.matched_lines,
+        data.receipts.map(name => frappe.utils.get_form_link('Purchase Receipt', name, true)).join(', ') || __('None')
+    ]);
+    if (data.failed.length) {
+        msg += '<br>' + __('Failed, see Error Log: {0}', [data.failed.map(f => f.invoice_no).join(', ')]);
+    }
+    if (data.invalid.length) {
+        msg += '<br>' + __('{0} rows skipped for an invalid quantity', [data.invalid.length]);
+    }
+    if (data.unknown_count) {
+        msg += '<br>' + __('{0} lines with unknown ISBNs: {1}', [
+            data.unknown_count,
+            data.unknown.slice(0, 20).map(line => line.isbn).join(', ') + (data.unknown_count > 20 ? ' ...' : '')
+        ]);
+        
+        let similar = data.unknown.filter(line => (line.similar || []).length);
+        if (similar.length) {
+            msg += '<br><br>' + __('Possible duplicates already in the catalog:') + '<br>' + similar.map(line => __('{0} looks like {1} ({2})', [
+                line.isbn, line.similar[0].item_name, frappe.utils.get_form_link('Item', line.similar[0].item_code, true)
+            ])).join('<br>');
+        }
+    }
+    if (data.drafts.length) {
+        msg += '<br>' + __('Unknown ISBNs were added to drafts {0}', [
+            data.drafts.map(name => frappe.utils.get_form_link('Book Item Creator', name, true)).join(', ')
+        ]);
+    }
+    if (data.undrafted.length) {
+        msg += '<br><br>' + __('No draft could be created for:') + '<br>' + data.undrafted.map(d => __('{0} ({1}): {2}', [
+            d.title, d.isbns.join(', '), d.error
+        ])).join('<br>');
+    }
+    
+    frappe.msgprint({
+        title: __('Invoice Imported'),
+        message: msg,
+        indicator: data.failed.length || data.unknown_count ? 'orange' : 'green'
+    });
+}
+
+function get_rate_changes_html(changes) {
+    let rows = changes.map(c => `
+        <tr>
+            <td>${c.parent} #${c.idx}</td>
+            <td>${c['class'] || ''}</td>
+            <td>${format_currency(c.mrp)}</td>
+            <td>${format_currency(c.old_rate)} &rarr; ${format_currency(c.rate)}</td>
+            <td>${format_currency(c.old_valuation_rate)} &rarr; ${format_currency(c.valuation_rate)}</td>
+        </tr>
+    `).join('');
+    
+    return `
+        <p>${__('{0} rows will change:', [changes.length])}</p>
+        <div style="max-height: 300px; overflow-y: auto;">
+            <table class="table table-bordered table-sm">
+                <thead><tr>
+                    <th>${__('Draft')}</th><th>${__('Class')}</th><th>${__('MRP')}</th>
+                    <th>${__('Rate')}</th><th>${__('Valuation Rate')}</th>
+                </tr></thead>
+                <tbody>${rows}</tbody>
+            </table>
+        </div>
+    `;
+}
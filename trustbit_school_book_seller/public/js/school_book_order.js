@@ -0,0 +1,71 @@
+// Copyright (c) 2024, Trustbit and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on('School Book Order', {
+    setup: function(frm) {
+        frm.set_query('class', 'titles', function() {
+            return { filters: { 'name': ['in', (frm.doc.classes || []).map(d => d['class'])] } };
+        });
+        
+        frm.set_query('item_code', 'titles', function(doc, cdt, cdn) {
+            let row = locals[cdt][cdn];
+            let filters = { 'disabled': 0, 'custom_book_item_creator': ['is', 'set'] };
+            if (row['class']) filters['custom_class'] = row['class'];
+            if (row.publication) filters['custom_publication'] = row.publication;
+            if (row.subject) filters['custom_subject'] = row.subject;
+            return { filters: filters };
+        });
+        
+        frm.set_query('default_warehouse', function() {
+            return { filters: { 'is_group': 0, 'company': frm.doc.company } };
+        });
+        
+        frm.set_query('selling_price_list', function() {
+            return { filters: { 'selling': 1 } };
+        });
+    },
+    
+    refresh: function(frm) {
+        if (frm.doc.docstatus === 1 && frm.doc.status !== 'Queued') {
+            let sales_orders = [...new Set((frm.doc.titles || []).map(d => d.sales_order).filter(Boolean))];
+            if (sales_orders.length) {
+                frm.add_custom_button(__('Sales Orders'), function() {
+                    frappe.set_route('List', 'Sales Order', { 'name': ['in', sales_orders] });
+                }, __('View'));
+            }
+            
+            if (frm.doc.total_shortfall_qty > 0) {
+                frm.add_custom_button(__('Shortfall Report'), function() {
+                    frappe.set_route('query-report', 'School Order Shortfall', { customer: frm.doc.customer });
+                }, __('View'));
+            }
+        }
+        
+        if (frm.doc.status === 'Queued') {
+            frm.dashboard.set_headline_alert(__('Raising Sales Orders in the background...'), 'blue');
+        }
+        
+        frappe.realtime.off('school_book_order_complete');
+        frappe.realtime.on('school_book_order_complete', function(data) {
+            if (data.docname !== frm.doc.name) return;
+            frappe.show_alert({
+                message: __('{0} Sales Orders raised, shortfall {1}', [data.sales_orders.length, data.shortfall_qty]),
+                indicator: data.failed.length ? 'orange' : 'green'
+            });
+            frm.reload_doc();
+        });
+    }
+});
+
+frappe.ui.form.on('School Book Order Title', {
+    // A changed title has to be resolved again on save
+    'class': function(frm, cdt, cdn) { clear_resolved_item(cdt, cdn); },
+    publication: function(frm, cdt, cdn) { clear_resolved_item(cdt, cdn); },
+    subject: function(frm, cdt, cdn) { clear_resolved_item(cdt, cdn); },
+    book_name: function(frm, cdt, cdn) { clear_resolved_item(cdt, cdn); }
+});
+
+function clear_resolved_item(cdt, cdn) {
+    frappe.model.set_value(cdt, cdn, 'item_code', '');
+    frappe.model.set_value(cdt, cdn, 'resolution', '');
+}
@@ -0,0 +1,85 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.utils import cint
+from trustbit_school_book_seller.trustbit_school_book.season import get_past_seasons
+
+
+# Entries created before this many completed seasons are archived,
+# override with "book_archive_after_seasons" in site config
+ARCHIVE_AFTER_SEASONS = 2
+
+ARCHIVE_BATCH_SIZE = 200
+
+# Statuses after which nothing more happens to an entry
+ARCHIVABLE_STATUSES = ("Completed", "Cancelled")
+
+# Active child table, its archive table and the parentfield rows get there
+ARCHIVE_TABLES = (
+    ("Book Class Detail", "Book Class Detail Archive", "archived_class_details"),
+    ("Book Creation Log", "Book Creation Log Archive", "archived_creation_log"),
+)
+
+
+def archive_book_item_creators():
+    """Scheduled job moving rows of old, finished entries to the archive tables"""
+    count = cint(frappe.conf.get("book_archive_after_seasons")) or ARCHIVE_AFTER_SEASONS
+    seasons = get_past_seasons(count)
+    if len(seasons) < count:
+        return 0
+    
+    cutoff = seasons[-1].year_start_date
+    archived = 0
+    while True:
+        docnames = frappe.get_all(
+            "Book Item Creator",
+            filters={
+                "docstatus": ["in", [1, 2]],
+                "status": ["in", ARCHIVABLE_STATUSES],
+                "is_archived": 0,
+                "creation": ["<", cutoff]
+            },
+            pluck="name",
+            order_by="creation",
+            limit=ARCHIVE_BATCH_SIZE
+        )
+        if not docnames:
+            break
+        
+        archive_batch(docnames)
+        frappe.db.commit()
+        archived += len(docnames)
+    
+    return archived
+
+
+def archive_batch(docnames):
+    """Copy child rows of the given entries to the archive tables and remove them from the active ones"""
+    for doctype, archive_doctype, parentfield in ARCHIVE_TABLES:
+        # Copy the columns both tables share, so fields added to the
+        # active table later do not break archiving
+        archive_columns = set(frappe.db.get_table_columns(archive_doctype))
+        columns = [column for column in frappe.db.get_table_columns(doctype) if column in archive_columns]
+        select = ", ".join("%(parentfield)s" if column == "parentfield" else f"`{column}`" for column in columns)
+        
+        frappe.db.sql(f"""
+            INSERT INTO `tab{archive_doctype}` ({", ".join(f"`{column}`" for column in columns)})
+            SELECT {select}
+            FROM `tab{doctype}`
+            WHERE parenttype = 'Book Item Creator' AND parent IN %(docnames)s
+        """, {"docnames": docnames, "parentfield": parentfield})
+        
+        frappe.db.delete(doctype, {"parenttype": "Book Item Creator", "parent": ["in", docnames]})
+    
+    # Their ISBNs are on the created Items now, the reservations are no longer needed
+    frappe.db.delete("Book ISBN Reservation", {"book_item_creator": ["in", docnames]})
+    
+    frappe.db.sql("""
+        UPDATE `tabBook Item Creator`
+        SET is_archived = 1
+        WHERE name IN %(docnames)s
+    """, {"docnames": docnames})
+    
+    for docname in docnames:
+        frappe.clear_document_cache("Book Item Creator", docname)
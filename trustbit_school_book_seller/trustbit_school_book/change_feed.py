@@ -0,0 +1,123 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import base64
+import json
+
+import frappe
+from frappe import _
+from frappe.utils import cint
+
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 2000
+
+# Start of every stream when no cursor is given
+EPOCH = ("1900-01-01 00:00:00", "")
+
+# Each stream is read with keyset pagination on (modified, name) of its
+# main table, joined to Item to keep only items made by this app
+STREAMS = {
+    "items": {
+        "query": """
+            SELECT
+                i.name, i.item_name, i.item_group, i.stock_uom, i.disabled,
+                i.custom_publication, i.custom_subject, i.custom_class,
+                i.custom_author, i.custom_edition, i.custom_publication_year,
+                i.custom_isbn_barcode, i.modified
+            FROM `tabItem` i
+            WHERE i.custom_book_item_creator IS NOT NULL
+                AND (i.modified > %(modified)s OR (i.modified = %(modified)s AND i.name > %(name)s))
+            ORDER BY i.modified, i.name
+            LIMIT %(limit)s
+        """
+    },
+    "prices": {
+        "query": """
+            SELECT
+                ip.name, ip.item_code, ip.price_list, ip.price_list_rate, ip.currency,
+                ip.selling, ip.buying, ip.valid_from, ip.valid_upto, ip.modified
+            FROM `tabItem Price` ip
+            INNER JOIN `tabItem` i ON i.name = ip.item_code
+            WHERE i.custom_book_item_creator IS NOT NULL
+                AND (ip.modified > %(modified)s OR (ip.modified = %(modified)s AND ip.name > %(name)s))
+            ORDER BY ip.modified, ip.name
+            LIMIT %(limit)s
+        """
+    },
+    "stock": {
+        "query": """
+            SELECT
+                b.name, b.item_code, b.warehouse, b.actual_qty, b.reserved_qty,
+                b.projected_qty, b.modified
+            FROM `tabBin` b
+            INNER JOIN `tabItem` i ON i.name = b.item_code
+            WHERE i.custom_book_item_creator IS NOT NULL
+                AND (b.modified > %(modified)s OR (b.modified = %(modified)s AND b.name > %(name)s))
+            ORDER BY b.modified, b.name
+            LIMIT %(limit)s
+        """
+    },
+    "deleted": {
+        # Deleted Document keeps no link back to the app, so deletions of
+        # any Item or Item Price are reported and downstream ignores unknown
+        # codes. Deleting an Item also drops its prices without a row each.
+        "query": """
+            SELECT
+                dd.name, dd.deleted_doctype, dd.deleted_name,
+                IF(dd.deleted_doctype = 'Item', dd.deleted_name,
+                    JSON_UNQUOTE(JSON_EXTRACT(dd.data, '$.item_code'))) as item_code,
+                dd.creation as modified
+            FROM `tabDeleted Document` dd
+            WHERE dd.deleted_doctype IN ('Item', 'Item Price')
+                AND (dd.creation > %(modified)s OR (dd.creation = %(modified)s AND dd.name > %(name)s))
+            ORDER BY dd.creation, dd.name
+            LIMIT %(limit)s
+        """
+    },
+}
+
+
+@frappe.whitelist()
+def get_book_item_changes(cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Get book items, prices, stock and deletions changed since a cursor"""
+    frappe.has_permission("Item", "read", throw=True)
+    
+    limit = min(max(cint(limit), 1), MAX_PAGE_SIZE)
+    positions = decode_cursor(cursor)
+    response = {"has_more": False}
+    
+    for stream, config in STREAMS.items():
+        modified, name = positions.get(stream) or EPOCH
+        rows = frappe.db.sql(
+            config["query"],
+            {"modified": modified, "name": name, "limit": limit},
+            as_dict=True
+        )
+        
+        if rows:
+            positions[stream] = (str(rows[-1].modified), rows[-1].name)
+        if len(rows) == limit:
+            response["has_more"] = True
+        
+        response[stream] = rows
+    
+    response["cursor"] = encode_cursor(positions)
+    
+    return response
+
+
+def encode_cursor(positions):
+    return base64.urlsafe_b64encode(json.dumps(positions).encode()).decode()
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return {}
+    
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        frappe.throw(_("Invalid change feed cursor"))
+    
+    return {stream: tuple(position) for stream, position in positions.items() if stream in STREAMS}
@@ -0,0 +1,387 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+from collections import Counter
+from datetime import datetime, timedelta
+
+import frappe
+from frappe import _
+from frappe.utils import add_to_date, cint, now_datetime, time_diff_in_seconds
+from frappe.utils.background_jobs import get_redis_conn
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+
+
+# Creation jobs running at once on the site, override with
+# "book_creation_concurrency" in site config
+MAX_CONCURRENT_JOBS = 2
+
+# A queued job counts as this many rows smaller for every minute it has
+# waited, so bulk imports still start while small entries keep arriving
+AGING_ROWS_PER_MINUTE = 50
+
+JOB_TIMEOUT = 4 * 3600
+
+ACTIVE_STATUSES = ("Queued", "Running")
+
+# Row statuses that count as successfully processed
+DONE_STATUSES = ("Created", "Updated", "Unchanged")
+
+# Running jobs record a heartbeat at most this often, in seconds
+HEARTBEAT_INTERVAL = 30
+
+# Running jobs without a heartbeat for this long are taken as stalled,
+# override with "book_creation_stall_minutes" in site config
+STALL_AFTER_MINUTES = 15
+
+# Times a Book Item Creator is resumed after stalling before its
+# unfinished rows are failed instead
+MAX_RESUMES = 3
+
+# Background job states in which the job has not run yet or is still running
+LIVE_RQ_STATUSES = ("queued", "deferred", "scheduled", "started")
+
+
+class CreationJobStopped(Exception):
+    """Raised in a run whose job was taken as stalled and handed to another run, or whose entry was cancelled"""
+
+
+def queue_job(book_item_creator, job_type, rows, user=None):
+    """Add a creation or retry run to the queue, started by the dispatcher once a slot is free"""
+    if frappe.db.exists("Book Creation Job", {"book_item_creator": book_item_creator, "status": ["in", ACTIVE_STATUSES]}):
+        frappe.throw(_("Book Item Creator {0} already has a job queued or running").format(book_item_creator))
+    
+    job = frappe.get_doc({
+        "doctype": "Book Creation Job",
+        "book_item_creator": book_item_creator,
+        "job_type": job_type,
+        "total_rows": rows,
+        "status": "Queued",
+        "user": user or frappe.session.user,
+        "queued_at": now_datetime()
+    })
+    job.insert(ignore_permissions=True)
+    
+    frappe.enqueue(
+        "trustbit_school_book_seller.trustbit_school_book.creation_queue.dispatch",
+        queue="short",
+        enqueue_after_commit=True
+    )
+    
+    return job
+
+
+def dequeue_jobs(book_item_creator):
+    """Drop jobs of a Book Item Creator that have not started yet"""
+    frappe.db.delete("Book Creation Job", {"book_item_creator": book_item_creator, "status": "Queued"})
+
+
+def dispatch():
+    """Start queued jobs while the site is under its concurrency limit"""
+    limit = cint(frappe.conf.get("book_creation_concurrency")) or MAX_CONCURRENT_JOBS
+    
+    # Locking the active jobs makes concurrent dispatchers wait for each
+    # other instead of both filling the same free slot
+    jobs = get_active_jobs(for_update=True)
+    running = [job for job in jobs if job.status == "Running"]
+    queued = order_queue([job for job in jobs if job.status == "Queued"], running)
+    to_start = [job.name for job in queued[:max(limit - len(running), 0)]]
+    
+    if to_start:
+        frappe.db.sql("""
+            UPDATE `tabBook Creation Job`
+            SET status = 'Running', started_at = %(now)s, last_heartbeat = %(now)s
+            WHERE name IN %(jobs)s
+        """, {"jobs": to_start, "now": now_datetime()})
+    frappe.db.commit()
+    
+    for job in to_start:
+        rq_job = frappe.enqueue(
+            "trustbit_school_book_seller.trustbit_school_book.creation_queue.run_job",
+            queue="long",
+            timeout=JOB_TIMEOUT,
+            job=job
+        )
+        if rq_job:
+            frappe.db.set_value("Book Creation Job", job, "rq_job_id", rq_job.id, update_modified=False)
+    frappe.db.commit()
+    
+    return to_start
+
+
+def get_active_jobs(for_update=False):
+    return frappe.db.sql(f"""
+        SELECT name, book_item_creator, job_type, user, total_rows, status, queued_at, started_at
+        FROM `tabBook Creation Job`
+        WHERE status IN %(statuses)s
+        ORDER BY queued_at
+        {"FOR UPDATE" if for_update else ""}
+    """, {"statuses": ACTIVE_STATUSES}, as_dict=True)
+
+
+def order_queue(queued, running):
+    """Queued jobs in start order: users with fewer running jobs first, then the smallest aged job"""
+    now = now_datetime()
+    jobs_per_user = Counter(job.user for job in running)
+    pending = list(queued)
+    ordered = []
+    
+    while pending:
+        job = min(pending, key=lambda job: (
+            jobs_per_user[job.user],
+            cint(job.total_rows) - time_diff_in_seconds(now, job.queued_at) / 60 * AGING_ROWS_PER_MINUTE
+        ))
+        pending.remove(job)
+        ordered.append(job)
+        jobs_per_user[job.user] += 1
+    
+    return ordered
+
+
+def run_job(job):
+    """Run a started job as the user who queued it, then hand its slot on"""
+    job_doc = frappe.get_doc("Book Creation Job", job)
+    if job_doc.status != "Running":
+        return
+    frappe.set_user(job_doc.user)
+    error = None
+    
+    try:
+        doc = frappe.get_doc("Book Item Creator", job_doc.book_item_creator)
+        if doc.docstatus == 2:
+            raise CreationJobStopped(job)
+        doc.flags.creation_job = job
+        if job_doc.job_type == "Retry":
+            doc.retry_items()
+        else:
+            doc.db_set("status", "In Progress", update_modified=False)
+            frappe.db.commit()
+            doc.create_items()
+    except CreationJobStopped:
+        # Either the watchdog handed the entry to a new run, which owns its
+        # status now, or the entry was cancelled and its rollback owns it
+        frappe.db.rollback()
+        error = _("Stopped, the entry was cancelled")
+    except Exception:
+        frappe.db.rollback()
+        error = frappe.get_traceback()
+        frappe.log_error(title=f"Book Creation Job Failed: {job_doc.book_item_creator}", message=error)
+        if job_doc.job_type == "Create":
+            frappe.db.set_value("Book Item Creator", job_doc.book_item_creator, "status", "Failed", update_modified=False)
+    
+    # A job taken as stalled meanwhile was requeued; leave the new run's state alone
+    if frappe.db.get_value("Book Creation Job", job, "status", for_update=True) != "Running":
+        frappe.db.rollback()
+        return
+    
+    frappe.db.set_value("Book Creation Job", job, {
+        "status": "Failed" if error else "Completed",
+        "finished_at": now_datetime(),
+        "error": error
+    }, update_modified=False)
+    frappe.db.commit()
+    
+    frappe.publish_realtime(
+        "book_creation_job_complete",
+        {"docname": job_doc.book_item_creator, "job_type": job_doc.job_type, "failed": bool(error)},
+        user=job_doc.user
+    )
+    
+    dispatch()
+
+
+def record_heartbeat(doc, force=False):
+    """Mark the job running a Book Item Creator as alive; committed with the caller's next commit
+    
+    Raises CreationJobStopped if the job is no longer Running or the entry
+    was cancelled, so the run stops before it writes over the resumed run or
+    creates items the rollback has not seen.
+    """
+    job = doc.flags.creation_job
+    now = now_datetime()
+    if not job or (not force and doc.flags.last_heartbeat and time_diff_in_seconds(now, doc.flags.last_heartbeat) < HEARTBEAT_INTERVAL):
+        return
+    
+    if (
+        frappe.db.get_value("Book Creation Job", job, "status") != "Running"
+        or frappe.db.get_value("Book Item Creator", doc.name, "docstatus") == 2
+    ):
+        raise CreationJobStopped(job)
+    
+    frappe.db.set_value("Book Creation Job", job, "last_heartbeat", now, update_modified=False)
+    doc.flags.last_heartbeat = now
+
+
+def is_job_alive(rq_job_id, stall_minutes):
+    """Whether the background job behind a creation job is waiting or running on a live worker
+    
+    Workers keep the heartbeat of a started job current while it runs, also
+    inside long steps such as submitting the opening Stock Entry.
+    """
+    if not rq_job_id:
+        return False
+    
+    try:
+        rq_job = Job.fetch(rq_job_id, connection=get_redis_conn())
+    except NoSuchJobError:
+        return False
+    
+    status = rq_job.get_status()
+    if status != "started":
+        return status in LIVE_RQ_STATUSES
+    
+    # Job heartbeats are kept in UTC
+    heartbeat = rq_job.last_heartbeat
+    return bool(heartbeat) and heartbeat.replace(tzinfo=None) > datetime.utcnow() - timedelta(minutes=stall_minutes)
+
+
+def recover_stalled_jobs():
+    """Find running jobs whose worker died, reconcile their rows and resume or fail them"""
+    stall_minutes = cint(frappe.conf.get("book_creation_stall_minutes")) or STALL_AFTER_MINUTES
+    silent = frappe.db.sql("""
+        SELECT j.name, j.book_item_creator, j.job_type, j.user, j.rq_job_id, bic.docstatus
+        FROM `tabBook Creation Job` j
+        INNER JOIN `tabBook Item Creator` bic ON bic.name = j.book_item_creator
+        WHERE j.status = 'Running' AND COALESCE(j.last_heartbeat, j.started_at) < %(cutoff)s
+        FOR UPDATE
+    """, {"cutoff": add_to_date(now_datetime(), minutes=-stall_minutes)}, as_dict=True)
+    
+    # A silent job whose worker is still busy, or that is still waiting for one, is only slow
+    stalled = [job for job in silent if not is_job_alive(job.rq_job_id, stall_minutes)]
+    if not stalled:
+        frappe.db.rollback()
+        return []
+    
+    frappe.db.sql("""
+        UPDATE `tabBook Creation Job`
+        SET status = 'Stalled', finished_at = %(now)s, error = %(error)s
+        WHERE name IN %(jobs)s
+    """, {
+        "jobs": [job.name for job in stalled],
+        "now": now_datetime(),
+        "error": _("No heartbeat for {0} minutes, the worker running the job stopped").format(stall_minutes)
+    })
+    
+    # Cancelled entries are being rolled back, so their jobs are only closed
+    stalled = [job for job in stalled if job.docstatus != 2]
+    if not stalled:
+        frappe.db.commit()
+        return []
+    
+    docnames = [job.book_item_creator for job in stalled]
+    reconcile_rows(docnames)
+    
+    stall_counts = dict(frappe.db.sql("""
+        SELECT book_item_creator, COUNT(*)
+        FROM `tabBook Creation Job`
+        WHERE status = 'Stalled' AND book_item_creator IN %(docs)s
+        GROUP BY book_item_creator
+    """, {"docs": docnames}))
+    
+    resumed, failed = [], []
+    for job in stalled:
+        if stall_counts.get(job.book_item_creator, 0) > MAX_RESUMES:
+            failed.append(job.book_item_creator)
+            continue
+        
+        doc = frappe.get_doc("Book Item Creator", job.book_item_creator)
+        pending = [row for row in doc.class_details if row.creation_status not in DONE_STATUSES]
+        failed_rows, stock_rows = doc.get_retry_rows()
+        if job.job_type == "Create" and pending:
+            queue_job(doc.name, "Create", len(pending), user=job.user)
+        elif failed_rows or stock_rows:
+            queue_job(doc.name, "Retry", len(failed_rows) + len(stock_rows), user=job.user)
+        else:
+            doc.db_set("status", "Completed", update_modified=False)
+            continue
+        doc.db_set("status", "Queued", update_modified=False)
+        resumed.append(doc.name)
+    
+    if failed:
+        fail_unfinished_rows(failed)
+    
+    frappe.db.commit()
+    
+    for job in stalled:
+        frappe.publish_realtime(
+            "book_creation_job_complete",
+            {"docname": job.book_item_creator, "job_type": job.job_type, "failed": job.book_item_creator in failed},
+            user=job.user
+        )
+    
+    return resumed
+
+
+def reconcile_rows(docnames):
+    """Settle "Creating" rows of the given entries by whether their Item actually exists
+    
+    Opening stock needs no reconciling: the Stock Entry and the rows linking
+    it are committed together, and created rows without one are posted by the
+    resumed run.
+    """
+    rows = frappe.db.sql("""
+        SELECT bcd.name, i.name as item_code
+        FROM `tabBook Class Detail` bcd
+        LEFT JOIN `tabItem` i ON i.custom_isbn_barcode = bcd.isbn_barcode AND i.custom_book_item_creator = bcd.parent
+        WHERE bcd.parenttype = 'Book Item Creator' AND bcd.parent IN %(docs)s AND bcd.creation_status = 'Creating'
+    """, {"docs": docnames}, as_dict=True)
+    
+    now = now_datetime()
+    updates = {}
+    for row in rows:
+        if row.item_code:
+            updates[row.name] = {
+                "generated_item_code": row.item_code,
+                "item_link": row.item_code,
+                "item_created": 1,
+                "creation_status": "Created",
+                "creation_timestamp": now,
+                "remarks": _("Recovered after the worker stopped")
+            }
+        else:
+            # Not created; the resumed run picks failed rows up again
+            updates[row.name] = {"creation_status": "Failed", "remarks": _("Worker stopped before the item was created")}
+    
+    if updates:
+        frappe.db.bulk_update("Book Class Detail", updates, update_modified=False)
+
+
+def fail_unfinished_rows(docnames):
+    """Give up on entries that keep stalling, leaving failed rows for a manual retry"""
+    frappe.db.sql("""
+        UPDATE `tabBook Class Detail`
+        SET creation_status = 'Failed', remarks = %(remarks)s
+        WHERE parenttype = 'Book Item Creator' AND parent IN %(docs)s
+            AND creation_status IN ('Pending', 'Creating')
+    """, {"docs": docnames, "remarks": _("Stopped after repeated worker failures")})
+    
+    for docname in docnames:
+        created = frappe.db.count("Book Class Detail", {"parent": docname, "creation_status": ["in", DONE_STATUSES]})
+        frappe.db.set_value("Book Item Creator", docname, {
+            "items_created": created,
+            "status": "Partially Created" if created else "Failed"
+        }, update_modified=False)
+
+
+@frappe.whitelist()
+def get_queue_status(docname):
+    """Queue position, depth and wait time of a Book Item Creator's active job"""
+    frappe.has_permission("Book Item Creator", "read", docname, throw=True)
+    
+    jobs = get_active_jobs()
+    active = next((job for job in jobs if job.book_item_creator == docname), None)
+    if not active:
+        return {}
+    
+    running = [job for job in jobs if job.status == "Running"]
+    queued = order_queue([job for job in jobs if job.status == "Queued"], running)
+    
+    return {
+        "status": active.status,
+        "job_type": active.job_type,
+        "position": next((i for i, job in enumerate(queued, 1) if job.name == active.name), 0),
+        "queued": len(queued),
+        "running": len(running),
+        "limit": cint(frappe.conf.get("book_creation_concurrency")) or MAX_CONCURRENT_JOBS,
+        "waited_seconds": cint(time_diff_in_seconds(active.started_at or now_datetime(), active.queued_at))
+    }
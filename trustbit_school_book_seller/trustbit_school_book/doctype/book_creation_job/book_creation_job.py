@@ -0,0 +1,14 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class BookCreationJob(Document):
+    pass
+
+
+def on_doctype_update():
+    # The scheduler reads queued and running jobs on every dispatch
+    frappe.db.add_index("Book Creation Job", ["status", "queued_at"])
@@ -0,0 +1,2 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
@@ -4,16 +4,55 @@
 import frappe
 from frappe import _
 from frappe.model.document import Document
-from frappe.utils import now_datetime, flt, cint
+from frappe.utils import now_datetime, flt, cint, cstr, formatdate, today
+from trustbit_school_book_seller.trustbit_school_book.creation_queue import (
+    ACTIVE_STATUSES, DONE_STATUSES, dequeue_jobs, queue_job, record_heartbeat
+)
+from trustbit_school_book_seller.trustbit_school_book.pricing import get_season_validity
+from trustbit_school_book_seller.trustbit_school_book.report_cache import invalidate_report_cache
+from trustbit_school_book_seller.trustbit_school_book.rollback import enqueue_rollback
+from trustbit_school_book_seller.trustbit_school_book.season import find_season
+from trustbit_school_book_seller.trustbit_school_book.search_index import index_items, get_indexable_items
+from trustbit_school_book_seller.trustbit_school_book.title_index import index_title_keys, find_similar_titles
 import csv
 import os
 
 
+# Item fields derived from the header that are kept in sync when
+# "Update Existing Items" is enabled
+SYNC_ITEM_FIELDS = (
+    "item_name",
+    "item_group",
+    "description",
+    "custom_publication",
+    "custom_subject",
+    "custom_class",
+    "custom_author",
+    "custom_edition",
+    "custom_publication_year",
+    "custom_sales_discount_percent",
+    "custom_purchase_discount_percent",
+)
+
+SYNC_BATCH_SIZE = 100
+
+# Rough cost of each write in seconds, used for the dry-run estimate
+ESTIMATED_SECONDS_PER_WRITE = {
+    "item": 0.4,
+    "item_price": 0.05,
+    "stock_entry": 0.8,
+    "stock_line": 0.05,
+    "sync_row": 0.01,
+}
+
+
 class BookItemCreator(Document):
     def validate(self):
         self.validate_class_details()
-        self.check_duplicate_isbn()
+        existing_items = self.check_duplicate_isbn()
         self.check_duplicate_class()
+        self.check_similar_titles(existing_items)
+        self.validate_stock_distribution()
         self.calculate_totals()
     
     def validate_class_details(self):
@@ -33,36 +72,115 @@ class BookItemCreator(Document):
                 frappe.throw(_("ISBN/Barcode is mandatory in Row {0}").format(row.idx))
     
     def check_duplicate_isbn(self):
-        """Check for duplicate ISBN in existing items and other book creators"""
+        """Check for duplicate ISBN in the document and existing items, then reserve them"""
+        existing_items = self.get_existing_items_by_isbn()
+        rows_by_isbn = {}
+        
         for row in self.class_details:
-            # Check in existing Items
-            existing_item = frappe.db.get_value(
-                "Item", 
-                {"custom_isbn_barcode": row.isbn_barcode}, 
-                ["name", "item_name"],
-                as_dict=True
-            )
-            if existing_item:
+            if row.isbn_barcode in rows_by_isbn:
                 frappe.throw(
-                    _("ISBN/Barcode {0} already exists in Item {1} ({2})").format(
-                        row.isbn_barcode, existing_item.name, existing_item.item_name
+                    _("ISBN/Barcode {0} is repeated in Rows {1} and {2}").format(
+                        row.isbn_barcode, rows_by_isbn[row.isbn_barcode], row.idx
                     )
                 )
+            rows_by_isbn[row.isbn_barcode] = row.idx
             
-            # Check in other submitted Book Item Creators
-            duplicate = frappe.db.sql("""
-                SELECT bic.name, bcd.class
-                FROM `tabBook Class Detail` bcd
-                INNER JOIN `tabBook Item Creator` bic ON bcd.parent = bic.name
-                WHERE bcd.isbn_barcode = %s AND bic.name != %s AND bic.docstatus = 1
-            """, (row.isbn_barcode, self.name), as_dict=True)
-            
-            if duplicate:
+            # In sync mode rows matching an existing Item are updates, not duplicates
+            existing_item = existing_items.get(row.isbn_barcode)
+            if existing_item and not self.update_existing_items:
                 frappe.throw(
-                    _("ISBN/Barcode {0} already used in {1} for {2}").format(
-                        row.isbn_barcode, duplicate[0].name, duplicate[0].get('class')
+                    _("ISBN/Barcode {0} already exists in Item {1} ({2})").format(
+                        row.isbn_barcode, existing_item.name, existing_item.item_name
                     )
                 )
+        
+        self.reserve_isbns(skip=existing_items)
+        
+        return existing_items
+    
+    def reserve_isbns(self, skip=()):
+        """Claim this document's ISBNs in the reservation table in one statement"""
+        # Sorted so concurrent claims lock overlapping ISBNs in the same order
+        rows = sorted(
+            (row for row in self.class_details if row.isbn_barcode and row.isbn_barcode not in skip),
+            key=lambda row: row.isbn_barcode
+        )
+        isbns = [row.isbn_barcode for row in rows]
+        
+        # Release ISBNs that were removed from the document
+        frappe.db.sql("""
+            DELETE FROM `tabBook ISBN Reservation`
+            WHERE book_item_creator = %(docname)s AND name NOT IN %(isbns)s
+        """, {"docname": self.name, "isbns": isbns or [""]})
+        
+        if not rows:
+            return
+        
+        # The ISBN is the primary key, so concurrent claims on the same ISBN
+        # wait on that row only and the loser sees the winner's reservation
+        now = now_datetime()
+        user = frappe.session.user
+        values = []
+        for row in rows:
+            values += [row.isbn_barcode, row.isbn_barcode, self.name, row.get('class'), now, now, user, user]
+        
+        frappe.db.sql("""
+            INSERT INTO `tabBook ISBN Reservation`
+                (name, isbn_barcode, book_item_creator, class, creation, modified, owner, modified_by)
+            VALUES {0}
+            ON DUPLICATE KEY UPDATE
+                class = IF(book_item_creator = VALUES(book_item_creator), VALUES(class), class)
+        """.format(", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * len(rows))), values)
+        
+        conflicts = frappe.db.sql("""
+            SELECT name, book_item_creator, class
+            FROM `tabBook ISBN Reservation`
+            WHERE name IN %(isbns)s AND book_item_creator != %(docname)s
+        """, {"isbns": isbns, "docname": self.name}, as_dict=True)
+        
+        if conflicts:
+            frappe.throw(
+                "<br>".join(
+                    _("ISBN/Barcode {0} already used in {1} for {2}").format(
+                        conflict.name, conflict.book_item_creator, conflict.get('class')
+                    )
+                    for conflict in conflicts
+                ),
+                title=_("ISBN/Barcode Already Reserved")
+            )
+    
+    def release_isbns(self):
+        """Release all ISBNs reserved by this document"""
+        frappe.db.delete("Book ISBN Reservation", {"book_item_creator": self.name})
+    
+    def check_similar_titles(self, existing_items):
+        """Warn about rows whose title is close to a book already in the catalog under another ISBN"""
+        if self.docstatus != 0:
+            return
+        
+        # Items this document matched by ISBN or created itself are not duplicates
+        exclude = {item.name for item in existing_items.values()}
+        exclude.update(row.item_link for row in self.class_details if row.item_link)
+        
+        matches = find_similar_titles([{
+            "publication": self.publication,
+            "subject": self.subject,
+            "class": row.get('class'),
+            "title": self.book_name
+        } for row in self.class_details], exclude)
+        
+        warnings = [
+            _("Row {0}: {1} looks like {2} ({3}), {4}% similar").format(
+                row.idx, row.get('class'), match["item_name"], match["item_code"], cint(match["score"] * 100)
+            )
+            for row, row_matches in zip(self.class_details, matches) for match in row_matches
+        ]
+        if warnings:
+            frappe.msgprint(
+                _("Check these titles are not already in the catalog with a mistyped ISBN:") + "<br>" + "<br>".join(warnings),
+                title=_("Possible Duplicate Books"),
+                indicator="orange"
+            )
     
     def check_duplicate_class(self):
         """Check for duplicate classes in the same document"""
@@ -73,32 +191,265 @@ class BookItemCreator(Document):
                 frappe.throw(_("Duplicate Class {0} in Row {1}").format(class_name, row.idx))
             classes.append(class_name)
     
+    def validate_stock_distribution(self):
+        """Each distribution line must be for a class in the grid and a warehouse other than the default"""
+        classes = {row.get('class') for row in self.class_details}
+        seen = set()
+        
+        for line in self.stock_distribution:
+            if line.get('class') not in classes:
+                frappe.throw(_("Class {0} in Stock Distribution Row {1} is not in Class Details").format(
+                    line.get('class'), line.idx
+                ))
+            if line.warehouse == self.default_warehouse:
+                frappe.throw(_("Stock Distribution Row {0}: enter Default Warehouse stock as Opening Stock on the class row").format(line.idx))
+            if flt(line.qty) <= 0:
+                frappe.throw(_("Qty must be greater than 0 in Stock Distribution Row {0}").format(line.idx))
+            if (line.get('class'), line.warehouse) in seen:
+                frappe.throw(_("Class {0} is distributed to {1} more than once").format(line.get('class'), line.warehouse))
+            seen.add((line.get('class'), line.warehouse))
+    
+    def get_stock_quantities(self, row):
+        """(warehouse, qty) pairs of opening stock for a class row, default warehouse first"""
+        quantities = [(self.default_warehouse, flt(row.opening_stock))] if flt(row.opening_stock) > 0 else []
+        quantities += [
+            (line.warehouse, flt(line.qty)) for line in self.stock_distribution
+            if line.get('class') == row.get('class') and flt(line.qty) > 0
+        ]
+        
+        return quantities
+    
     def calculate_totals(self):
         """Calculate summary totals"""
+        for row in self.class_details:
+            row.amount = sum(qty for warehouse, qty in self.get_stock_quantities(row)) * flt(row.valuation_rate)
+        
         self.total_items_to_create = len(self.class_details)
-        self.total_opening_stock = sum(flt(row.opening_stock) for row in self.class_details)
-        self.total_stock_value = sum(
-            flt(row.opening_stock) * flt(row.valuation_rate) for row in self.class_details
+        self.total_opening_stock = sum(flt(row.opening_stock) for row in self.class_details) + sum(
+            flt(line.qty) for line in self.stock_distribution
         )
+        self.total_stock_value = sum(flt(row.amount) for row in self.class_details)
+    
+    def before_submit(self):
+        """Abort before any writes if a header-level dependency is invalid"""
+        errors = self.get_preflight_errors()
+        if errors:
+            frappe.throw("<br>".join(errors), title=_("Cannot Create Items"))
+    
+    def get_preflight_errors(self):
+        """Validate all linked masters and company/warehouse consistency in batched queries"""
+        errors = []
+        
+        item_group = frappe.db.get_value("Item Group", self.item_group, "is_group")
+        if item_group is None:
+            errors.append(_("Item Group {0} does not exist").format(self.item_group))
+        elif cint(item_group):
+            errors.append(_("Item Group {0} is a group, select a leaf Item Group").format(self.item_group))
+        
+        uom_enabled = frappe.db.get_value("UOM", self.uom, "enabled")
+        if uom_enabled is None:
+            errors.append(_("UOM {0} does not exist").format(self.uom))
+        elif not cint(uom_enabled):
+            errors.append(_("UOM {0} is disabled").format(self.uom))
+        
+        price_lists = {
+            pl.name: pl for pl in frappe.get_all(
+                "Price List",
+                filters={"name": ["in", [self.selling_price_list, self.buying_price_list]]},
+                fields=["name", "enabled", "selling", "buying"]
+            )
+        }
+        for price_list, usage in ((self.selling_price_list, "selling"), (self.buying_price_list, "buying")):
+            if not price_list:
+                continue
+            details = price_lists.get(price_list)
+            if not details:
+                errors.append(_("Price List {0} does not exist").format(price_list))
+            elif not cint(details.enabled):
+                errors.append(_("Price List {0} is disabled").format(price_list))
+            elif not cint(details.get(usage)):
+                errors.append(_("Price List {0} is not a {1} price list").format(price_list, _(usage)))
+        
+        if (self.selling_price_list or self.buying_price_list) and not find_season():
+            errors.append(_("No Fiscal Year covers {0}, create one so Item Prices can be valid for the season").format(
+                formatdate(today())
+            ))
+        
+        if self.hsn_sac_code and frappe.db.exists("DocType", "GST HSN Code"):
+            if not frappe.db.exists("GST HSN Code", self.hsn_sac_code):
+                errors.append(_("HSN/SAC Code {0} does not exist").format(self.hsn_sac_code))
+        
+        row_classes = {row.get('class') for row in self.class_details}
+        classes = {
+            cls.name: cls for cls in frappe.get_all(
+                "Class Master",
+                filters={"name": ["in", list(row_classes)]},
+                fields=["name", "disabled"]
+            )
+        }
+        for class_name in row_classes:
+            if class_name not in classes:
+                errors.append(_("Class {0} does not exist").format(class_name))
+            elif cint(classes[class_name].disabled):
+                errors.append(_("Class {0} is disabled").format(class_name))
+        
+        errors += self.get_warehouse_errors()
+        
+        return errors
+    
+    def get_warehouse_errors(self):
+        """Check that stock can be posted to the warehouses for the default company"""
+        errors = []
+        needs_stock = any(self.get_stock_quantities(row) for row in self.class_details)
+        company = frappe.defaults.get_user_default("Company") or frappe.db.get_single_value(
+            "Global Defaults", "default_company"
+        )
+        
+        if needs_stock and not company:
+            return [_("Set a default Company to post opening stock")]
+        
+        warehouses = self.get_warehouses()
+        details = {
+            wh.name: wh for wh in frappe.get_all(
+                "Warehouse",
+                filters={"name": ["in", warehouses]},
+                fields=["name", "is_group", "disabled", "company"]
+            )
+        }
+        for warehouse in warehouses:
+            wh = details.get(warehouse)
+            if not wh:
+                errors.append(_("Warehouse {0} does not exist").format(warehouse))
+            elif cint(wh.is_group):
+                errors.append(_("Warehouse {0} is a group warehouse").format(warehouse))
+            elif cint(wh.disabled):
+                errors.append(_("Warehouse {0} is disabled").format(warehouse))
+            elif company and wh.company != company:
+                errors.append(
+                    _("Warehouse {0} belongs to {1}, but opening stock is posted for {2}").format(
+                        warehouse, wh.company, company
+                    )
+                )
+        
+        if needs_stock:
+            company_details = frappe.get_cached_value(
+                "Company", company, ["enable_perpetual_inventory", "stock_adjustment_account"], as_dict=True
+            )
+            if company_details and cint(company_details.enable_perpetual_inventory) and not company_details.stock_adjustment_account:
+                errors.append(_("Set a Stock Adjustment Account on Company {0} to post opening stock").format(company))
+        
+        return errors
+    
+    def get_warehouses(self):
+        """Warehouses that receive opening stock"""
+        warehouses = [self.default_warehouse] if self.default_warehouse else []
+        for line in self.stock_distribution:
+            if line.warehouse and line.warehouse not in warehouses:
+                warehouses.append(line.warehouse)
+        
+        return warehouses
+    
+    def get_creation_plan(self):
+        """Expected writes and duration for creating this document's items"""
+        existing_items = self.get_existing_items_by_isbn() if self.update_existing_items else {}
+        pending_rows = [
+            row for row in self.class_details
+            if row.creation_status not in DONE_STATUSES and row.isbn_barcode not in existing_items
+        ]
+        price_lists = len([pl for pl in (self.selling_price_list, self.buying_price_list) if pl])
+        stock_lines = sum(len(self.get_stock_quantities(row)) for row in pending_rows)
+        
+        writes = {
+            "item": len(pending_rows),
+            "item_price": len(pending_rows) * price_lists,
+            "stock_entry": 1 if stock_lines else 0,
+            "stock_line": stock_lines,
+            "sync_row": len([row for row in self.class_details if row.isbn_barcode in existing_items]),
+        }
+        
+        return {
+            "items_to_create": writes["item"],
+            "items_to_sync": writes["sync_row"],
+            "item_prices": writes["item_price"],
+            "stock_entries": writes["stock_entry"],
+            "stock_lines": writes["stock_line"],
+            "total_writes": sum(writes.values()),
+            "estimated_seconds": round(
+                sum(count * ESTIMATED_SECONDS_PER_WRITE[kind] for kind, count in writes.items()), 1
+            )
+        }
     
     def on_submit(self):
-        """Create items on submit"""
+        """Queue item creation on submit"""
         # BUG FIX: Use db_set with update_modified=False for submitted docs
-        self.db_set("status", "In Progress", update_modified=False)
-        frappe.db.commit()
-        self.create_items()
+        self.db_set("status", "Queued", update_modified=False)
+        invalidate_report_cache(self.publication, self.subject)
+        queue_job(self.name, "Create", len(self.class_details))
+    
+    def before_cancel(self):
+        if self.is_archived:
+            frappe.throw(_("Archived entries cannot be cancelled, their rows have moved to the archive"))
+        # A running job keeps creating items after the rollback has read the rows
+        if frappe.db.exists("Book Creation Job", {"book_item_creator": self.name, "status": ["in", ACTIVE_STATUSES]}):
+            frappe.throw(_("Items are still being created for {0}, cancel once the creation job has finished").format(self.name))
     
     def on_cancel(self):
-        """Handle cancellation"""
+        """Roll back created items, prices and opening stock in the background"""
         # BUG FIX: Use db_set with update_modified=False for submitted docs
-        self.db_set("status", "Cancelled", update_modified=False)
+        self.db_set("status", "Rolling Back", update_modified=False)
+        dequeue_jobs(self.name)
+        self.release_isbns()
+        invalidate_report_cache(self.publication, self.subject)
+        enqueue_rollback(self.name)
+    
+    def on_trash(self):
+        self.release_isbns()
+    
+    def get_class_details(self):
+        """Class detail rows, read from the archive table once the entry is archived"""
+        return self.archived_class_details if self.is_archived else self.class_details
     
     def create_items(self):
-        """Create items for each class detail row"""
-        success_count = 0
+        """Create items for each class detail row not yet processed, so a stalled run can resume"""
+        done_rows = [row for row in self.class_details if row.creation_status in DONE_STATUSES]
+        success_count = len(done_rows)
         failed_count = 0
         
-        for row in self.class_details:
+        # Opening stock of all created items is posted together once the loop is done,
+        # including items an earlier run created without posting their stock
+        stock_rows = [
+            (row.item_link, row) for row in done_rows
+            if row.creation_status == "Created" and row.item_link and not row.stock_entry and self.get_stock_quantities(row)
+        ]
+        rows = [row for row in self.class_details if row.creation_status not in DONE_STATUSES]
+        
+        # Sync mode: rows whose ISBN already exists are updated in one pass
+        existing_items = self.get_existing_items_by_isbn() if self.update_existing_items else {}
+        sync_rows = [row for row in rows if row.isbn_barcode in existing_items]
+        
+        # Committed per batch, so long syncs keep the job's heartbeat current
+        for start in range(0, len(sync_rows), SYNC_BATCH_SIZE):
+            batch = sync_rows[start:start + SYNC_BATCH_SIZE]
+            try:
+                self.sync_existing_items(batch, existing_items)
+                success_count += len(batch)
+            except Exception as e:
+                frappe.db.rollback()
+                frappe.db.bulk_update("Book Class Detail", {
+                    row.name: {"creation_status": "Failed", "remarks": str(e)[:200]}
+                    for row in batch
+                }, update_modified=False)
+                failed_count += len(batch)
+                frappe.log_error(title=f"Book Item Sync Failed: {self.name}", message=frappe.get_traceback())
+            
+            record_heartbeat(self, force=True)
+            frappe.db.commit()
+            self.publish_progress(success_count, failed_count)
+        
+        for row in rows:
+            if row.isbn_barcode in existing_items:
+                continue
+            
             try:
                 # BUG FIX: Use frappe.db.set_value instead of row.db_set
                 frappe.db.set_value("Book Class Detail", row.name, "creation_status", "Creating", update_modified=False)
@@ -122,13 +473,8 @@ class BookItemCreator(Document):
                     except Exception as e:
                         frappe.log_error(f"Price List Error for {item.name}: {str(e)}")
                     
-                    # Create stock entry if opening stock > 0
-                    if flt(row.opening_stock) > 0:
-                        try:
-                            stock_entry = self.create_stock_entry(item.name, row)
-                            frappe.db.set_value("Book Class Detail", row.name, "stock_entry_created", 1, update_modified=False)
-                        except Exception as e:
-                            frappe.log_error(f"Stock Entry Error for {item.name}: {str(e)}")
+                    if self.get_stock_quantities(row):
+                        stock_rows.append((item.name, row))
                     
                     success_count += 1
                 else:
@@ -137,7 +483,7 @@ class BookItemCreator(Document):
                         "remarks": "Item creation returned None"
                     }, update_modified=False)
                     failed_count += 1
-                    
+            
             except Exception as e:
                 frappe.db.set_value("Book Class Detail", row.name, {
                     "creation_status": "Failed",
@@ -146,24 +492,18 @@ class BookItemCreator(Document):
                 failed_count += 1
                 frappe.log_error(title=f"Book Item Creation Failed: {self.name}", message=str(e))
             
+            record_heartbeat(self)
             frappe.db.commit()
             
             # Publish realtime progress
-            frappe.publish_realtime(
-                "book_item_creation_progress",
-                {
-                    "docname": self.name,
-                    "current": success_count + failed_count,
-                    "total": len(self.class_details),
-                    "success": success_count,
-                    "failed": failed_count
-                },
-                user=frappe.session.user
-            )
+            self.publish_progress(success_count, failed_count)
+        
+        stock_posted = self.post_opening_stock(stock_rows) or not stock_rows
+        record_heartbeat(self, force=True)
         
         # Update final status
         # BUG FIX: Use frappe.db.set_value for submitted documents
-        if failed_count == 0:
+        if failed_count == 0 and stock_posted:
             final_status = "Completed"
         elif success_count == 0:
             final_status = "Failed"
@@ -174,6 +514,7 @@ class BookItemCreator(Document):
             "items_created": success_count,
             "status": final_status
         }, update_modified=False)
+        invalidate_report_cache(self.publication, self.subject)
         
         frappe.db.commit()
         
@@ -183,35 +524,248 @@ class BookItemCreator(Document):
             "total": len(self.class_details)
         }
     
-    def create_single_item(self, row):
-        """Create a single item from class detail row"""
-        publication_name = frappe.db.get_value("Publication", self.publication, "publication_name")
+    def publish_progress(self, success_count, failed_count):
+        """Publish realtime creation progress to the submitting user"""
+        frappe.publish_realtime(
+            "book_item_creation_progress",
+            {
+                "docname": self.name,
+                "current": success_count + failed_count,
+                "total": len(self.class_details),
+                "success": success_count,
+                "failed": failed_count
+            },
+            user=frappe.session.user
+        )
+    
+    def get_retry_rows(self):
+        """Failed rows, and created rows whose opening stock could not be posted"""
+        failed_rows = [row for row in self.class_details if row.creation_status == "Failed"]
+        stock_rows = [
+            (row.item_link, row) for row in self.class_details
+            if row.creation_status == "Created" and row.item_link and not row.stock_entry and self.get_stock_quantities(row)
+        ]
+        
+        return failed_rows, stock_rows
+    
+    def retry_items(self):
+        """Retry creating failed items and posting missing opening stock"""
+        failed_rows, stock_rows = self.get_retry_rows()
+        
+        success_count = 0
+        
+        for row in failed_rows:
+            try:
+                item = self.create_single_item(row)
+                if item:
+                    # BUG FIX: Use frappe.db.set_value for submitted docs
+                    frappe.db.set_value("Book Class Detail", row.name, {
+                        "generated_item_code": item.name,
+                        "item_link": item.name,
+                        "item_created": 1,
+                        "creation_status": "Created",
+                        "creation_timestamp": now_datetime(),
+                        "remarks": "Created on retry"
+                    }, update_modified=False)
+                    
+                    # Create price list entries
+                    self.create_price_list_entries(item.name, row)
+                    
+                    if self.get_stock_quantities(row):
+                        stock_rows.append((item.name, row))
+                    
+                    success_count += 1
+            except Exception as e:
+                frappe.db.set_value("Book Class Detail", row.name, "remarks", f"Retry failed: {str(e)[:150]}", update_modified=False)
+            
+            # Committed per row like create_items, so a stalled retry keeps what it created
+            record_heartbeat(self)
+            frappe.db.commit()
+        
+        stock_posted = self.post_opening_stock(stock_rows) or not stock_rows
+        record_heartbeat(self, force=True)
+        
+        # Update counts
+        total_created = frappe.db.count("Book Class Detail", {"parent": self.name, "creation_status": ["in", DONE_STATUSES]})
+        total_rows = len(self.class_details)
+        
+        if total_created == total_rows and stock_posted:
+            new_status = "Completed"
+        elif total_created > 0:
+            new_status = "Partially Created"
+        else:
+            new_status = "Failed"
+        
+        frappe.db.set_value("Book Item Creator", self.name, {
+            "items_created": total_created,
+            "status": new_status
+        }, update_modified=False)
+        invalidate_report_cache(self.publication, self.subject)
+        
+        frappe.db.commit()
+        
+        return {"success": success_count, "total_failed": len(failed_rows)}
+    
+    def get_item_values(self, row):
+        """Get Item field values derived from the header and a class detail row"""
+        publication_name = frappe.get_cached_value("Publication", self.publication, "publication_name")
         class_name = row.get('class')
         
         # Generate item name: Publication Book Class
         item_name = f"{publication_name} {self.book_name} {class_name}"
         
-        # Create item
-        item = frappe.get_doc({
-            "doctype": "Item",
+        return {
             "item_name": item_name,
             "item_group": self.item_group,
-            "stock_uom": self.uom,
-            "is_stock_item": 1,
-            "include_item_in_manufacturing": 0,
-            "default_warehouse": self.default_warehouse,
             "description": f"{item_name} - {self.subject}",
-            
-            # Custom fields
             "custom_publication": self.publication,
             "custom_subject": self.subject,
             "custom_class": class_name,
             "custom_author": self.author,
             "custom_edition": self.edition,
             "custom_publication_year": self.publication_year,
-            "custom_isbn_barcode": row.isbn_barcode,
             "custom_sales_discount_percent": self.sales_discount_percent,
             "custom_purchase_discount_percent": self.purchase_discount_percent,
+        }
+    
+    def get_existing_items_by_isbn(self):
+        """Get existing Items keyed by ISBN for all rows in one query"""
+        isbns = list({row.isbn_barcode for row in self.class_details if row.isbn_barcode})
+        if not isbns:
+            return {}
+        
+        fields = ["name", "custom_isbn_barcode", *SYNC_ITEM_FIELDS]
+        if self.hsn_sac_code and frappe.get_meta("Item").has_field("gst_hsn_code"):
+            fields.append("gst_hsn_code")
+        
+        items = frappe.get_all(
+            "Item",
+            filters={"custom_isbn_barcode": ["in", isbns]},
+            fields=fields
+        )
+        return {item.custom_isbn_barcode: item for item in items}
+    
+    def sync_existing_items(self, rows, existing_items):
+        """Update Items matched by ISBN, writing only the fields that changed"""
+        item_codes = [existing_items[row.isbn_barcode].name for row in rows]
+        
+        # This season's Item Prices for both price lists, keyed by (item_code, price_list);
+        # earlier seasons keep their rates and get a new season price instead
+        price_lists = [pl for pl in (self.selling_price_list, self.buying_price_list) if pl]
+        current_prices = {}
+        for price in frappe.get_all(
+            "Item Price",
+            filters={
+                "item_code": ["in", item_codes],
+                "price_list": ["in", price_lists],
+                "valid_from": self.get_price_validity()["valid_from"]
+            },
+            fields=["name", "item_code", "price_list", "price_list_rate"],
+            order_by="creation desc"
+        ):
+            current_prices.setdefault((price.item_code, price.price_list), price)
+        
+        # Existing barcodes per item
+        barcodes = {}
+        for barcode in frappe.get_all(
+            "Item Barcode",
+            filters={"parenttype": "Item", "parent": ["in", item_codes]},
+            fields=["parent", "barcode", "idx"]
+        ):
+            barcodes.setdefault(barcode.parent, {})[barcode.barcode] = barcode.idx
+        
+        item_updates = {}
+        price_updates = {}
+        new_prices = []
+        new_barcodes = []
+        row_updates = {}
+        
+        for row in rows:
+            item = existing_items[row.isbn_barcode]
+            changed = []
+            
+            values = self.get_item_values(row)
+            if "gst_hsn_code" in item:
+                values["gst_hsn_code"] = self.hsn_sac_code
+            
+            item_changes = {
+                field: value for field, value in values.items()
+                if values_differ(item.get(field), value)
+            }
+            if item_changes:
+                item_updates[item.name] = item_changes
+                changed.extend(item_changes)
+            
+            for price_list, rate in (
+                (self.selling_price_list, row.rate),
+                (self.buying_price_list, row.valuation_rate)
+            ):
+                if not price_list:
+                    continue
+                price = current_prices.get((item.name, price_list))
+                if not price:
+                    new_prices.append((item.name, price_list, rate))
+                    changed.append(price_list)
+                elif flt(price.price_list_rate) != flt(rate):
+                    price_updates[price.name] = {"price_list_rate": rate}
+                    changed.append(price_list)
+            
+            item_barcodes = barcodes.get(item.name, {})
+            if row.isbn_barcode not in item_barcodes:
+                new_barcodes.append((item.name, row.isbn_barcode, max(item_barcodes.values(), default=0) + 1))
+                changed.append("barcode")
+            
+            row_updates[row.name] = {
+                "generated_item_code": item.name,
+                "item_link": item.name,
+                "creation_status": "Updated" if changed else "Unchanged",
+                "creation_timestamp": now_datetime(),
+                "remarks": _("Updated: {0}").format(", ".join(changed)) if changed else _("No changes")
+            }
+        
+        if item_updates:
+            frappe.db.bulk_update("Item", item_updates, chunk_size=SYNC_BATCH_SIZE)
+            for item_code in item_updates:
+                frappe.clear_document_cache("Item", item_code)
+            # bulk_update skips Item hooks, so refresh search tokens and title keys here
+            updated_items = get_indexable_items({"name": ["in", list(item_updates)]})
+            index_items(updated_items)
+            index_title_keys(updated_items)
+        if price_updates:
+            frappe.db.bulk_update("Item Price", price_updates, chunk_size=SYNC_BATCH_SIZE)
+        
+        for item_code, price_list, rate in new_prices:
+            self.insert_item_price(item_code, price_list, rate)
+        
+        for item_code, barcode, idx in new_barcodes:
+            frappe.get_doc({
+                "doctype": "Item Barcode",
+                "parenttype": "Item",
+                "parentfield": "barcodes",
+                "parent": item_code,
+                "idx": idx,
+                "barcode": barcode,
+                "barcode_type": ""
+            }).db_insert()
+        
+        frappe.db.bulk_update("Book Class Detail", row_updates, chunk_size=SYNC_BATCH_SIZE, update_modified=False)
+        
+        return {
+            "updated": len([u for u in row_updates.values() if u["creation_status"] == "Updated"]),
+            "unchanged": len([u for u in row_updates.values() if u["creation_status"] == "Unchanged"])
+        }
+    
+    def create_single_item(self, row):
+        """Create a single item from class detail row"""
+        # Create item
+        item = frappe.get_doc({
+            "doctype": "Item",
+            **self.get_item_values(row),
+            "stock_uom": self.uom,
+            "is_stock_item": 1,
+            "include_item_in_manufacturing": 0,
+            "default_warehouse": self.default_warehouse,
+            "custom_isbn_barcode": row.isbn_barcode,
             "custom_book_item_creator": self.name,
             
             # BUG FIX: Use empty string for barcode_type to accept any format
@@ -237,40 +791,81 @@ class BookItemCreator(Document):
         """Create selling and buying price list entries"""
         # Selling Price
         if self.selling_price_list:
-            selling_price = frappe.get_doc({
-                "doctype": "Item Price",
-                "item_code": item_code,
-                "price_list": self.selling_price_list,
-                "price_list_rate": row.rate,
-                "selling": 1
-            })
-            selling_price.insert(ignore_permissions=True)
+            self.insert_item_price(item_code, self.selling_price_list, row.rate)
         
         # Buying Price (using valuation rate)
         if self.buying_price_list:
-            buying_price = frappe.get_doc({
-                "doctype": "Item Price",
-                "item_code": item_code,
-                "price_list": self.buying_price_list,
-                "price_list_rate": row.valuation_rate,
-                "buying": 1
-            })
-            buying_price.insert(ignore_permissions=True)
+            self.insert_item_price(item_code, self.buying_price_list, row.valuation_rate)
+    
+    def insert_item_price(self, item_code, price_list, rate):
+        """Insert an Item Price for one of the header price lists, valid for the current season"""
+        item_price = frappe.get_doc({
+            "doctype": "Item Price",
+            "item_code": item_code,
+            "price_list": price_list,
+            "price_list_rate": rate,
+            "selling": cint(price_list == self.selling_price_list),
+            "buying": cint(price_list == self.buying_price_list),
+            **self.get_price_validity()
+        })
+        item_price.insert(ignore_permissions=True)
+        
+        return item_price
+    
+    def get_price_validity(self):
+        if not self.flags.price_validity:
+            self.flags.price_validity = get_season_validity()
+        return self.flags.price_validity
     
-    def create_stock_entry(self, item_code, row):
-        """Create stock entry for opening stock"""
+    def post_opening_stock(self, stock_rows):
+        """Post opening stock of the given (item_code, row) pairs and record the entry on each row"""
+        if not stock_rows:
+            return None
+        
+        record_heartbeat(self, force=True)
+        frappe.db.commit()
+        
+        try:
+            stock_entry = self.create_stock_entry(stock_rows)
+        except Exception as e:
+            frappe.db.rollback()
+            frappe.db.bulk_update("Book Class Detail", {
+                row.name: {"remarks": _("Opening stock not posted: {0}").format(str(e))[:200]}
+                for item_code, row in stock_rows
+            }, update_modified=False)
+            frappe.log_error(title=f"Book Opening Stock Failed: {self.name}", message=frappe.get_traceback())
+            frappe.db.commit()
+            return None
+        
+        # Checked before committing, so a run taken as stalled meanwhile never posts stock twice
+        record_heartbeat(self, force=True)
+        frappe.db.bulk_update("Book Class Detail", {
+            row.name: {"stock_entry_created": 1, "stock_entry": stock_entry.name}
+            for item_code, row in stock_rows
+        }, update_modified=False)
+        frappe.db.commit()
+        
+        return stock_entry
+    
+    def create_stock_entry(self, stock_rows):
+        """Create one Material Receipt with a line per item and warehouse"""
         stock_entry = frappe.get_doc({
             "doctype": "Stock Entry",
             "stock_entry_type": "Material Receipt",
             "posting_date": frappe.utils.today(),
             "posting_time": frappe.utils.nowtime(),
-            "items": [{
-                "item_code": item_code,
-                "qty": row.opening_stock,
-                "t_warehouse": self.default_warehouse,
-                "basic_rate": row.valuation_rate,
-                "allow_zero_valuation_rate": 0
-            }]
+            "remarks": _("Opening stock for {0}").format(self.name),
+            "items": [
+                {
+                    "item_code": item_code,
+                    "qty": qty,
+                    "t_warehouse": warehouse,
+                    "basic_rate": row.valuation_rate,
+                    "allow_zero_valuation_rate": 0
+                }
+                for item_code, row in stock_rows
+                for warehouse, qty in self.get_stock_quantities(row)
+            ]
         })
         stock_entry.insert(ignore_permissions=True)
         stock_entry.submit()
@@ -278,6 +873,13 @@ class BookItemCreator(Document):
         return stock_entry
 
 
+def values_differ(current, new):
+    """Compare a stored field value with a new one, treating numbers numerically"""
+    if isinstance(new, (int, float)):
+        return flt(current) != flt(new)
+    return cstr(current) != cstr(new)
+
+
 # ========== WHITELISTED API FUNCTIONS ==========
 # NOTE: These paths are called from JavaScript
 # The correct path format is: trustbit_school_book_seller.trustbit_school_book.doctype.book_item_creator.book_item_creator.function_name
@@ -325,85 +927,55 @@ def check_isbn_exists(isbn_barcode, exclude_doc=None):
             "item_name": item.item_name
         }
     
-    # Check in submitted Book Item Creators
-    duplicate = frappe.db.sql("""
-        SELECT bic.name, bcd.class
-        FROM `tabBook Class Detail` bcd
-        INNER JOIN `tabBook Item Creator` bic ON bcd.parent = bic.name
-        WHERE bcd.isbn_barcode = %s AND bic.docstatus = 1
-    """, (isbn_barcode,), as_dict=True)
-    
-    if duplicate:
+    # Check in ISBNs reserved by other Book Item Creators
+    reservation = frappe.db.get_value(
+        "Book ISBN Reservation",
+        isbn_barcode,
+        ["book_item_creator", "class"],
+        as_dict=True
+    )
+    if reservation and reservation.book_item_creator != exclude_doc:
         return {
             "exists": True,
             "type": "Book Item Creator",
-            "name": duplicate[0].name,
-            "class": duplicate[0].get('class')
+            "name": reservation.book_item_creator,
+            "class": reservation.get('class')
         }
     
     return {"exists": False}
 
 
+@frappe.whitelist()
+def dry_run(docname):
+    """Run the pre-flight checks and report expected writes without creating anything"""
+    doc = frappe.get_doc("Book Item Creator", docname)
+    doc.check_permission("read")
+    
+    errors = doc.get_preflight_errors()
+    
+    return {
+        "ok": not errors,
+        "errors": errors,
+        **doc.get_creation_plan()
+    }
+
+
 @frappe.whitelist()
 def retry_failed_items(docname):
-    """Retry creating failed items"""
+    """Queue a retry of failed items"""
     doc = frappe.get_doc("Book Item Creator", docname)
+    doc.check_permission("submit")
     
     if doc.docstatus != 1:
         frappe.throw(_("Document must be submitted to retry"))
     
-    failed_rows = [row for row in doc.class_details if row.creation_status == "Failed"]
-    
-    if not failed_rows:
+    failed_rows, stock_rows = doc.get_retry_rows()
+    if not failed_rows and not stock_rows:
         frappe.throw(_("No failed items to retry"))
     
-    success_count = 0
+    job = queue_job(docname, "Retry", len(failed_rows) + len(stock_rows))
     
-    for row in failed_rows:
-        try:
-            item = doc.create_single_item(row)
-            if item:
-                # BUG FIX: Use frappe.db.set_value for submitted docs
-                frappe.db.set_value("Book Class Detail", row.name, {
-                    "generated_item_code": item.name,
-                    "item_link": item.name,
-                    "item_created": 1,
-                    "creation_status": "Created",
-                    "creation_timestamp": now_datetime(),
-                    "remarks": "Created on retry"
-                }, update_modified=False)
-                
-                # Create price list entries
-                doc.create_price_list_entries(item.name, row)
-                
-                # Create stock entry if needed
-                if flt(row.opening_stock) > 0:
-                    doc.create_stock_entry(item.name, row)
-                    frappe.db.set_value("Book Class Detail", row.name, "stock_entry_created", 1, update_modified=False)
-                
-                success_count += 1
-        except Exception as e:
-            frappe.db.set_value("Book Class Detail", row.name, "remarks", f"Retry failed: {str(e)[:150]}", update_modified=False)
-    
-    # Update counts
-    total_created = frappe.db.count("Book Class Detail", {"parent": docname, "creation_status": "Created"})
-    total_rows = len(doc.class_details)
-    
-    if total_created == total_rows:
-        new_status = "Completed"
-    elif total_created > 0:
-        new_status = "Partially Created"
-    else:
-        new_status = "Failed"
-    
-    frappe.db.set_value("Book Item Creator", docname, {
-        "items_created": total_created,
-        "status": new_status
-    }, update_modified=False)
-    
-    frappe.db.commit()
-    
-    return {"success": success_count, "total_failed": len(failed_rows)}
+    return {"job": job.name, "total_failed": len(failed_rows), "stock_pending": len(stock_rows)}
 
 
 @frappe.whitelist()
@@ -416,9 +988,12 @@ def export_items_to_excel(docname):
     
     # Get created items
     items_data = []
-    for row in doc.class_details:
+    for row in doc.get_class_details():
         if row.creation_status == "Created" and row.generated_item_code:
             item = frappe.get_doc("Item", row.generated_item_code)
+            # Opening stock as posted, distribution lines included
+            quantities = doc.get_stock_quantities(row)
+            opening_stock = sum(qty for warehouse, qty in quantities)
             items_data.append({
                 "Item Code": item.name,
                 "Item Name": item.item_name,
@@ -429,11 +1004,11 @@ def export_items_to_excel(docname):
                 "ISBN/Barcode": row.isbn_barcode,
                 "Selling Rate": row.rate,
                 "Valuation Rate": row.valuation_rate,
-                "Opening Stock": row.opening_stock,
-                "Stock Value": flt(row.opening_stock) * flt(row.valuation_rate),
+                "Opening Stock": opening_stock,
+                "Stock Value": opening_stock * flt(row.valuation_rate),
                 "Item Group": item.item_group,
                 "UOM": item.stock_uom,
-                "Warehouse": doc.default_warehouse,
+                "Warehouse": ", ".join(f"{warehouse}: {qty:g}" for warehouse, qty in quantities) or doc.default_warehouse,
                 "Creation Date": str(row.creation_timestamp) if row.creation_timestamp else ""
             })
     
@@ -464,8 +1039,8 @@ def export_items_to_excel(docname):
 
 
 @frappe.whitelist()
-def parse_csv_file(file_url):
-    """Parse uploaded CSV file for import"""
+def parse_csv_file(file_url, publication=None, subject=None, book_name=None):
+    """Parse uploaded CSV file for import, flagging classes that already have a similar title"""
     try:
         # Get file path
         file_doc = frappe.get_doc("File", {"file_url": file_url})
@@ -500,7 +1075,20 @@ def parse_csv_file(file_url):
                     else:
                         frappe.log_error(f"Class not found: {normalized['class']}")
         
-        return {"success": True, "data": data}
+        similar_titles = []
+        if publication and book_name:
+            matches = find_similar_titles([{
+                "publication": publication,
+                "subject": subject,
+                "class": row['class'],
+                "title": book_name
+            } for row in data])
+            similar_titles = [
+                {"class": row['class'], **match}
+                for row, row_matches in zip(data, matches) for match in row_matches
+            ]
+        
+        return {"success": True, "data": data, "similar_titles": similar_titles}
     
     except Exception as e:
         frappe.log_error(title="CSV Parse Error", message=str(e))
@@ -527,7 +1115,7 @@ def duplicate_book_item_creator(docname):
             setattr(new_doc, field, getattr(source_doc, field))
     
     # Copy class details WITHOUT ISBN (user must enter new ISBNs)
-    for row in source_doc.class_details:
+    for row in source_doc.get_class_details():
         new_row = new_doc.append('class_details')
         new_row.set('class', row.get('class'))
         new_row.rate = row.rate
@@ -536,6 +1124,13 @@ def duplicate_book_item_creator(docname):
         new_row.isbn_barcode = ''  # Clear ISBN - must be unique
         new_row.creation_status = 'Pending'
     
+    for line in source_doc.stock_distribution:
+        new_doc.append('stock_distribution', {
+            'class': line.get('class'),
+            'warehouse': line.warehouse,
+            'qty': line.qty
+        })
+    
     new_doc.status = 'Draft'
     new_doc.items_created = 0
     new_doc.insert(ignore_permissions=True)
@@ -0,0 +1,48 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import cint, flt
+
+
+# Printable page size in mm, portrait
+PAGE_SIZES = {
+    "A4": (210, 297),
+    "A5": (148, 210),
+    "Letter": (215.9, 279.4),
+}
+
+
+class BookLabelSettings(Document):
+    def validate(self):
+        if cint(self.columns) < 1 or cint(self.rows) < 1 or cint(self.max_pages_per_file) < 1:
+            frappe.throw(_("Labels per Row, Rows per Page and Max Pages per File must be at least 1"))
+        
+        page_width, page_height = PAGE_SIZES[self.page_size]
+        used_width = 2 * flt(self.page_margin) + cint(self.columns) * (flt(self.label_width) + flt(self.column_gap))
+        used_height = 2 * flt(self.page_margin) + cint(self.rows) * (flt(self.label_height) + flt(self.row_gap))
+        
+        if used_width > page_width or used_height > page_height:
+            frappe.throw(_("{0} x {1} labels of {2} x {3} mm do not fit on a {4} page").format(
+                self.columns, self.rows, self.label_width, self.label_height, self.page_size
+            ))
+    
+    def get_layout(self):
+        """Plain layout values handed to the label render workers"""
+        return {
+            "page_size": self.page_size,
+            "columns": cint(self.columns),
+            "rows": cint(self.rows),
+            "label_width": flt(self.label_width),
+            "label_height": flt(self.label_height),
+            "page_margin": flt(self.page_margin),
+            "column_gap": flt(self.column_gap),
+            "row_gap": flt(self.row_gap),
+            "barcode_height": flt(self.barcode_height),
+            "font_size": cint(self.font_size),
+            "show_price": cint(self.show_price),
+            "show_class": cint(self.show_class),
+            "show_publication": cint(self.show_publication),
+        }
@@ -0,0 +1,14 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class BookSalesDaily(Document):
+    pass
+
+
+def on_doctype_update():
+    # Report queries filter by date range and group by these
+    frappe.db.add_index("Book Sales Daily", ["posting_date", "publication", "subject", "class"])
@@ -0,0 +1,14 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class BookSearchToken(Document):
+    pass
+
+
+def on_doctype_update():
+    # Prefix lookups read token and item_code straight from this index
+    frappe.db.add_index("Book Search Token", ["token", "item_code"])
@@ -0,0 +1,284 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import json
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import cint, cstr, flt, now_datetime
+
+
+# Scans accepted in one add_scans call; devices send their buffer in batches
+MAX_SCANS_PER_CALL = 5000
+
+# Unknown barcodes listed in the session summary, the rest are only counted
+UNKNOWN_LIST_LIMIT = 100
+
+
+class BookStockTake(Document):
+    def validate(self):
+        if self.docstatus == 0:
+            self.status = "Draft"
+        self.update_summary()
+    
+    def update_summary(self):
+        summary = get_scan_summary(self.name)
+        self.total_scans = summary.total_scans
+        self.items_counted = summary.items_counted
+        self.unknown_barcodes = summary.unknown_barcodes
+        self.variance_qty = sum(abs(flt(row.counted_qty) - flt(row.system_qty)) for row in get_variances(self))
+    
+    def before_submit(self):
+        if not self.total_scans:
+            frappe.throw(_("Scan the counted books before submitting"))
+    
+    def on_submit(self):
+        """Post the Stock Reconciliations in the background"""
+        self.db_set("status", "Queued", update_modified=False)
+        frappe.enqueue(
+            "trustbit_school_book_seller.trustbit_school_book.doctype.book_stock_take.book_stock_take.post_stock_reconciliations",
+            queue="long",
+            timeout=3600,
+            enqueue_after_commit=True,
+            docname=self.name
+        )
+    
+    def before_cancel(self):
+        submitted = frappe.get_all(
+            "Stock Reconciliation",
+            filters={"name": ["in", self.get_stock_reconciliations() or [""]], "docstatus": 1},
+            pluck="name"
+        )
+        if submitted:
+            frappe.throw(_("Cancel the Stock Reconciliations first: {0}").format(", ".join(submitted)))
+    
+    def on_cancel(self):
+        self.db_set("status", "Cancelled", update_modified=False)
+    
+    def on_trash(self):
+        frappe.db.delete("Book Stock Take Scan", {"stock_take": self.name})
+    
+    def get_stock_reconciliations(self):
+        return [row.stock_reconciliation for row in self.warehouses if row.stock_reconciliation]
+
+
+@frappe.whitelist()
+def add_scans(docname, scans, device=None):
+    """Append barcode scans to a draft session in one insert; several devices can scan in parallel
+    
+    Each scan is a barcode, or a dict with barcode and optionally qty and warehouse.
+    """
+    frappe.has_permission("Book Stock Take", "write", docname, throw=True)
+    
+    if isinstance(scans, str):
+        scans = json.loads(scans)
+    if len(scans) > MAX_SCANS_PER_CALL:
+        frappe.throw(_("Send at most {0} scans at a time").format(MAX_SCANS_PER_CALL))
+    
+    # Read without locking the session, so concurrent devices never wait on each other
+    session = frappe.db.get_value(
+        "Book Stock Take", docname, ["docstatus", "company", "default_warehouse"], as_dict=True
+    )
+    if not session or session.docstatus != 0:
+        frappe.throw(_("Stock Take {0} is no longer open for scanning").format(docname))
+    
+    scans = [scan if isinstance(scan, dict) else {"barcode": scan} for scan in scans]
+    warehouses = {scan.get("warehouse") for scan in scans if scan.get("warehouse")}
+    if warehouses:
+        valid = set(frappe.get_all(
+            "Warehouse",
+            filters={"name": ["in", list(warehouses)], "company": session.company, "is_group": 0},
+            pluck="name"
+        ))
+        if warehouses - valid:
+            frappe.throw(_("Warehouses not in {0}: {1}").format(session.company, ", ".join(warehouses - valid)))
+    
+    now = now_datetime()
+    user = frappe.session.user
+    values = []
+    for scan in scans:
+        barcode = cstr(scan.get("barcode")).strip()
+        if barcode:
+            values.append([
+                frappe.generate_hash(length=10), docname, barcode[:140], flt(scan.get("qty", 1)),
+                scan.get("warehouse") or session.default_warehouse, cstr(device)[:140], now, now, user, user
+            ])
+    
+    frappe.db.bulk_insert(
+        "Book Stock Take Scan",
+        ["name", "stock_take", "barcode", "qty", "warehouse", "device", "creation", "modified", "owner", "modified_by"],
+        values
+    )
+    
+    return {"accepted": len(values), "total_scans": frappe.db.count("Book Stock Take Scan", {"stock_take": docname})}
+
+
+@frappe.whitelist()
+def get_stock_take_summary(docname):
+    """Scan totals, counts per warehouse and unknown barcodes of a session"""
+    doc = frappe.get_doc("Book Stock Take", docname)
+    doc.check_permission("read")
+    
+    warehouses = {}
+    for row in get_variances(doc):
+        warehouse = warehouses.setdefault(row.warehouse, {"warehouse": row.warehouse, "items": 0, "counted_qty": 0, "variance_qty": 0})
+        warehouse["items"] += 1
+        warehouse["counted_qty"] += flt(row.counted_qty)
+        warehouse["variance_qty"] += flt(row.counted_qty) - flt(row.system_qty)
+    
+    unknown = frappe.db.sql("""
+        SELECT s.barcode, SUM(s.qty) as qty
+        FROM `tabBook Stock Take Scan` s
+        LEFT JOIN `tabItem` i ON i.custom_isbn_barcode = s.barcode
+        WHERE s.stock_take = %(stock_take)s AND i.name IS NULL
+        GROUP BY s.barcode
+        ORDER BY s.barcode
+        LIMIT %(limit)s
+    """, {"stock_take": docname, "limit": UNKNOWN_LIST_LIMIT}, as_dict=True)
+    
+    return {**get_scan_summary(docname), "warehouses": list(warehouses.values()), "unknown": unknown}
+
+
+def get_scan_summary(docname):
+    summary = frappe.db.sql("""
+        SELECT
+            COUNT(*) as total_scans,
+            COUNT(DISTINCT i.name) as items_counted,
+            COUNT(DISTINCT CASE WHEN i.name IS NULL THEN s.barcode END) as unknown_barcodes
+        FROM `tabBook Stock Take Scan` s
+        LEFT JOIN `tabItem` i ON i.custom_isbn_barcode = s.barcode
+        WHERE s.stock_take = %(stock_take)s
+    """, {"stock_take": docname}, as_dict=True)[0]
+    
+    return frappe._dict({key: cint(value) for key, value in summary.items()})
+
+
+def get_variances(doc):
+    """Counted and system qty per warehouse and item, scans aggregated per ISBN and compared with Bin in one query"""
+    values = {"stock_take": doc.name, "publication": doc.publication}
+    
+    # Scans resolve to items through the unique custom_isbn_barcode index
+    counted = """
+        SELECT s.warehouse, i.name as item_code, SUM(s.qty) as counted_qty
+        FROM `tabBook Stock Take Scan` s
+        INNER JOIN `tabItem` i ON i.custom_isbn_barcode = s.barcode
+        WHERE s.stock_take = %(stock_take)s
+        GROUP BY s.warehouse, i.name
+    """
+    
+    unscanned = ""
+    if doc.zero_unscanned:
+        publication_condition = "AND i.custom_publication = %(publication)s" if doc.publication else ""
+        unscanned = f"""
+            UNION ALL
+            SELECT
+                b.warehouse, b.item_code, i.custom_publication, i.custom_class,
+                0, b.actual_qty, COALESCE(NULLIF(b.valuation_rate, 0), i.valuation_rate, 0)
+            FROM `tabBin` b
+            INNER JOIN `tabItem` i ON i.name = b.item_code
+            LEFT JOIN ({counted}) counts ON counts.warehouse = b.warehouse AND counts.item_code = b.item_code
+            WHERE i.custom_book_item_creator IS NOT NULL AND b.actual_qty != 0 AND counts.item_code IS NULL
+                AND b.warehouse IN (
+                    SELECT DISTINCT warehouse FROM `tabBook Stock Take Scan` WHERE stock_take = %(stock_take)s
+                )
+                {publication_condition}
+        """
+    
+    return frappe.db.sql(f"""
+        SELECT
+            counts.warehouse, counts.item_code, i.custom_publication as publication, i.custom_class as class,
+            counts.counted_qty, COALESCE(b.actual_qty, 0) as system_qty,
+            COALESCE(NULLIF(b.valuation_rate, 0), i.valuation_rate, 0) as valuation_rate
+        FROM ({counted}) counts
+        INNER JOIN `tabItem` i ON i.name = counts.item_code
+        LEFT JOIN `tabBin` b ON b.item_code = counts.item_code AND b.warehouse = counts.warehouse
+        {unscanned}
+    """, values, as_dict=True)
+
+
+def post_stock_reconciliations(docname):
+    """Post one Stock Reconciliation per counted warehouse for the items whose count differs from stock"""
+    doc = frappe.get_doc("Book Stock Take", docname)
+    
+    by_warehouse = {}
+    for row in get_variances(doc):
+        if flt(row.counted_qty) != flt(row.system_qty):
+            by_warehouse.setdefault(row.warehouse, []).append(row)
+    
+    # Warehouses posted by an earlier run keep their reconciliation
+    posted = {row.warehouse: row for row in doc.warehouses if row.stock_reconciliation}
+    frappe.db.delete("Book Stock Take Warehouse", {"parent": docname, "stock_reconciliation": ["is", "not set"]})
+    
+    created, failed = [], []
+    idx = len(posted)
+    for warehouse, rows in sorted(by_warehouse.items()):
+        if warehouse in posted:
+            continue
+        idx += 1
+        
+        result = {
+            "warehouse": warehouse,
+            "items": len(rows),
+            "variance_qty": sum(flt(row.counted_qty) - flt(row.system_qty) for row in rows),
+            "variance_value": sum((flt(row.counted_qty) - flt(row.system_qty)) * flt(row.valuation_rate) for row in rows)
+        }
+        
+        frappe.db.savepoint("book_stock_take_reconciliation")
+        try:
+            reconciliation = frappe.get_doc({
+                "doctype": "Stock Reconciliation",
+                "company": doc.company,
+                "purpose": "Stock Reconciliation",
+                "posting_date": doc.posting_date,
+                "posting_time": doc.posting_time,
+                "set_posting_time": 1,
+                "items": [{
+                    "item_code": row.item_code,
+                    "warehouse": warehouse,
+                    "qty": max(flt(row.counted_qty), 0),
+                    "valuation_rate": row.valuation_rate
+                } for row in rows]
+            })
+            reconciliation.insert()
+            reconciliation.submit()
+            result["stock_reconciliation"] = reconciliation.name
+            created.append(reconciliation.name)
+        except Exception as e:
+            frappe.db.rollback(save_point="book_stock_take_reconciliation")
+            result["error"] = str(e)[:500]
+            failed.append(warehouse)
+            frappe.log_error(title=f"Book Stock Take {docname}: {warehouse}", message=frappe.get_traceback())
+        
+        frappe.get_doc({
+            "doctype": "Book Stock Take Warehouse",
+            "parenttype": "Book Stock Take",
+            "parentfield": "warehouses",
+            "parent": docname,
+            "idx": idx,
+            **result
+        }).db_insert()
+    
+    if failed:
+        status = "Partially Posted" if created or posted else "Failed"
+    else:
+        status = "Posted"
+    frappe.db.set_value("Book Stock Take", docname, "status", status, update_modified=False)
+    frappe.db.commit()
+    
+    summary = {"docname": docname, "stock_reconciliations": created, "failed": failed}
+    frappe.publish_realtime("book_stock_take_complete", summary, user=frappe.session.user)
+    
+    return summary
+
+
+@frappe.whitelist()
+def retry_posting(docname):
+    """Queue the warehouses that failed to post again"""
+    doc = frappe.get_doc("Book Stock Take", docname)
+    doc.check_permission("submit")
+    
+    if doc.docstatus != 1 or doc.status not in ("Partially Posted", "Failed"):
+        frappe.throw(_("Only submitted stock takes that failed to post can be retried"))
+    
+    doc.on_submit()
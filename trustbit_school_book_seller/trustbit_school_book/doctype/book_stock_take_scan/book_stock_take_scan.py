@@ -0,0 +1,14 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class BookStockTakeScan(Document):
+    pass
+
+
+def on_doctype_update():
+    # Counts group the scans of a session by warehouse and barcode
+    frappe.db.add_index("Book Stock Take Scan", ["stock_take", "warehouse", "barcode"])
@@ -0,0 +1,8 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+from frappe.model.document import Document
+
+
+class BookStockTakeWarehouse(Document):
+    pass
@@ -0,0 +1,14 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class BookTitleKey(Document):
+    pass
+
+
+def on_doctype_update():
+    # Duplicate checks read the keys of a publication and class, narrowed by subject when known
+    frappe.db.add_index("Book Title Key", ["publication", "class", "subject"])
@@ -0,0 +1,241 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import cint, flt
+from trustbit_school_book_seller.trustbit_school_book.pricing import get_effective_prices
+
+
+class SchoolBookOrder(Document):
+    def validate(self):
+        self.validate_classes()
+        self.resolve_titles()
+        self.allocate_stock()
+        self.calculate_totals()
+    
+    def validate_classes(self):
+        students = {}
+        for row in self.classes:
+            if row.get("class") in students:
+                frappe.throw(_("Class {0} is repeated in Row {1}").format(row.get("class"), row.idx))
+            students[row.get("class")] = cint(row.students)
+        
+        for row in self.titles:
+            if row.get("class") not in students:
+                frappe.throw(_("Class {0} in booklist Row {1} has no student count").format(row.get("class"), row.idx))
+    
+    def get_students(self):
+        return {row.get("class"): cint(row.students) for row in self.classes}
+    
+    def resolve_titles(self):
+        """Match booklist rows without an item to book items in one grouped query"""
+        rows = [row for row in self.titles if not row.item_code]
+        candidates = get_book_items(rows)
+        
+        for row in rows:
+            matches = candidates.get((row.get("class"), row.publication, row.subject), [])
+            if row.book_name:
+                matches = [item for item in matches if (item.book_name or "").lower() == row.book_name.strip().lower()]
+            
+            if len(matches) == 1:
+                row.item_code = matches[0].name
+                row.resolution = "Resolved"
+            else:
+                row.resolution = "Ambiguous" if matches else "Not Found"
+        
+        for row in self.titles:
+            if row.item_code:
+                row.resolution = "Resolved"
+        
+        prices = get_effective_prices(
+            {row.item_code for row in self.titles if row.item_code}, self.selling_price_list, self.transaction_date
+        )
+        for row in self.titles:
+            row.rate = prices.get(row.item_code, 0)
+    
+    def allocate_stock(self):
+        """Required qty of each title and the warehouse filling it, checked against Bin in one query"""
+        students = self.get_students()
+        warehouses = None if self.split_by_warehouse else [self.default_warehouse]
+        remaining = get_available_stock(
+            {row.item_code for row in self.titles if row.item_code}, self.company, warehouses
+        )
+        
+        for row in self.titles:
+            row.required_qty = flt(students.get(row.get("class"), 0) * flt(row.qty_per_student))
+            stock = remaining.setdefault(row.item_code, {}) if row.item_code else {}
+            
+            # Split orders take each title from the default warehouse if it
+            # covers it, otherwise from the warehouse holding the most
+            warehouse = self.default_warehouse
+            if self.split_by_warehouse and stock and flt(stock.get(warehouse)) < row.required_qty:
+                warehouse = max(stock, key=stock.get)
+            
+            row.warehouse = warehouse
+            row.available_qty = min(max(flt(stock.get(warehouse)), 0), row.required_qty)
+            row.shortfall_qty = row.required_qty - row.available_qty
+            
+            # Titles of the same item across classes draw on the same stock
+            stock[warehouse] = flt(stock.get(warehouse)) - row.available_qty
+    
+    def calculate_totals(self):
+        self.total_qty = sum(flt(row.required_qty) for row in self.titles)
+        self.total_shortfall_qty = sum(flt(row.shortfall_qty) for row in self.titles)
+        self.total_amount = sum(flt(row.required_qty) * flt(row.rate) for row in self.titles)
+    
+    def before_submit(self):
+        unresolved = [
+            _("Row {0}: {1} {2} {3} ({4})").format(row.idx, row.publication, row.subject, row.get("class"), _(row.resolution))
+            for row in self.titles if not row.item_code
+        ]
+        if unresolved:
+            frappe.throw(
+                _("Pick an Item or set the Book Name for these titles:") + "<br>" + "<br>".join(unresolved),
+                title=_("Unresolved Titles")
+            )
+    
+    def on_submit(self):
+        """Raise the Sales Orders in the background"""
+        self.db_set("status", "Queued", update_modified=False)
+        frappe.enqueue(
+            "trustbit_school_book_seller.trustbit_school_book.doctype.school_book_order.school_book_order.make_sales_orders",
+            queue="long",
+            timeout=1800,
+            enqueue_after_commit=True,
+            docname=self.name
+        )
+    
+    def before_cancel(self):
+        submitted = frappe.get_all(
+            "Sales Order",
+            filters={"name": ["in", self.get_sales_orders() or [""]], "docstatus": 1},
+            pluck="name"
+        )
+        if submitted:
+            frappe.throw(_("Cancel the submitted Sales Orders first: {0}").format(", ".join(submitted)))
+    
+    def on_cancel(self):
+        """Delete the draft Sales Orders raised for this order"""
+        for sales_order in self.get_sales_orders():
+            if frappe.db.get_value("Sales Order", sales_order, "docstatus") == 0:
+                frappe.delete_doc("Sales Order", sales_order, ignore_permissions=True)
+        
+        self.db_set("status", "Cancelled", update_modified=False)
+    
+    def get_sales_orders(self):
+        return list({row.sales_order for row in self.titles if row.sales_order})
+
+
+def get_book_items(rows):
+    """Book items per (class, publication, subject) of the given rows, with the book name they were created under"""
+    if not rows:
+        return {}
+    
+    items = frappe.db.sql("""
+        SELECT i.name, i.custom_class, i.custom_publication, i.custom_subject, bic.book_name
+        FROM `tabItem` i
+        LEFT JOIN `tabBook Item Creator` bic ON bic.name = i.custom_book_item_creator
+        WHERE i.custom_book_item_creator IS NOT NULL AND i.disabled = 0
+            AND i.custom_class IN %(classes)s
+            AND i.custom_publication IN %(publications)s
+            AND i.custom_subject IN %(subjects)s
+    """, {
+        "classes": list({row.get("class") for row in rows}),
+        "publications": list({row.publication for row in rows}),
+        "subjects": list({row.subject for row in rows})
+    }, as_dict=True)
+    
+    candidates = {}
+    for item in items:
+        candidates.setdefault((item.custom_class, item.custom_publication, item.custom_subject), []).append(item)
+    
+    return candidates
+
+
+def get_available_stock(item_codes, company, warehouses=None):
+    """Unreserved stock per item and warehouse of the company, from Bin in one query"""
+    if not item_codes:
+        return {}
+    
+    values = {"items": list(item_codes), "company": company}
+    warehouse_condition = ""
+    if warehouses:
+        warehouse_condition = " AND b.warehouse IN %(warehouses)s"
+        values["warehouses"] = warehouses
+    
+    stock = {}
+    for item_code, warehouse, qty in frappe.db.sql(f"""
+        SELECT b.item_code, b.warehouse, b.actual_qty - b.reserved_qty
+        FROM `tabBin` b
+        INNER JOIN `tabWarehouse` w ON w.name = b.warehouse
+        WHERE b.item_code IN %(items)s AND w.company = %(company)s {warehouse_condition}
+    """, values):
+        if flt(qty) > 0:
+            stock.setdefault(item_code, {})[warehouse] = flt(qty)
+    
+    return stock
+
+
+def make_sales_orders(docname):
+    """Raise one draft Sales Order per warehouse for the titles of a submitted School Book Order"""
+    doc = frappe.get_doc("School Book Order", docname)
+    
+    # Stock may have moved since the order was saved
+    doc.allocate_stock()
+    
+    by_warehouse = {}
+    for row in doc.titles:
+        if not row.sales_order and row.item_code and row.required_qty > 0:
+            by_warehouse.setdefault(row.warehouse, []).append(row)
+    
+    updates = {}
+    created, failed = [], []
+    for warehouse, rows in by_warehouse.items():
+        frappe.db.savepoint("school_book_sales_order")
+        try:
+            sales_order = frappe.get_doc({
+                "doctype": "Sales Order",
+                "customer": doc.customer,
+                "company": doc.company,
+                "transaction_date": doc.transaction_date,
+                "delivery_date": doc.delivery_date,
+                "selling_price_list": doc.selling_price_list,
+                "set_warehouse": warehouse,
+                "items": [{
+                    "item_code": row.item_code,
+                    "qty": row.required_qty,
+                    "warehouse": warehouse,
+                    "delivery_date": doc.delivery_date
+                } for row in rows]
+            })
+            sales_order.insert()
+            created.append(sales_order.name)
+            for row in rows:
+                row.sales_order = sales_order.name
+        except Exception:
+            frappe.db.rollback(save_point="school_book_sales_order")
+            failed.append(warehouse)
+            frappe.log_error(title=f"School Book Order {docname}: {warehouse}", message=frappe.get_traceback())
+    
+    for row in doc.titles:
+        updates[row.name] = {
+            "warehouse": row.warehouse,
+            "available_qty": row.available_qty,
+            "shortfall_qty": row.shortfall_qty,
+            "sales_order": row.sales_order
+        }
+    frappe.db.bulk_update("School Book Order Title", updates, update_modified=False)
+    
+    doc.calculate_totals()
+    frappe.db.set_value("School Book Order", docname, {
+        "status": "Failed" if not created and failed else ("Partially Ordered" if failed else "Ordered"),
+        "total_shortfall_qty": doc.total_shortfall_qty
+    }, update_modified=False)
+    frappe.db.commit()
+    
+    summary = {"docname": docname, "sales_orders": created, "failed": failed, "shortfall_qty": doc.total_shortfall_qty}
+    frappe.publish_realtime("school_book_order_complete", summary, user=frappe.session.user)
+    
+    return summary
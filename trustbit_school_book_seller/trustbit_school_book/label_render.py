@@ -0,0 +1,156 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+# Runs inside label worker processes, so it must not import frappe:
+# workers are spawned fresh and only get plain data to render.
+
+from html import escape
+
+import pdfkit
+
+
+CODE128_PATTERNS = (
+    "212222", "222122", "222221", "121223", "121322", "131222", "122213", "122312", "132212", "221213",
+    "221312", "231212", "112232", "122132", "122231", "113222", "123122", "123221", "223211", "221132",
+    "221231", "213212", "223112", "312131", "311222", "321122", "321221", "312212", "322112", "322211",
+    "212123", "212321", "232121", "111323", "131123", "131321", "112313", "132113", "132311", "211313",
+    "231113", "231311", "112133", "112331", "132131", "113123", "113321", "133121", "313121", "211331",
+    "231131", "213113", "213311", "213131", "311123", "311321", "331121", "312113", "312311", "332111",
+    "314111", "221411", "431111", "111224", "111422", "121124", "121421", "141122", "141221", "112214",
+    "112412", "122114", "122411", "142112", "142211", "241211", "221114", "413111", "241112", "134111",
+    "111242", "121142", "121241", "114212", "124112", "124211", "411212", "421112", "421211", "212141",
+    "214121", "412121", "111143", "111341", "131141", "114113", "114311", "411113", "411311", "113141",
+    "114131", "311141", "411131", "211412", "211214", "211232", "2331112",
+)
+CODE128_START_B = 104
+CODE128_START_C = 105
+CODE128_STOP = 106
+
+EAN_L_CODES = (
+    "0001101", "0011001", "0010011", "0111101", "0100011",
+    "0110001", "0101111", "0111011", "0110111", "0001011",
+)
+EAN_R_CODES = tuple(code.translate(str.maketrans("01", "10")) for code in EAN_L_CODES)
+EAN_G_CODES = tuple(code[::-1] for code in EAN_R_CODES)
+EAN_PARITY = (
+    "LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG",
+    "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL",
+)
+
+# Quiet zone either side of a barcode, in modules
+QUIET_ZONE = 10
+
+
+def ean13_checksum(digits):
+    return (10 - sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits[:12])) % 10) % 10
+
+
+def is_ean13(value):
+    return len(value) == 13 and value.isdigit() and ean13_checksum(value) == int(value[12])
+
+
+def ean13_modules(value):
+    """Bar/space modules of a valid EAN-13 (ISBN-13) as a string of 1s and 0s"""
+    parity = EAN_PARITY[int(value[0])]
+    left = "".join(
+        (EAN_L_CODES if parity[i] == "L" else EAN_G_CODES)[int(d)]
+        for i, d in enumerate(value[1:7])
+    )
+    right = "".join(EAN_R_CODES[int(d)] for d in value[7:])
+    
+    return "101" + left + "01010" + right + "101"
+
+
+def code128_modules(value):
+    """Bar/space modules of any printable ASCII value in Code 128 (set C for even digit strings, else B)"""
+    if value.isdigit() and len(value) % 2 == 0:
+        codes = [CODE128_START_C] + [int(value[i:i + 2]) for i in range(0, len(value), 2)]
+    else:
+        codes = [CODE128_START_B] + [ord(char) - 32 for char in value if 32 <= ord(char) < 128]
+    
+    checksum = (codes[0] + sum(i * code for i, code in enumerate(codes[1:], 1))) % 103
+    modules = ""
+    for code in codes + [checksum, CODE128_STOP]:
+        # Patterns alternate bar and space widths, starting with a bar
+        for i, width in enumerate(CODE128_PATTERNS[code]):
+            modules += ("1" if i % 2 == 0 else "0") * int(width)
+    
+    return modules
+
+
+def barcode_svg(value, width_mm, height_mm):
+    """Inline SVG of a barcode scaled to the given box, EAN-13 for valid ISBN-13s"""
+    modules = ean13_modules(value) if is_ean13(value) else code128_modules(value)
+    modules = "0" * QUIET_ZONE + modules + "0" * QUIET_ZONE
+    
+    # One rect per run of bars keeps the SVG small
+    rects = []
+    start = None
+    for i, module in enumerate(modules + "0"):
+        if module == "1" and start is None:
+            start = i
+        elif module == "0" and start is not None:
+            rects.append(f'<rect x="{start}" y="0" width="{i - start}" height="1"/>')
+            start = None
+    
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width_mm}mm" height="{height_mm}mm" '
+        f'viewBox="0 0 {len(modules)} 1" preserveAspectRatio="none">{"".join(rects)}</svg>'
+    )
+
+
+def label_html(label, layout):
+    lines = [f'<div class="name">{escape(label["item_name"] or "")}</div>']
+    details = []
+    if layout["show_publication"] and label.get("publication"):
+        details.append(escape(label["publication"]))
+    if layout["show_class"] and label.get("class"):
+        details.append(escape(label["class"]))
+    if layout["show_price"] and label.get("price"):
+        details.append(f'<b>{escape(label["price"])}</b>')
+    if details:
+        lines.append(f'<div class="details">{" &middot; ".join(details)}</div>')
+    if label.get("isbn_barcode"):
+        lines.append(barcode_svg(label["isbn_barcode"], layout["label_width"] - 4, layout["barcode_height"]))
+        lines.append(f'<div class="code">{escape(label["isbn_barcode"])}</div>')
+    
+    return f'<div class="label">{"".join(lines)}</div>'
+
+
+def labels_page_html(labels, layout):
+    per_page = layout["columns"] * layout["rows"]
+    pages = [labels[i:i + per_page] for i in range(0, len(labels), per_page)]
+    body = "".join(
+        f'<div class="page">{"".join(label_html(label, layout) for label in page)}</div>'
+        for page in pages
+    )
+    
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><style>
+    body {{ margin: 0; font-family: Arial, sans-serif; font-size: {layout["font_size"]}pt; }}
+    .page {{ page-break-after: always; padding: {layout["page_margin"]}mm; }}
+    .page:last-child {{ page-break-after: auto; }}
+    .label {{
+        display: inline-block; vertical-align: top; overflow: hidden; text-align: center;
+        width: {layout["label_width"]}mm; height: {layout["label_height"]}mm;
+        margin: 0 {layout["column_gap"]}mm {layout["row_gap"]}mm 0; padding: 1mm 2mm; box-sizing: border-box;
+    }}
+    .name {{ font-weight: bold; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }}
+    .code {{ font-size: {max(layout["font_size"] - 1, 5)}pt; letter-spacing: 1px; }}
+</style></head><body>{body}</body></html>"""
+
+
+def render_labels_pdf(labels, layout):
+    """Render a chunk of labels to PDF bytes, one page per columns x rows labels"""
+    options = {
+        "page-size": layout["page_size"],
+        "margin-top": "0mm",
+        "margin-bottom": "0mm",
+        "margin-left": "0mm",
+        "margin-right": "0mm",
+        "encoding": "UTF-8",
+        "disable-smart-shrinking": None,
+        "quiet": None,
+    }
+    
+    return pdfkit.from_string(labels_page_html(labels, layout), False, options=options)
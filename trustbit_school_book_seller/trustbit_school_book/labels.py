@@ -0,0 +1,158 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import frappe
+from frappe import _
+from frappe.utils import cint, fmt_money, now_datetime
+from pypdf import PdfWriter
+from trustbit_school_book_seller.trustbit_school_book.label_render import render_labels_pdf
+from trustbit_school_book_seller.trustbit_school_book.pricing import get_effective_price_rows
+
+
+# Pages rendered by one worker task
+PAGES_PER_TASK = 10
+
+# Render processes, override with "book_label_workers" in site config
+MAX_LABEL_WORKERS = 4
+
+# Label filters and the Item column each one applies to
+LABEL_FILTERS = {
+    "book_item_creator": "custom_book_item_creator",
+    "publication": "custom_publication",
+    "subject": "custom_subject",
+    "class": "custom_class",
+    "item_group": "item_group",
+}
+
+
+@frappe.whitelist()
+def print_labels(book_item_creator=None, publication=None, filters=None, copies=1):
+    """Queue a label PDF for the items of a Book Item Creator, a publication or a filter"""
+    frappe.has_permission("Item", "read", throw=True)
+    
+    if isinstance(filters, str):
+        filters = json.loads(filters)
+    filters = {key: value for key, value in (filters or {}).items() if key in LABEL_FILTERS and value}
+    if book_item_creator:
+        filters["book_item_creator"] = book_item_creator
+    if publication:
+        filters["publication"] = publication
+    if not filters:
+        frappe.throw(_("Select a Book Item Creator, a Publication or a filter to print labels for"))
+    
+    frappe.enqueue(
+        "trustbit_school_book_seller.trustbit_school_book.labels.generate_labels",
+        queue="long",
+        timeout=3600,
+        filters=filters,
+        copies=cint(copies) or 1
+    )
+    
+    return {"message": _("Labels are being generated, the PDF will be attached when ready")}
+
+
+def generate_labels(filters, copies=1):
+    """Render label PDFs across a process pool and attach them as Files"""
+    settings = frappe.get_cached_doc("Book Label Settings")
+    layout = settings.get_layout()
+    labels = [label for label in get_label_data(filters, settings.price_list) for _copy in range(copies)]
+    if not labels:
+        frappe.publish_realtime("book_labels_ready", {"files": [], "filters": filters}, user=frappe.session.user)
+        return []
+    
+    labels_per_page = layout["columns"] * layout["rows"]
+    pages_per_task = min(PAGES_PER_TASK, cint(settings.max_pages_per_file))
+    labels_per_task = labels_per_page * pages_per_task
+    tasks = [labels[i:i + labels_per_task] for i in range(0, len(labels), labels_per_task)]
+    tasks_per_file = max(cint(settings.max_pages_per_file) // pages_per_task, 1)
+    parts = [tasks[i:i + tasks_per_file] for i in range(0, len(tasks), tasks_per_file)]
+    
+    attached_to = get_attachment_target(filters)
+    workers = min(cint(frappe.conf.get("book_label_workers")) or MAX_LABEL_WORKERS, os.cpu_count() or 1, len(tasks))
+    files = []
+    
+    # Workers are spawned rather than forked so they do not share this
+    # process's database connection; the render module does not import frappe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for number, part in enumerate(parts, 1):
+            writer = PdfWriter()
+            for pdf in pool.map(render_labels_pdf, part, repeat(layout)):
+                writer.append(io.BytesIO(pdf))
+            
+            output = io.BytesIO()
+            writer.write(output)
+            files.append(save_labels_file(output.getvalue(), number, len(parts), attached_to))
+    
+    frappe.db.commit()
+    frappe.publish_realtime(
+        "book_labels_ready",
+        {"files": files, "labels": len(labels), "filters": filters},
+        user=frappe.session.user
+    )
+    
+    return files
+
+
+def get_label_data(filters, price_list=None):
+    """Name, class, publication, ISBN and formatted selling rate in effect today of every matching item"""
+    price_list = price_list or frappe.db.get_single_value("Selling Settings", "selling_price_list")
+    values = {}
+    conditions = ""
+    for key, column in LABEL_FILTERS.items():
+        if filters.get(key):
+            conditions += f" AND i.{column} = %({key})s"
+            values[key] = filters[key]
+    
+    labels = frappe.db.sql(f"""
+        SELECT
+            i.name as item_code, i.item_name, i.custom_publication as publication,
+            i.custom_class as class, i.custom_isbn_barcode as isbn_barcode
+        FROM `tabItem` i
+        LEFT JOIN `tabClass Master` cm ON cm.name = i.custom_class
+        WHERE i.custom_book_item_creator IS NOT NULL AND i.disabled = 0 {conditions}
+        ORDER BY i.custom_publication, i.custom_subject, cm.sort_order, i.name
+    """, values, as_dict=True)
+    prices = {
+        price.item_code: fmt_money(price.price_list_rate, currency=price.currency)
+        for price in get_effective_price_rows([label.item_code for label in labels], [price_list])
+        if price.price_list_rate
+    }
+    
+    # Workers get plain dicts with the price already formatted
+    return [{
+        "item_name": label.item_name,
+        "publication": label.publication,
+        "class": label.get("class"),
+        "isbn_barcode": label.isbn_barcode,
+        "price": prices.get(label.item_code),
+    } for label in labels]
+
+
+def get_attachment_target(filters):
+    if filters.get("book_item_creator"):
+        return ("Book Item Creator", filters["book_item_creator"])
+    if filters.get("publication"):
+        return ("Publication", filters["publication"])
+    return (None, None)
+
+
+def save_labels_file(content, number, total, attached_to):
+    suffix = f"_part{number}of{total}" if total > 1 else ""
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": f"Book_Labels_{now_datetime().strftime('%Y%m%d_%H%M%S')}{suffix}.pdf",
+        "attached_to_doctype": attached_to[0],
+        "attached_to_name": attached_to[1],
+        "is_private": 1,
+        "content": content
+    })
+    file_doc.insert(ignore_permissions=True)
+    
+    return {"file_url": file_doc.file_url, "file_name": file_doc.file_name}
@@ -0,0 +1,364 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+# Load test for a local bench, run against a scratch site since it creates
+# real Items and stock:
+#
+#   bench --site test.local execute \
+#       trustbit_school_book_seller.trustbit_school_book.load_test.run \
+#       --kwargs "{'scenario': 'season', 'url': 'http://test.local:8000', 'pwd': 'admin'}"
+#
+# Virtual users are threads, each with its own logged-in HTTP session, so
+# requests go through the web workers, MariaDB and Redis like real traffic.
+
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+
+import frappe
+import requests
+from frappe.utils import cint, flt, get_url, random_string
+from trustbit_school_book_seller.trustbit_school_book.label_render import ean13_checksum
+
+
+BOOK_ITEM_CREATOR_METHODS = "trustbit_school_book_seller.trustbit_school_book.doctype.book_item_creator.book_item_creator"
+
+# Preset sizes, any key can be overridden in the run() kwargs
+SCENARIOS = {
+    "smoke": {
+        "users": 2,
+        "iterations": 2,
+        "classes_per_entry": 3,
+        "isbn_lookups": 5,
+        "csv_rows": 20,
+        "duplicate_percent": 0,
+    },
+    "season": {
+        "users": 20,
+        "iterations": 10,
+        "classes_per_entry": 12,
+        "isbn_lookups": 20,
+        "csv_rows": 200,
+        "duplicate_percent": 5,
+    },
+}
+
+REPORTS = ("Book Items Report", "Book Creation Summary")
+
+# InnoDB counters read before and after the run
+LOCK_COUNTERS = ("Innodb_deadlocks", "Innodb_row_lock_waits", "Innodb_row_lock_time")
+
+REQUEST_TIMEOUT = 600
+
+# Creation runs are queued, so outcomes are read once the entries' jobs have
+# finished, or after this many seconds
+OUTCOME_TIMEOUT = 1800
+OUTCOME_POLL_SECONDS = 5
+
+# Entry statuses that leave rows for retry_failed_items
+RETRYABLE_STATUSES = ("Failed", "Partially Created")
+
+
+def run(scenario="smoke", url=None, usr="Administrator", pwd=None, **overrides):
+    """Drive concurrent users against the site and print throughput, latency and lock contention per endpoint"""
+    if scenario not in SCENARIOS:
+        frappe.throw(f"Unknown scenario {scenario}, use one of {', '.join(SCENARIOS)}")
+    
+    config = frappe._dict(SCENARIOS[scenario], **overrides)
+    config.url = (url or get_url()).rstrip("/")
+    config.usr = usr
+    config.pwd = pwd or frappe.conf.get("admin_password")
+    config.masters = get_masters(config)
+    config.file_url = make_csv_file(config)
+    
+    results = []
+    submitted = []
+    known_isbns = []
+    lock = threading.Lock()
+    
+    counters_before = get_lock_counters()
+    started = time.perf_counter()
+    
+    threads = [
+        threading.Thread(target=run_user, args=(config, results, submitted, known_isbns, lock), name=f"load-user-{i}")
+        for i in range(cint(config.users))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    elapsed = time.perf_counter() - started
+    counters_after = get_lock_counters()
+    
+    summary = {
+        "scenario": scenario,
+        "config": {key: value for key, value in config.items() if key not in ("pwd", "masters")},
+        "elapsed_seconds": round(elapsed, 2),
+        "endpoints": summarize(results, elapsed),
+        "lock_counters": {key: counters_after.get(key, 0) - counters_before.get(key, 0) for key in LOCK_COUNTERS},
+        "entries": get_entry_outcomes(submitted),
+    }
+    print_summary(summary)
+    
+    return summary
+
+
+def run_user(config, results, submitted, known_isbns, lock):
+    session = requests.Session()
+    response = session.post(f"{config.url}/api/method/login", json={"usr": config.usr, "pwd": config.pwd}, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    own_entries = []
+    retried = set()
+    
+    for _iteration in range(cint(config.iterations)):
+        with lock:
+            reuse = list(known_isbns)
+        entry = make_entry(config, reuse)
+        
+        result = call(session, config, results, "submit Book Item Creator", "post", "/api/resource/Book Item Creator", entry)
+        docname = result.get("data", {}).get("name") if result else None
+        
+        with lock:
+            known_isbns.extend(row["isbn_barcode"] for row in entry["class_details"])
+            if docname:
+                submitted.append(docname)
+        if docname:
+            own_entries.append(docname)
+        
+        for _lookup in range(cint(config.isbn_lookups)):
+            # Mix of ISBNs that exist and ones that do not
+            isbn = random.choice(reuse) if reuse and random.random() < 0.5 else make_isbn()
+            call(session, config, results, "check_isbn_exists", "post", f"/api/method/{BOOK_ITEM_CREATOR_METHODS}.check_isbn_exists", {
+                "isbn_barcode": isbn,
+                "exclude_doc": docname
+            })
+        
+        call(session, config, results, "parse_csv_file", "post", f"/api/method/{BOOK_ITEM_CREATOR_METHODS}.parse_csv_file", {
+            "file_url": config.file_url
+        })
+        
+        # Only entries whose queued run has left failed rows can be retried
+        for retry_docname in get_retryable_entries(session, config, [name for name in own_entries if name not in retried]):
+            retried.add(retry_docname)
+            call(session, config, results, "retry_failed_items", "post", f"/api/method/{BOOK_ITEM_CREATOR_METHODS}.retry_failed_items", {
+                "docname": retry_docname
+            })
+        
+        for report_name in REPORTS:
+            call(session, config, results, report_name, "post", "/api/method/frappe.desk.query_report.run", {
+                "report_name": report_name,
+                "filters": json.dumps({"publication": config.masters.publication})
+            })
+
+
+def call(session, config, results, endpoint, method, path, payload):
+    """Time one request and record its outcome; returns the decoded response on success"""
+    started = time.perf_counter()
+    error = None
+    body = None
+    try:
+        response = session.request(method, config.url + path, json=payload, timeout=REQUEST_TIMEOUT)
+        body = response.json() if response.content else {}
+        if response.status_code >= 400:
+            error = body.get("exc_type") or f"HTTP {response.status_code}"
+    except (requests.RequestException, ValueError) as e:
+        error = type(e).__name__
+    
+    results.append((endpoint, time.perf_counter() - started, error))
+    
+    return None if error else body
+
+
+def get_retryable_entries(session, config, docnames):
+    """Entries among docnames that finished with failed rows; not timed, it only steers the test"""
+    if not docnames:
+        return []
+    
+    try:
+        response = session.get(f"{config.url}/api/resource/Book Item Creator", params={
+            "filters": json.dumps([["name", "in", docnames], ["status", "in", RETRYABLE_STATUSES]]),
+            "fields": json.dumps(["name"]),
+            "limit_page_length": 0
+        }, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return [row["name"] for row in response.json().get("data", [])]
+    except (requests.RequestException, ValueError):
+        return []
+
+
+def make_entry(config, reuse):
+    masters = config.masters
+    classes = random.sample(masters.classes, min(cint(config.classes_per_entry), len(masters.classes)))
+    
+    rows = []
+    for class_name in classes:
+        duplicate = reuse and random.random() * 100 < flt(config.duplicate_percent)
+        rows.append({
+            "class": class_name,
+            "rate": random.randint(100, 500),
+            "valuation_rate": random.randint(50, 100),
+            "opening_stock": random.randint(0, 50),
+            "isbn_barcode": random.choice(reuse) if duplicate else make_isbn()
+        })
+    
+    return {
+        "doctype": "Book Item Creator",
+        "docstatus": 1,
+        "naming_series": masters.naming_series,
+        "publication": masters.publication,
+        "subject": masters.subject,
+        "book_name": f"Load Test {random_string(8)}",
+        "uom": masters.uom,
+        "item_group": masters.item_group,
+        "default_warehouse": masters.warehouse,
+        "selling_price_list": masters.selling_price_list,
+        "buying_price_list": masters.buying_price_list,
+        "class_details": rows
+    }
+
+
+def make_isbn():
+    digits = "978" + "".join(random.choices("0123456789", k=9))
+    return digits + str(ean13_checksum(digits))
+
+
+def get_masters(config):
+    """Masters the generated entries use, taken from the kwargs or the first usable record"""
+    def pick(key, doctype, filters=None):
+        value = config.get(key) or frappe.db.get_value(doctype, filters or {}, "name", order_by="creation")
+        if not value:
+            frappe.throw(f"No {doctype} found, pass {key} to run()")
+        return value
+    
+    meta = frappe.get_meta("Book Item Creator")
+    
+    return frappe._dict({
+        "naming_series": config.get("naming_series") or (meta.get_field("naming_series").options or "").split("\n")[0],
+        "publication": pick("publication", "Publication"),
+        "subject": pick("subject", "Subject"),
+        "item_group": pick("item_group", "Item Group", {"is_group": 0}),
+        "warehouse": pick("warehouse", "Warehouse", {"is_group": 0}),
+        "uom": config.get("uom") or "Nos",
+        "selling_price_list": pick("selling_price_list", "Price List", {"selling": 1}),
+        "buying_price_list": pick("buying_price_list", "Price List", {"buying": 1}),
+        "classes": frappe.get_all("Class Master", filters={"disabled": 0}, pluck="name", order_by="sort_order"),
+    })
+
+
+def make_csv_file(config):
+    lines = ["Class,Selling Rate,Valuation Rate,ISBN Barcode,Opening Stock"]
+    for i in range(cint(config.csv_rows)):
+        class_name = config.masters.classes[i % len(config.masters.classes)]
+        lines.append(f"{class_name},{random.randint(100, 500)},{random.randint(50, 100)},{make_isbn()},{random.randint(0, 50)}")
+    
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": f"book_load_test_{random_string(6)}.csv",
+        "is_private": 1,
+        "content": "\n".join(lines)
+    })
+    file_doc.insert(ignore_permissions=True)
+    frappe.db.commit()
+    
+    return file_doc.file_url
+
+
+def get_lock_counters():
+    return {
+        name: flt(value)
+        for name, value in frappe.db.sql("SHOW GLOBAL STATUS WHERE Variable_name IN %(names)s", {"names": LOCK_COUNTERS})
+    }
+
+
+def summarize(results, elapsed):
+    by_endpoint = defaultdict(list)
+    for endpoint, latency, error in results:
+        by_endpoint[endpoint].append((latency, error))
+    
+    summary = {}
+    for endpoint, calls in by_endpoint.items():
+        latencies = sorted(latency for latency, _error in calls)
+        errors = defaultdict(int)
+        for _latency, error in calls:
+            if error:
+                errors[error] += 1
+        
+        summary[endpoint] = {
+            "requests": len(calls),
+            "throughput_per_second": round(len(calls) / elapsed, 2) if elapsed else 0,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": round(latencies[-1] * 1000, 1),
+            "error_rate_percent": round(sum(errors.values()) / len(calls) * 100, 2),
+            "errors": dict(errors),
+        }
+    
+    return summary
+
+
+def percentile(sorted_values, percent):
+    index = min(int(round(percent / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return round(sorted_values[index] * 1000, 1)
+
+
+def get_entry_outcomes(docnames):
+    """Final status of the submitted entries and why rows failed inside create_items"""
+    if not docnames:
+        return {}
+    
+    pending = wait_for_creation_jobs(docnames)
+    
+    statuses = frappe.db.sql("""
+        SELECT status, COUNT(*) FROM `tabBook Item Creator`
+        WHERE name IN %(docnames)s
+        GROUP BY status
+    """, {"docnames": docnames})
+    
+    # Row errors are caught and stored in remarks, so lock errors only show up here
+    row_errors = frappe.db.sql("""
+        SELECT LEFT(remarks, 80), COUNT(*) FROM `tabBook Class Detail`
+        WHERE parenttype = 'Book Item Creator' AND parent IN %(docnames)s AND creation_status = 'Failed'
+        GROUP BY LEFT(remarks, 80)
+        ORDER BY COUNT(*) DESC
+    """, {"docnames": docnames})
+    
+    return {"statuses": dict(statuses), "failed_rows": dict(row_errors), "pending_jobs": pending}
+
+
+def wait_for_creation_jobs(docnames):
+    """Wait until no creation job of the entries is queued or running; returns the jobs still active on timeout"""
+    deadline = time.monotonic() + OUTCOME_TIMEOUT
+    while True:
+        # End the transaction so each poll sees the workers' commits
+        frappe.db.rollback()
+        pending = frappe.db.count("Book Creation Job", {
+            "book_item_creator": ["in", docnames],
+            "status": ["in", ("Queued", "Running")]
+        })
+        if not pending or time.monotonic() >= deadline:
+            return pending
+        time.sleep(OUTCOME_POLL_SECONDS)
+
+
+def print_summary(summary):
+    print(f"\nScenario {summary['scenario']}: {summary['elapsed_seconds']}s")
+    print(f"{'Endpoint':<28}{'Reqs':>7}{'Req/s':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'Err %':>8}")
+    for endpoint, stats in summary["endpoints"].items():
+        print(
+            f"{endpoint:<28}{stats['requests']:>7}{stats['throughput_per_second']:>8}"
+            f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['error_rate_percent']:>8}"
+        )
+        for error, count in stats["errors"].items():
+            print(f"    {error}: {count}")
+    
+    print("\nInnoDB during run: " + ", ".join(f"{key} {value:g}" for key, value in summary["lock_counters"].items()))
+    if summary["entries"]:
+        if summary["entries"]["pending_jobs"]:
+            print(f"Creation jobs still queued or running after {OUTCOME_TIMEOUT}s: {summary['entries']['pending_jobs']}")
+        print("Entry statuses: " + ", ".join(f"{status} {count}" for status, count in summary["entries"]["statuses"].items()))
+        for remarks, count in summary["entries"]["failed_rows"].items():
+            print(f"    Failed row: {remarks} ({count})")
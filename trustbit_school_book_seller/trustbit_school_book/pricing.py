@@ -0,0 +1,179 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.utils import add_days, getdate, now_datetime, today
+from trustbit_school_book_seller.trustbit_school_book.report_cache import clear_report_cache
+from trustbit_school_book_seller.trustbit_school_book.season import find_season, get_season
+
+
+# Item Prices are versioned per season: each one is valid from the start
+# to the end of a Fiscal Year, so a new season's rates never overwrite
+# the rates past invoices were made at
+
+SWITCH_OVER_BATCH_SIZE = 1000
+
+ITEM_PRICE_FIELDS = (
+    "name", "item_code", "item_name", "price_list", "price_list_rate", "currency",
+    "uom", "selling", "buying", "valid_from", "valid_upto"
+)
+
+
+def get_season_validity(date=None):
+    """valid_from and valid_upto of Item Prices for the season covering a date"""
+    season = get_season(date)
+    return {"valid_from": season.year_start_date, "valid_upto": season.year_end_date}
+
+
+def get_effective_prices(item_codes, price_list, date=None):
+    """Rate of each item in a price list effective at a date, resolved in one query"""
+    return {
+        price.item_code: price.price_list_rate
+        for price in get_effective_price_rows(item_codes, [price_list], date)
+    }
+
+
+def get_effective_price_rows(item_codes, price_lists, date=None):
+    """Item Price in effect at a date per item and price list
+    
+    Of overlapping prices, the one with the latest valid_from wins, and prices
+    without a validity window only apply where no season price does. Pass None
+    as item_codes to resolve every book item.
+    """
+    price_lists = [price_list for price_list in price_lists if price_list]
+    if (item_codes is not None and not item_codes) or not price_lists:
+        return []
+    
+    values = {"price_lists": price_lists, "date": getdate(date or today())}
+    if item_codes is None:
+        item_condition = "item_code IN (SELECT name FROM `tabItem` WHERE custom_book_item_creator IS NOT NULL)"
+    else:
+        item_condition = "item_code IN %(items)s"
+        values["items"] = list(item_codes)
+    
+    return frappe.db.sql(f"""
+        SELECT {", ".join(ITEM_PRICE_FIELDS)}
+        FROM (
+            SELECT
+                {", ".join(ITEM_PRICE_FIELDS)},
+                ROW_NUMBER() OVER (
+                    PARTITION BY item_code, price_list
+                    ORDER BY valid_from IS NULL, valid_from DESC, modified DESC
+                ) as price_rank
+            FROM `tabItem Price`
+            WHERE {item_condition}
+                AND price_list IN %(price_lists)s
+                AND IFNULL(customer, '') = '' AND IFNULL(supplier, '') = ''
+                AND (valid_from IS NULL OR valid_from <= %(date)s)
+                AND (valid_upto IS NULL OR valid_upto >= %(date)s)
+        ) prices
+        WHERE price_rank = 1
+    """, values, as_dict=True)
+
+
+def switch_over_season_prices(date=None):
+    """Carry last season's book prices into the season of a date
+    
+    Items without a price for the new season get one at the rate in effect on
+    the last day of the previous season, and open-ended prices are closed at
+    that day. Safe to run daily, only missing prices are written.
+    """
+    if not find_season(date):
+        frappe.log_error(
+            title="Season Price Switch-Over Skipped",
+            message=f"No Fiscal Year covers {getdate(date or today())}, create one to carry book prices into it"
+        )
+        return 0
+    
+    validity = get_season_validity(date)
+    last_day = add_days(validity["valid_from"], -1)
+    rebase_open_prices(validity)
+    price_lists = frappe.get_all("Price List", filters={"enabled": 1}, pluck="name")
+    
+    current = {
+        (price.item_code, price.price_list)
+        for price in get_effective_price_rows(None, price_lists, validity["valid_from"])
+        if price.valid_from == validity["valid_from"]
+    }
+    previous = [
+        price for price in get_effective_price_rows(None, price_lists, last_day)
+        if (price.item_code, price.price_list) not in current
+    ]
+    
+    now = now_datetime()
+    user = frappe.session.user
+    for start in range(0, len(previous), SWITCH_OVER_BATCH_SIZE):
+        batch = previous[start:start + SWITCH_OVER_BATCH_SIZE]
+        frappe.db.bulk_insert(
+            "Item Price",
+            [*ITEM_PRICE_FIELDS, "creation", "modified", "owner", "modified_by"],
+            [[
+                frappe.generate_hash(length=10), price.item_code, price.item_name, price.price_list,
+                price.price_list_rate, price.currency, price.uom, price.selling, price.buying,
+                validity["valid_from"], validity["valid_upto"], now, now, user, user
+            ] for price in batch]
+        )
+        
+        # Close the open-ended prices carried forward so they stay on last season
+        open_ended = [price.name for price in batch if not price.valid_upto]
+        if open_ended:
+            frappe.db.sql("""
+                UPDATE `tabItem Price`
+                SET valid_upto = %(last_day)s, modified = %(now)s, modified_by = %(user)s
+                WHERE name IN %(names)s
+            """, {"last_day": last_day, "now": now, "user": user, "names": open_ended})
+        
+        frappe.db.commit()
+    
+    # Prices are written in bulk without Item Price hooks, so cached rates of every book are stale
+    frappe.db.commit()
+    clear_report_cache()
+    
+    return len(previous)
+
+
+def rebase_open_prices(validity):
+    """Turn open-ended prices that started during a season into that season's price
+    
+    Item Price valid_from defaults to the day a price is made, so prices from
+    before seasons were versioned start mid-season and would outrank a season
+    price written later by sync mode. Where the item already has a price in
+    effect at the start of the season, that price is closed the day before the
+    new one starts instead, so each rate keeps the dates it was charged on.
+    """
+    values = {**validity, "now": now_datetime(), "user": frappe.session.user}
+    
+    frappe.db.sql("""
+        UPDATE `tabItem Price` older
+        INNER JOIN (
+            SELECT item_code, price_list, MIN(valid_from) as valid_from
+            FROM `tabItem Price`
+            WHERE valid_upto IS NULL
+                AND valid_from > %(valid_from)s AND valid_from <= %(valid_upto)s
+                AND IFNULL(customer, '') = '' AND IFNULL(supplier, '') = ''
+                AND item_code IN (SELECT name FROM `tabItem` WHERE custom_book_item_creator IS NOT NULL)
+            GROUP BY item_code, price_list
+        ) new ON new.item_code = older.item_code AND new.price_list = older.price_list
+        SET older.valid_upto = DATE_SUB(new.valid_from, INTERVAL 1 DAY),
+            older.modified = %(now)s, older.modified_by = %(user)s
+        WHERE (older.valid_from IS NULL OR older.valid_from <= %(valid_from)s)
+            AND (older.valid_upto IS NULL OR older.valid_upto >= new.valid_from)
+            AND IFNULL(older.customer, '') = '' AND IFNULL(older.supplier, '') = ''
+    """, values)
+    
+    frappe.db.sql("""
+        UPDATE `tabItem Price` ip
+        LEFT JOIN `tabItem Price` older ON older.item_code = ip.item_code
+            AND older.price_list = ip.price_list
+            AND older.name != ip.name
+            AND (older.valid_from IS NULL OR older.valid_from <= %(valid_from)s)
+            AND (older.valid_upto IS NULL OR older.valid_upto >= %(valid_from)s)
+            AND IFNULL(older.customer, '') = '' AND IFNULL(older.supplier, '') = ''
+        SET ip.valid_from = %(valid_from)s, ip.valid_upto = %(valid_upto)s,
+            ip.modified = %(now)s, ip.modified_by = %(user)s
+        WHERE ip.valid_upto IS NULL
+            AND ip.valid_from > %(valid_from)s AND ip.valid_from <= %(valid_upto)s
+            AND IFNULL(ip.customer, '') = '' AND IFNULL(ip.supplier, '') = ''
+            AND older.name IS NULL
+            AND ip.item_code IN (SELECT name FROM `tabItem` WHERE custom_book_item_creator IS NOT NULL)
+    """, values)
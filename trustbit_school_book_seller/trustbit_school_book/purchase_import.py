@@ -0,0 +1,326 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import csv
+import re
+
+import frappe
+from frappe import _
+from frappe.utils import cint, cstr, flt, today
+from openpyxl import load_workbook
+from trustbit_school_book_seller.trustbit_school_book.label_render import ean13_checksum
+from trustbit_school_book_seller.trustbit_school_book.title_index import find_similar_titles, get_title_key
+
+
+# Invoices with more lines than this are imported in a background job
+IMPORT_SYNC_LIMIT = 300
+
+# Unknown ISBNs listed in the import summary, the rest are only counted
+UNKNOWN_LIST_LIMIT = 200
+
+# Header keywords of each invoice column, checked in this order
+INVOICE_COLUMNS = (
+    ("isbn", ("isbn", "barcode", "ean")),
+    ("qty", ("qty", "quantity")),
+    ("mrp", ("mrp", "list price")),
+    ("rate", ("rate", "price", "cost")),
+    ("invoice_no", ("invoice", "bill")),
+    ("class", ("class",)),
+    ("title", ("title", "book", "name", "description")),
+)
+
+
+@frappe.whitelist()
+def import_publisher_invoice(file_url, supplier, company, warehouse, publication=None,
+        invoice_no=None, submit=0, create_draft_for_unknown=0):
+    """Build Purchase Receipts from a publisher invoice file, in the background for large files"""
+    frappe.has_permission("Purchase Receipt", "create", throw=True)
+    if cint(create_draft_for_unknown):
+        frappe.has_permission("Book Item Creator", "create", throw=True)
+    
+    file_doc = frappe.get_doc("File", {"file_url": file_url})
+    kwargs = {
+        "file_url": file_url,
+        "supplier": supplier,
+        "company": company,
+        "warehouse": warehouse,
+        "publication": publication,
+        "invoice_no": invoice_no or file_doc.file_name,
+        "submit": cint(submit),
+        "create_draft_for_unknown": cint(create_draft_for_unknown),
+    }
+    
+    if count_lines(file_doc) > IMPORT_SYNC_LIMIT:
+        frappe.enqueue(
+            "trustbit_school_book_seller.trustbit_school_book.purchase_import.make_purchase_receipts",
+            queue="long",
+            timeout=3600,
+            **kwargs
+        )
+        return {"queued": True, "message": _("Invoice is being imported in the background")}
+    
+    return make_purchase_receipts(**kwargs)
+
+
+def make_purchase_receipts(file_url, supplier, company, warehouse, publication=None,
+        invoice_no=None, submit=0, create_draft_for_unknown=0):
+    """Create one Purchase Receipt per invoice in the file with every line whose ISBN matches a book item"""
+    file_doc = frappe.get_doc("File", {"file_url": file_url})
+    invoices, invalid = read_invoices(file_doc, invoice_no)
+    items = get_items_by_isbn({line.isbn for lines in invoices.values() for line in lines})
+    
+    receipts, failed, unknown = [], [], []
+    for number, lines in invoices.items():
+        matched = [line for line in lines if line.isbn in items]
+        unknown += [line for line in lines if line.isbn not in items]
+        if not matched:
+            continue
+        
+        frappe.db.savepoint("book_invoice_receipt")
+        try:
+            receipt = frappe.get_doc({
+                "doctype": "Purchase Receipt",
+                "supplier": supplier,
+                "company": company,
+                "posting_date": today(),
+                "set_warehouse": warehouse,
+                "supplier_delivery_note": number,
+                "items": [{
+                    "item_code": items[line.isbn].name,
+                    "qty": line.qty,
+                    "rate": line.rate,
+                    "uom": items[line.isbn].stock_uom,
+                    "conversion_factor": 1,
+                    "warehouse": warehouse
+                } for line in matched]
+            })
+            receipt.insert()
+            if submit:
+                receipt.submit()
+            receipts.append(receipt.name)
+        except Exception as e:
+            frappe.db.rollback(save_point="book_invoice_receipt")
+            failed.append({"invoice_no": number, "error": str(e)[:200]})
+            frappe.log_error(title=f"Book Invoice Import: {number}", message=frappe.get_traceback())
+    
+    drafts, undrafted = [], []
+    if unknown and create_draft_for_unknown:
+        drafts, undrafted = make_drafts_for_unknown(unknown, supplier, warehouse, publication)
+    
+    frappe.db.commit()
+    
+    unknown_lines = [line.copy() for line in unknown[:UNKNOWN_LIST_LIMIT]]
+    add_similar_titles(unknown_lines, publication or frappe.db.get_value("Publication", {"supplier": supplier}, "name"))
+    
+    summary = {
+        "receipts": receipts,
+        "failed": failed,
+        "matched_lines": sum(1 for lines in invoices.values() for line in lines if line.isbn in items),
+        "unknown_count": len(unknown),
+        "unknown": unknown_lines,
+        "invalid": invalid[:UNKNOWN_LIST_LIMIT],
+        "drafts": drafts,
+        "undrafted": undrafted[:UNKNOWN_LIST_LIMIT]
+    }
+    frappe.publish_realtime("book_invoice_import_complete", summary, user=frappe.session.user)
+    
+    return summary
+
+
+def read_invoices(file_doc, default_invoice_no):
+    """Invoice lines grouped by invoice number, merging repeated ISBNs at the same rate"""
+    invoices = {}
+    invalid = []
+    
+    for row_number, line in enumerate(iter_invoice_lines(file_doc), 2):
+        if not line.isbn:
+            continue
+        if flt(line.qty) <= 0:
+            invalid.append({"row": row_number, "isbn": line.isbn, "error": _("Quantity must be greater than 0")})
+            continue
+        
+        lines = invoices.setdefault(line.invoice_no or default_invoice_no, {})
+        key = (line.isbn, flt(line.rate))
+        if key in lines:
+            lines[key].qty += flt(line.qty)
+        else:
+            lines[key] = line
+    
+    return {number: list(lines.values()) for number, lines in invoices.items()}, invalid
+
+
+def iter_invoice_lines(file_doc):
+    """Stream invoice rows of a CSV or Excel file without loading the whole file"""
+    rows = iter_file_rows(file_doc)
+    columns = map_columns(next(rows, None) or [])
+    
+    for values in rows:
+        line = frappe._dict({
+            fieldname: values[index] if index < len(values) else None
+            for fieldname, index in columns.items()
+        })
+        line.isbn = normalize_isbn(line.isbn)
+        line.qty = flt(line.qty)
+        line.rate = flt(line.rate)
+        line.mrp = flt(line.get("mrp"))
+        line.invoice_no = cell_text(line.invoice_no)
+        line["class"] = cell_text(line.get("class"))
+        line.title = cell_text(line.title)
+        yield line
+
+
+def iter_file_rows(file_doc):
+    file_path = file_doc.get_full_path()
+    
+    if file_path.lower().endswith((".xlsx", ".xlsm")):
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            yield from workbook.active.iter_rows(values_only=True)
+        finally:
+            workbook.close()
+    else:
+        with open(file_path, "r", encoding="utf-8-sig", newline="") as f:
+            yield from csv.reader(f)
+
+
+def count_lines(file_doc):
+    file_path = file_doc.get_full_path()
+    
+    if file_path.lower().endswith((".xlsx", ".xlsm")):
+        workbook = load_workbook(file_path, read_only=True)
+        try:
+            return max(cint(workbook.active.max_row) - 1, 0)
+        finally:
+            workbook.close()
+    
+    with open(file_path, "rb") as f:
+        return max(sum(1 for _line in f) - 1, 0)
+
+
+def map_columns(header):
+    """Column index of each invoice field, matched on header keywords"""
+    columns = {}
+    for index, name in enumerate(header):
+        name = cell_text(name).lower()
+        for fieldname, keywords in INVOICE_COLUMNS:
+            if fieldname not in columns and any(keyword in name for keyword in keywords):
+                columns[fieldname] = index
+                break
+    
+    if "isbn" not in columns or "qty" not in columns:
+        frappe.throw(_("The invoice file needs an ISBN and a Quantity column"))
+    
+    return columns
+
+
+def cell_text(value):
+    # Excel returns long numbers such as ISBNs as floats
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip() if value is not None else ""
+
+
+def normalize_isbn(value):
+    """ISBN without separators, ISBN-10 converted to its ISBN-13 form"""
+    isbn = re.sub(r"[^0-9Xx]", "", cell_text(value)).upper()
+    if len(isbn) == 10:
+        digits = "978" + isbn[:9]
+        isbn = digits + str(ean13_checksum(digits))
+    
+    return isbn
+
+
+def get_items_by_isbn(isbns):
+    """Enabled items per normalized ISBN, however their ISBN was typed in
+    
+    Items are matched on custom_isbn_normalized, kept in the same form as
+    invoice ISBNs whenever an item is saved.
+    """
+    if not isbns:
+        return {}
+    
+    items = {}
+    for item in frappe.db.sql("""
+        SELECT name, custom_isbn_barcode, custom_isbn_normalized, stock_uom
+        FROM `tabItem`
+        WHERE custom_isbn_normalized IN %(isbns)s AND disabled = 0
+        ORDER BY creation
+    """, {"isbns": list(isbns)}, as_dict=True):
+        items.setdefault(item.custom_isbn_normalized, item)
+    
+    return items
+
+
+def on_item_validate(doc, method=None):
+    """Keep the normalized ISBN of an item in step with the one typed in"""
+    doc.custom_isbn_normalized = normalize_isbn(doc.get("custom_isbn_barcode")) or None
+
+
+def add_similar_titles(lines, publication):
+    """Point unknown lines at book items with a similar title, likely the same book under a mistyped ISBN"""
+    matches = find_similar_titles([
+        {"publication": publication, "class": line.get("class"), "title": line.title} for line in lines
+    ])
+    for line, line_matches in zip(lines, matches):
+        line.similar = line_matches
+
+
+def make_drafts_for_unknown(lines, supplier, warehouse, publication=None):
+    """Collect unknown ISBNs in Book Item Creator drafts, one per title, to be completed and submitted by hand
+    
+    ISBNs of the same title go into one draft as its classes; a title listed
+    twice for a class gets a second draft. Drafts that fail validation, such
+    as lines without a class or MRP, are not created and returned with the error.
+    """
+    publication = publication or frappe.db.get_value("Publication", {"supplier": supplier}, "name")
+    classes = set(frappe.get_all("Class Master", pluck="name"))
+    
+    # Lines without a title cannot be told apart and get a draft each
+    groups = {}
+    seen = set()
+    for line in lines:
+        if line.isbn in seen:
+            continue
+        seen.add(line.isbn)
+        drafts = groups.setdefault(get_title_key(line.title) or line.isbn, [])
+        draft_lines = next((d for d in drafts if line.get("class") not in {other.get("class") for other in d}), None)
+        if draft_lines is None:
+            draft_lines = []
+            drafts.append(draft_lines)
+        draft_lines.append(line)
+    
+    created, failed = [], []
+    for draft_lines in (d for drafts in groups.values() for d in drafts):
+        draft = frappe.new_doc("Book Item Creator")
+        draft.publication = publication
+        draft.book_name = draft_lines[0].title or _("ISBN {0}").format(draft_lines[0].isbn)
+        draft.default_warehouse = warehouse
+        draft.buying_price_list = frappe.db.get_single_value("Buying Settings", "buying_price_list")
+        draft.selling_price_list = frappe.db.get_single_value("Selling Settings", "selling_price_list")
+        for line in draft_lines:
+            draft.append("class_details", {
+                "class": line.get("class") if line.get("class") in classes else None,
+                "isbn_barcode": line.isbn,
+                "mrp": line.mrp,
+                "rate": line.mrp,
+                "valuation_rate": line.rate,
+                "opening_stock": line.qty,
+                "remarks": _("From invoice {0}").format(line.invoice_no)[:140]
+            })
+        
+        # Subject and other header details are filled in by hand before the draft is saved again
+        draft.flags.ignore_mandatory = True
+        frappe.db.savepoint("book_invoice_draft")
+        try:
+            draft.insert()
+            created.append(draft.name)
+        except Exception as e:
+            frappe.db.rollback(save_point="book_invoice_draft")
+            frappe.clear_last_message()
+            failed.append({
+                "title": draft.book_name,
+                "isbns": [line.isbn for line in draft_lines],
+                "error": cstr(e)[:200]
+            })
+    
+    return created, failed
@@ -0,0 +1,180 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import json
+import math
+
+import frappe
+from frappe import _
+from frappe.utils import flt
+
+
+ROUNDING_FUNCTIONS = {
+    "Round": lambda value: math.floor(value + 0.5),
+    "Round Up": math.ceil,
+    "Round Down": math.floor,
+}
+
+
+def derive_rates(mrps, discount_percent, multiple=1, method="Round"):
+    """Apply one discount to a list of MRPs and round every result the same way"""
+    factor = 1 - flt(discount_percent) / 100
+    return [round_to_multiple(flt(mrp) * factor, multiple, method) for mrp in mrps]
+
+
+def round_to_multiple(value, multiple, method="Round"):
+    if flt(multiple) <= 0:
+        return flt(value, 2)
+    
+    # Trim float noise first so 149.9999999 rounds down to 149, not 148
+    steps = flt(value / flt(multiple), 6)
+    return flt(ROUNDING_FUNCTIONS.get(method, ROUNDING_FUNCTIONS["Round"])(steps) * flt(multiple), 2)
+
+
+def get_rate_changes(header, rows):
+    """Derived selling and valuation rates for the rows with an MRP, as a diff"""
+    rows = [row for row in rows if flt(row.get("mrp")) > 0]
+    mrps = [row.get("mrp") for row in rows]
+    multiple = header.get("rounding_multiple")
+    method = header.get("rounding_method")
+    
+    rates = derive_rates(mrps, header.get("sales_discount_percent"), multiple, method)
+    valuation_rates = derive_rates(mrps, header.get("purchase_discount_percent"), multiple, method)
+    
+    changes = []
+    for row, rate, valuation_rate in zip(rows, rates, valuation_rates):
+        if flt(row.get("rate")) == rate and flt(row.get("valuation_rate")) == valuation_rate:
+            continue
+        
+        changes.append(frappe._dict({
+            "parent": header.get("name"),
+            "name": row.get("name"),
+            "idx": row.get("idx"),
+            "class": row.get("class"),
+            "mrp": flt(row.get("mrp")),
+            "opening_stock": flt(row.get("opening_stock")),
+            "old_rate": flt(row.get("rate")),
+            "rate": rate,
+            "old_valuation_rate": flt(row.get("valuation_rate")),
+            "valuation_rate": valuation_rate,
+        }))
+    
+    return changes
+
+
+@frappe.whitelist()
+def preview_rates(doc):
+    """Preview derived rates for a Book Item Creator form, saved or not"""
+    if isinstance(doc, str):
+        doc = json.loads(doc)
+    doc = frappe._dict(doc)
+    
+    return get_rate_changes(doc, [frappe._dict(row) for row in doc.get("class_details") or []])
+
+
+@frappe.whitelist()
+def preview_publication_rates(publication):
+    """Preview derived rates for every draft Book Item Creator of a publication"""
+    frappe.has_permission("Book Item Creator", "write", throw=True)
+    
+    return get_publication_rate_changes(publication)
+
+
+@frappe.whitelist()
+def apply_publication_rates(publication):
+    """Queue applying derived rates to every draft Book Item Creator of a publication"""
+    frappe.has_permission("Book Item Creator", "write", throw=True)
+    
+    frappe.enqueue(
+        "trustbit_school_book_seller.trustbit_school_book.rate_engine.apply_rates_to_drafts",
+        queue="long",
+        timeout=1800,
+        publication=publication
+    )
+    
+    return {"message": _("Rates are being applied to draft entries of {0}").format(publication)}
+
+
+def get_publication_rate_changes(publication):
+    """Rate changes for all drafts of a publication, read in two queries"""
+    headers = frappe.get_all(
+        "Book Item Creator",
+        filters={"publication": publication, "docstatus": 0},
+        fields=[
+            "name", "sales_discount_percent", "purchase_discount_percent",
+            "rounding_method", "rounding_multiple"
+        ]
+    )
+    if not headers:
+        return []
+    
+    # Rows carry their total opening stock, distribution lines included
+    distributed = {
+        (line.parent, line.get("class")): flt(line.qty) for line in frappe.get_all(
+            "Book Stock Distribution",
+            filters={"parenttype": "Book Item Creator", "parent": ["in", [h.name for h in headers]]},
+            fields=["parent", "class", "sum(qty) as qty"],
+            group_by="parent, class"
+        )
+    }
+    
+    rows_by_parent = {}
+    for row in frappe.get_all(
+        "Book Class Detail",
+        filters={"parenttype": "Book Item Creator", "parent": ["in", [h.name for h in headers]]},
+        fields=["name", "parent", "idx", "class", "mrp", "rate", "valuation_rate", "opening_stock"],
+        order_by="parent, idx"
+    ):
+        row.opening_stock = flt(row.opening_stock) + distributed.get((row.parent, row.get("class")), 0)
+        rows_by_parent.setdefault(row.parent, []).append(row)
+    
+    changes = []
+    for header in headers:
+        changes += get_rate_changes(header, rows_by_parent.get(header.name, []))
+    
+    return changes
+
+
+def apply_rates_to_drafts(publication):
+    """Write derived rates to draft rows in bulk and refresh the affected totals
+    
+    Rows whose derived selling or valuation rate is not above 0, such as after
+    a 100% discount or rounding down, fail validation on the draft and are
+    skipped and reported instead.
+    """
+    changes = []
+    skipped = []
+    for change in get_publication_rate_changes(publication):
+        if change.rate > 0 and change.valuation_rate > 0:
+            changes.append(change)
+        else:
+            skipped.append({"parent": change.parent, "idx": change.idx, "class": change.get("class")})
+    
+    parents = list({change.parent for change in changes})
+    if changes:
+        frappe.db.bulk_update("Book Class Detail", {
+            change.name: {
+                "rate": change.rate,
+                "valuation_rate": change.valuation_rate,
+                "amount": change.opening_stock * change.valuation_rate
+            }
+            for change in changes
+        })
+        
+        # Recompute stock value of each touched draft from its rows
+        totals = frappe.db.sql("""
+            SELECT parent, SUM(amount) as total_stock_value
+            FROM `tabBook Class Detail`
+            WHERE parenttype = 'Book Item Creator' AND parent IN %(parents)s
+            GROUP BY parent
+        """, {"parents": parents}, as_dict=True)
+        
+        frappe.db.bulk_update("Book Item Creator", {
+            total.parent: {"total_stock_value": flt(total.total_stock_value)} for total in totals
+        })
+        frappe.db.commit()
+    
+    summary = {"publication": publication, "updated": len(changes), "documents": len(parents), "skipped": skipped}
+    frappe.publish_realtime("book_rates_applied", summary, user=frappe.session.user)
+    
+    return summary
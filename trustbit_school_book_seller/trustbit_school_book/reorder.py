@@ -0,0 +1,186 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import json
+import math
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, cint, flt, today
+from trustbit_school_book_seller.trustbit_school_book.pricing import get_effective_prices
+from trustbit_school_book_seller.trustbit_school_book.season import get_past_seasons
+
+
+# Extra stock over average season sales to plan for, override with
+# "book_reorder_buffer_percent" in site config
+REORDER_BUFFER_PERCENT = 10
+
+# Days from today a suggested Purchase Order is required by
+DEFAULT_LEAD_DAYS = 7
+
+# Stock Ledger voucher types that count as a sale
+SALES_VOUCHER_TYPES = ("Delivery Note", "Sales Invoice", "POS Invoice")
+
+
+def get_reorder_plan(filters):
+    """Suggested reorder quantity of every book item from past season sales and current stock"""
+    filters = frappe._dict(filters)
+    seasons = get_past_seasons(cint(filters.seasons) or 1, filters.get("date"))
+    if not seasons:
+        frappe.throw(_("No completed Fiscal Year found to base reorder suggestions on"))
+    
+    buffer_percent = flt(filters.get("buffer_percent", frappe.conf.get("book_reorder_buffer_percent", REORDER_BUFFER_PERCENT)))
+    rows = get_sales_and_stock(filters, seasons[-1].year_start_date, seasons[0].year_end_date)
+    prices = get_effective_prices(
+        [row.item_code for row in rows],
+        filters.get("price_list") or frappe.db.get_single_value("Buying Settings", "buying_price_list"),
+        filters.get("date")
+    )
+    
+    for row in rows:
+        row.rate = flt(prices.get(row.item_code))
+        row.average_sales = flt(row.sold_qty) / len(seasons)
+        row.target_qty = math.ceil(row.average_sales * (1 + buffer_percent / 100))
+        row.suggested_qty = max(row.target_qty - flt(row.actual_qty) - flt(row.ordered_qty), 0)
+        row.amount = row.suggested_qty * flt(row.rate)
+    
+    return rows
+
+
+def get_sales_and_stock(filters, from_date, to_date):
+    """Sales in the period, stock on hand and on order per book item, in one grouped query"""
+    values = {
+        "sales_voucher_types": SALES_VOUCHER_TYPES,
+        "from_date": from_date,
+        "to_date": to_date,
+    }
+    item_conditions = ""
+    warehouse_condition = ""
+    
+    for fieldname in ("publication", "subject", "class"):
+        if filters.get(fieldname):
+            item_conditions += f" AND i.custom_{fieldname} = %({fieldname})s"
+            values[fieldname] = filters.get(fieldname)
+    if filters.get("warehouse"):
+        warehouse_condition = " AND warehouse = %(warehouse)s"
+        values["warehouse"] = filters.warehouse
+    
+    return frappe.db.sql(f"""
+        SELECT
+            i.name as item_code, i.item_name, i.stock_uom,
+            i.custom_publication as publication, i.custom_subject as subject,
+            i.custom_class as class, p.supplier,
+            COALESCE(initial.opening_stock, 0) as opening_stock,
+            COALESCE(sales.sold_qty, 0) as sold_qty,
+            COALESCE(bin.actual_qty, 0) as actual_qty,
+            COALESCE(bin.ordered_qty, 0) as ordered_qty
+        FROM `tabItem` i
+        LEFT JOIN `tabPublication` p ON p.name = i.custom_publication
+        LEFT JOIN `tabClass Master` cm ON cm.name = i.custom_class
+        LEFT JOIN (
+            SELECT item_link, SUM(opening_stock) as opening_stock
+            FROM (
+                SELECT item_link, opening_stock FROM `tabBook Class Detail`
+                WHERE parenttype = 'Book Item Creator' AND docstatus = 1 AND item_link IS NOT NULL
+                UNION ALL
+                SELECT item_link, opening_stock FROM `tabBook Class Detail Archive`
+                WHERE parenttype = 'Book Item Creator' AND docstatus = 1 AND item_link IS NOT NULL
+                UNION ALL
+                SELECT bcd.item_link, sd.qty FROM `tabBook Stock Distribution` sd
+                INNER JOIN `tabBook Class Detail` bcd ON bcd.parent = sd.parent AND bcd.class = sd.class
+                WHERE sd.parenttype = 'Book Item Creator' AND sd.docstatus = 1 AND bcd.item_link IS NOT NULL
+                UNION ALL
+                SELECT bcd.item_link, sd.qty FROM `tabBook Stock Distribution` sd
+                INNER JOIN `tabBook Class Detail Archive` bcd ON bcd.parent = sd.parent AND bcd.class = sd.class
+                WHERE sd.parenttype = 'Book Item Creator' AND sd.docstatus = 1 AND bcd.item_link IS NOT NULL
+            ) class_details
+            GROUP BY item_link
+        ) initial ON initial.item_link = i.name
+        LEFT JOIN (
+            SELECT item_code, -SUM(actual_qty) as sold_qty
+            FROM `tabStock Ledger Entry`
+            WHERE is_cancelled = 0 AND voucher_type IN %(sales_voucher_types)s
+                AND posting_date BETWEEN %(from_date)s AND %(to_date)s {warehouse_condition}
+            GROUP BY item_code
+        ) sales ON sales.item_code = i.name
+        LEFT JOIN (
+            SELECT item_code, SUM(actual_qty) as actual_qty, SUM(ordered_qty) as ordered_qty
+            FROM `tabBin`
+            WHERE 1 = 1 {warehouse_condition}
+            GROUP BY item_code
+        ) bin ON bin.item_code = i.name
+        WHERE i.custom_book_item_creator IS NOT NULL AND i.disabled = 0 {item_conditions}
+        ORDER BY i.custom_publication, cm.sort_order, i.custom_subject, i.name
+    """, values, as_dict=True)
+
+
+@frappe.whitelist()
+def create_purchase_orders(filters):
+    """Queue draft Purchase Orders, one per publication, for the suggested quantities"""
+    frappe.has_permission("Purchase Order", "create", throw=True)
+    
+    if isinstance(filters, str):
+        filters = json.loads(filters)
+    filters = frappe._dict(filters)
+    
+    if not filters.get("company") or not filters.get("warehouse"):
+        frappe.throw(_("Company and Warehouse are required to create Purchase Orders"))
+    
+    frappe.enqueue(
+        "trustbit_school_book_seller.trustbit_school_book.reorder.make_purchase_orders",
+        queue="long",
+        timeout=3600,
+        filters=filters
+    )
+    
+    return {"message": _("Purchase Orders are being created in the background")}
+
+
+def make_purchase_orders(filters):
+    """Insert one draft Purchase Order per publication with a supplier"""
+    filters = frappe._dict(filters)
+    by_publication = {}
+    for row in get_reorder_plan(filters):
+        if row.suggested_qty > 0:
+            by_publication.setdefault(row.publication, []).append(row)
+    
+    schedule_date = filters.get("schedule_date") or add_days(today(), DEFAULT_LEAD_DAYS)
+    price_list = filters.get("price_list") or frappe.db.get_single_value("Buying Settings", "buying_price_list")
+    created, skipped, failed = [], [], []
+    
+    for publication, rows in by_publication.items():
+        if not rows[0].supplier:
+            skipped.append(publication)
+            continue
+        
+        frappe.db.savepoint("book_reorder_purchase_order")
+        try:
+            purchase_order = frappe.get_doc({
+                "doctype": "Purchase Order",
+                "supplier": rows[0].supplier,
+                "company": filters.company,
+                "schedule_date": schedule_date,
+                "set_warehouse": filters.warehouse,
+                "buying_price_list": price_list,
+                "items": [{
+                    "item_code": row.item_code,
+                    "qty": row.suggested_qty,
+                    "rate": row.rate,
+                    "uom": row.stock_uom,
+                    "warehouse": filters.warehouse,
+                    "schedule_date": schedule_date
+                } for row in rows]
+            })
+            purchase_order.insert()
+            created.append(purchase_order.name)
+        except Exception:
+            frappe.db.rollback(save_point="book_reorder_purchase_order")
+            failed.append(publication)
+            frappe.log_error(title=f"Book Reorder: {publication}", message=frappe.get_traceback())
+    
+    frappe.db.commit()
+    
+    summary = {"created": created, "skipped": skipped, "failed": failed}
+    frappe.publish_realtime("book_reorder_complete", summary, user=frappe.session.user)
+    
+    return summary
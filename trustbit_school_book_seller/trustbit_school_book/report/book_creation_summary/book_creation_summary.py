@@ -4,15 +4,22 @@
 import frappe
 from frappe import _
 from frappe.utils import flt
+from trustbit_school_book_seller.trustbit_school_book.report_cache import get_cached_report, get_cache_indicator
 
 
 def execute(filters=None):
+    (columns, data, chart, summary), cache_hit = get_cached_report("Book Creation Summary", filters, build_report)
+    
+    return columns, data, None, chart, summary + [get_cache_indicator(cache_hit)]
+
+
+def build_report(filters):
     columns = get_columns()
     data = get_data(filters)
     chart = get_chart(data)
     summary = get_summary(data)
     
-    return columns, data, None, chart, summary
+    return columns, data, chart, summary
 
 
 def get_columns():
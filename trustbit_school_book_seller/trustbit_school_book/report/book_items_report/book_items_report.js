@@ -32,6 +32,21 @@ frappe.query_reports["Book Items Report"] = {
             "label": __("To Date"),
             "fieldtype": "Date",
             "default": frappe.datetime.get_today()
+        },
+        {
+            "fieldname": "price_list",
+            "label": __("Selling Price List"),
+            "fieldtype": "Link",
+            "options": "Price List",
+            "get_query": function() {
+                return { filters: { 'selling': 1 } };
+            }
+        },
+        {
+            "fieldname": "price_date",
+            "label": __("Prices As On"),
+            "fieldtype": "Date",
+            "default": frappe.datetime.get_today()
         }
     ]
 };
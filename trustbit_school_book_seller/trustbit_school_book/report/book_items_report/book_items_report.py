@@ -4,15 +4,23 @@
 import frappe
 from frappe import _
 from frappe.utils import flt
+from trustbit_school_book_seller.trustbit_school_book.pricing import get_effective_price_rows
+from trustbit_school_book_seller.trustbit_school_book.report_cache import get_cached_report, get_cache_indicator
 
 
 def execute(filters=None):
+    (columns, data, chart, summary), cache_hit = get_cached_report("Book Items Report", filters, build_report)
+    
+    return columns, data, None, chart, summary + [get_cache_indicator(cache_hit)]
+
+
+def build_report(filters):
     columns = get_columns()
     data = get_data(filters)
     chart = get_chart(data)
     summary = get_summary(data)
     
-    return columns, data, None, chart, summary
+    return columns, data, chart, summary
 
 
 def get_columns():
@@ -59,14 +67,31 @@ def get_data(filters):
             i.creation,
             COALESCE(bin.actual_qty, 0) as actual_qty,
             COALESCE(bin.stock_value, 0) as stock_value,
-            (SELECT price_list_rate FROM `tabItem Price` 
-             WHERE item_code = i.name AND selling = 1 LIMIT 1) as selling_rate
+            bic.selling_price_list
         FROM `tabItem` i
         LEFT JOIN `tabBin` bin ON bin.item_code = i.name
+        LEFT JOIN `tabBook Item Creator` bic ON bic.name = i.custom_book_item_creator
         {conditions}
         ORDER BY i.creation DESC
     """, as_dict=True)
     
+    # Selling rate in effect on the price date, so past seasons show the rates they sold at.
+    # Without a price list filter each item is priced in the list its creator entry used.
+    default_price_list = frappe.db.get_single_value("Selling Settings", "selling_price_list")
+    for row in data:
+        row.selling_price_list = filters.get("price_list") or row.selling_price_list or default_price_list
+    
+    prices = {
+        (price.item_code, price.price_list): price.price_list_rate
+        for price in get_effective_price_rows(
+            {row.item_code for row in data},
+            list({row.selling_price_list for row in data}),
+            filters.get("price_date")
+        )
+    }
+    for row in data:
+        row.selling_rate = prices.get((row.item_code, row.selling_price_list))
+    
     return data
 
 
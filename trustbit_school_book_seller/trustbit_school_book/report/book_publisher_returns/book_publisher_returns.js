@@ -0,0 +1,94 @@
+// Copyright (c) 2024, Trustbit and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Book Publisher Returns"] = {
+    "filters": [
+        {
+            "fieldname": "company",
+            "label": __("Company"),
+            "fieldtype": "Link",
+            "options": "Company",
+            "default": frappe.defaults.get_user_default("Company"),
+            "reqd": 1
+        },
+        {
+            "fieldname": "warehouse",
+            "label": __("Warehouse"),
+            "fieldtype": "Link",
+            "options": "Warehouse",
+            "get_query": function() {
+                return { filters: { "is_group": 0, "company": frappe.query_report.get_filter_value("company") } };
+            }
+        },
+        {
+            "fieldname": "from_date",
+            "label": __("Received Since"),
+            "fieldtype": "Date",
+            "description": __("Receipts from this date can be returned against, the start of the season if empty")
+        },
+        {
+            "fieldname": "keep_qty",
+            "label": __("Keep Qty"),
+            "fieldtype": "Float",
+            "description": __("Copies of every title to keep per warehouse when higher than its reorder level")
+        },
+        {
+            "fieldname": "publication",
+            "label": __("Publication"),
+            "fieldtype": "Link",
+            "options": "Publication"
+        },
+        {
+            "fieldname": "class",
+            "label": __("Class"),
+            "fieldtype": "Link",
+            "options": "Class Master"
+        },
+        {
+            "fieldname": "subject",
+            "label": __("Subject"),
+            "fieldtype": "Link",
+            "options": "Subject"
+        },
+        {
+            "fieldname": "only_returnable",
+            "label": __("Only Items to Return"),
+            "fieldtype": "Check",
+            "default": 1
+        }
+    ],
+    
+    onload: function(report) {
+        report.page.add_inner_button(__('Create Purchase Returns'), function() {
+            let filters = report.get_filter_values();
+            
+            frappe.confirm(__('Create a draft Purchase Return per publication for the return quantities?'), function() {
+                frappe.call({
+                    method: 'trustbit_school_book_seller.trustbit_school_book.returns.create_publisher_returns',
+                    args: { filters: filters },
+                    callback: function(r) {
+                        frappe.show_alert({ message: r.message.message, indicator: 'blue' });
+                    }
+                });
+            });
+        });
+        
+        frappe.realtime.off('book_publisher_returns_complete');
+        frappe.realtime.on('book_publisher_returns_complete', function(data) {
+            let msg = __('{0} draft Purchase Returns created for {1} books, {2}', [
+                data.created.length, data.qty, format_currency(data.amount)
+            ]);
+            if (data.skipped.length) {
+                msg += '<br>' + __('No supplier set on: {0}', [data.skipped.join(', ')]);
+            }
+            if (data.failed.length) {
+                msg += '<br>' + __('Failed, see Error Log: {0}', [data.failed.join(', ')]);
+            }
+            frappe.msgprint({
+                title: __('Returns Complete'),
+                message: msg,
+                indicator: data.failed.length ? 'orange' : 'green'
+            });
+        });
+    }
+};
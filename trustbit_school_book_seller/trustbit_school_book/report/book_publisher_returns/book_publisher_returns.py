@@ -0,0 +1,65 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import flt, cint
+from trustbit_school_book_seller.trustbit_school_book.returns import get_return_plan
+
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    plan = get_return_plan(filters)
+    data = [row for row in plan if row.return_qty > 0] if filters.get("only_returnable") else plan
+    
+    return get_columns(), data, None, get_chart(data), get_summary(data)
+
+
+def get_columns():
+    return [
+        {"label": _("Item"), "fieldname": "item_code", "fieldtype": "Link", "options": "Item", "width": 200},
+        {"label": _("Publication"), "fieldname": "publication", "fieldtype": "Link", "options": "Publication", "width": 130},
+        {"label": _("Class"), "fieldname": "class", "fieldtype": "Link", "options": "Class Master", "width": 90},
+        {"label": _("Warehouse"), "fieldname": "warehouse", "fieldtype": "Link", "options": "Warehouse", "width": 130},
+        {"label": _("Supplier"), "fieldname": "supplier", "fieldtype": "Link", "options": "Supplier", "width": 130},
+        {"label": _("On Hand"), "fieldname": "actual_qty", "fieldtype": "Float", "width": 90},
+        {"label": _("Reserved"), "fieldname": "reserved_qty", "fieldtype": "Float", "width": 90},
+        {"label": _("On Draft Returns"), "fieldname": "draft_return_qty", "fieldtype": "Float", "width": 120},
+        {"label": _("Minimum Holding"), "fieldname": "min_qty", "fieldtype": "Float", "width": 120},
+        {"label": _("Purchase Receipt"), "fieldname": "purchase_receipt", "fieldtype": "Link", "options": "Purchase Receipt", "width": 140},
+        {"label": _("Return Qty"), "fieldname": "return_qty", "fieldtype": "Float", "width": 100},
+        {"label": _("Without Receipt"), "fieldname": "unmatched_qty", "fieldtype": "Float", "width": 110},
+        {"label": _("Rate"), "fieldname": "rate", "fieldtype": "Currency", "width": 90},
+        {"label": _("Amount"), "fieldname": "amount", "fieldtype": "Currency", "width": 110},
+    ]
+
+
+def get_chart(data):
+    # Return quantity per publication
+    qty_by_publication = {}
+    for row in data:
+        key = row.publication or _("Not Set")
+        qty_by_publication[key] = qty_by_publication.get(key, 0) + flt(row.return_qty)
+    
+    return {
+        "data": {
+            "labels": list(qty_by_publication),
+            "datasets": [{"name": _("Return Qty"), "values": list(qty_by_publication.values())}]
+        },
+        "type": "bar",
+        "colors": ["#ff5858"]
+    }
+
+
+def get_summary(data):
+    to_return = [row for row in data if row.return_qty > 0]
+    # Without a supplier no receipt matches, so their stock only shows as returnable
+    without_supplier = {row.publication for row in data if row.returnable_qty > 0 and not row.supplier}
+    
+    return [
+        {"label": _("Titles to Return"), "value": cint(len({row.item_code for row in to_return})), "indicator": "blue"},
+        {"label": _("Total Return Qty"), "value": sum(flt(row.return_qty) for row in to_return), "indicator": "green"},
+        {"label": _("Return Value"), "value": frappe.format_value(sum(flt(row.amount) for row in to_return), {"fieldtype": "Currency"}), "indicator": "orange"},
+        {"label": _("Without Receipt"), "value": sum(flt(row.get("unmatched_qty")) for row in data), "indicator": "grey"},
+        {"label": _("Publications without Supplier"), "value": cint(len(without_supplier)), "indicator": "red" if without_supplier else "green"},
+    ]
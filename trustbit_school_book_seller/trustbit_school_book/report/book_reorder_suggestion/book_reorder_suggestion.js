@@ -0,0 +1,106 @@
+// Copyright (c) 2024, Trustbit and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Book Reorder Suggestion"] = {
+    "filters": [
+        {
+            "fieldname": "company",
+            "label": __("Company"),
+            "fieldtype": "Link",
+            "options": "Company",
+            "default": frappe.defaults.get_user_default("Company"),
+            "reqd": 1
+        },
+        {
+            "fieldname": "warehouse",
+            "label": __("Warehouse"),
+            "fieldtype": "Link",
+            "options": "Warehouse",
+            "get_query": function() {
+                return { filters: { "is_group": 0, "company": frappe.query_report.get_filter_value("company") } };
+            }
+        },
+        {
+            "fieldname": "seasons",
+            "label": __("Past Seasons"),
+            "fieldtype": "Int",
+            "default": 1,
+            "reqd": 1
+        },
+        {
+            "fieldname": "buffer_percent",
+            "label": __("Buffer %"),
+            "fieldtype": "Percent",
+            "default": 10
+        },
+        {
+            "fieldname": "publication",
+            "label": __("Publication"),
+            "fieldtype": "Link",
+            "options": "Publication"
+        },
+        {
+            "fieldname": "class",
+            "label": __("Class"),
+            "fieldtype": "Link",
+            "options": "Class Master"
+        },
+        {
+            "fieldname": "subject",
+            "label": __("Subject"),
+            "fieldtype": "Link",
+            "options": "Subject"
+        },
+        {
+            "fieldname": "price_list",
+            "label": __("Buying Price List"),
+            "fieldtype": "Link",
+            "options": "Price List",
+            "get_query": function() {
+                return { filters: { "buying": 1 } };
+            }
+        },
+        {
+            "fieldname": "only_suggested",
+            "label": __("Only Items to Reorder"),
+            "fieldtype": "Check",
+            "default": 1
+        }
+    ],
+    
+    onload: function(report) {
+        report.page.add_inner_button(__('Create Purchase Orders'), function() {
+            let filters = report.get_filter_values();
+            if (!filters.warehouse) {
+                frappe.msgprint(__('Select a Warehouse to receive the Purchase Orders into'));
+                return;
+            }
+            
+            frappe.confirm(__('Create a draft Purchase Order per publication for the suggested quantities?'), function() {
+                frappe.call({
+                    method: 'trustbit_school_book_seller.trustbit_school_book.reorder.create_purchase_orders',
+                    args: { filters: filters },
+                    callback: function(r) {
+                        frappe.show_alert({ message: r.message.message, indicator: 'blue' });
+                    }
+                });
+            });
+        });
+        
+        frappe.realtime.off('book_reorder_complete');
+        frappe.realtime.on('book_reorder_complete', function(data) {
+            let msg = __('{0} draft Purchase Orders created', [data.created.length]);
+            if (data.skipped.length) {
+                msg += '<br>' + __('No supplier set on: {0}', [data.skipped.join(', ')]);
+            }
+            if (data.failed.length) {
+                msg += '<br>' + __('Failed, see Error Log: {0}', [data.failed.join(', ')]);
+            }
+            frappe.msgprint({
+                title: __('Reorder Complete'),
+                message: msg,
+                indicator: data.failed.length ? 'orange' : 'green'
+            });
+        });
+    }
+};
@@ -0,0 +1,61 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import flt, cint
+from trustbit_school_book_seller.trustbit_school_book.reorder import get_reorder_plan
+
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    plan = get_reorder_plan(filters)
+    data = [row for row in plan if row.suggested_qty > 0] if filters.get("only_suggested") else plan
+    
+    return get_columns(), data, None, get_chart(data), get_summary(data)
+
+
+def get_columns():
+    return [
+        {"label": _("Item"), "fieldname": "item_code", "fieldtype": "Link", "options": "Item", "width": 200},
+        {"label": _("Publication"), "fieldname": "publication", "fieldtype": "Link", "options": "Publication", "width": 130},
+        {"label": _("Subject"), "fieldname": "subject", "fieldtype": "Link", "options": "Subject", "width": 110},
+        {"label": _("Class"), "fieldname": "class", "fieldtype": "Link", "options": "Class Master", "width": 90},
+        {"label": _("Supplier"), "fieldname": "supplier", "fieldtype": "Link", "options": "Supplier", "width": 130},
+        {"label": _("Initial Stock"), "fieldname": "opening_stock", "fieldtype": "Float", "width": 100},
+        {"label": _("Avg Season Sales"), "fieldname": "average_sales", "fieldtype": "Float", "width": 120},
+        {"label": _("On Hand"), "fieldname": "actual_qty", "fieldtype": "Float", "width": 90},
+        {"label": _("On Order"), "fieldname": "ordered_qty", "fieldtype": "Float", "width": 90},
+        {"label": _("Suggested Qty"), "fieldname": "suggested_qty", "fieldtype": "Float", "width": 110},
+        {"label": _("Rate"), "fieldname": "rate", "fieldtype": "Currency", "width": 90},
+        {"label": _("Amount"), "fieldname": "amount", "fieldtype": "Currency", "width": 110},
+    ]
+
+
+def get_chart(data):
+    # Suggested quantity per class, in report order
+    qty_by_class = {}
+    for row in data:
+        key = row.get("class") or _("Not Set")
+        qty_by_class[key] = qty_by_class.get(key, 0) + flt(row.suggested_qty)
+    
+    return {
+        "data": {
+            "labels": list(qty_by_class),
+            "datasets": [{"name": _("Suggested Qty"), "values": list(qty_by_class.values())}]
+        },
+        "type": "bar",
+        "colors": ["#5e64ff"]
+    }
+
+
+def get_summary(data):
+    to_order = [row for row in data if row.suggested_qty > 0]
+    without_supplier = {row.publication for row in to_order if not row.supplier}
+    
+    return [
+        {"label": _("Items to Reorder"), "value": cint(len(to_order)), "indicator": "blue"},
+        {"label": _("Total Suggested Qty"), "value": sum(flt(row.suggested_qty) for row in to_order), "indicator": "green"},
+        {"label": _("Estimated Cost"), "value": frappe.format_value(sum(flt(row.amount) for row in to_order), {"fieldtype": "Currency"}), "indicator": "orange"},
+        {"label": _("Publications without Supplier"), "value": cint(len(without_supplier)), "indicator": "red" if without_supplier else "green"},
+    ]
@@ -0,0 +1,64 @@
+// Copyright (c) 2024, Trustbit and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Book Sell Through"] = {
+    "filters": [
+        {
+            "fieldname": "from_date",
+            "label": __("From Date"),
+            "fieldtype": "Date",
+            "default": frappe.datetime.add_months(frappe.datetime.get_today(), -3),
+            "reqd": 1
+        },
+        {
+            "fieldname": "to_date",
+            "label": __("To Date"),
+            "fieldtype": "Date",
+            "default": frappe.datetime.get_today(),
+            "reqd": 1
+        },
+        {
+            "fieldname": "group_by",
+            "label": __("Group By"),
+            "fieldtype": "Select",
+            "options": ["Publication", "Subject", "Class"],
+            "default": "Publication",
+            "reqd": 1
+        },
+        {
+            "fieldname": "period",
+            "label": __("Period"),
+            "fieldtype": "Select",
+            "options": ["Daily", "Weekly", "Monthly"],
+            "default": "Weekly",
+            "reqd": 1
+        },
+        {
+            "fieldname": "publication",
+            "label": __("Publication"),
+            "fieldtype": "Link",
+            "options": "Publication"
+        },
+        {
+            "fieldname": "subject",
+            "label": __("Subject"),
+            "fieldtype": "Link",
+            "options": "Subject"
+        },
+        {
+            "fieldname": "class",
+            "label": __("Class"),
+            "fieldtype": "Link",
+            "options": "Class Master"
+        },
+        {
+            "fieldname": "warehouse",
+            "label": __("Warehouse"),
+            "fieldtype": "Link",
+            "options": "Warehouse",
+            "get_query": function() {
+                return { filters: { "is_group": 0 } };
+            }
+        }
+    ]
+};
@@ -0,0 +1,165 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import add_months, flt, getdate, today
+from trustbit_school_book_seller.trustbit_school_book.report_cache import get_cached_report, get_cache_indicator
+
+
+# Group by option, Book Sales Daily column and the doctype it links to
+GROUP_FIELDS = {
+    "Publication": ("publication", "Publication"),
+    "Subject": ("subject", "Subject"),
+    "Class": ("class", "Class Master"),
+}
+
+# SQL expression for the first day of each period
+PERIOD_EXPRESSIONS = {
+    "Daily": "d.posting_date",
+    "Weekly": "DATE_SUB(d.posting_date, INTERVAL WEEKDAY(d.posting_date) DAY)",
+    "Monthly": "DATE_FORMAT(d.posting_date, '%%Y-%%m-01')",
+}
+
+# Groups drawn as lines on the chart
+CHART_GROUPS = 5
+
+
+def execute(filters=None):
+    (columns, data, chart, summary), cache_hit = get_cached_report("Book Sell Through", filters, build_report)
+    
+    return columns, data, None, chart, summary + [get_cache_indicator(cache_hit)]
+
+
+def build_report(filters):
+    group_by = filters.get("group_by") or "Publication"
+    period = filters.get("period") or "Weekly"
+    conditions, values = get_conditions(filters)
+    
+    data = get_data(group_by, conditions, values, filters)
+    chart = get_chart(data, group_by, period, conditions, values)
+    
+    return get_columns(group_by), data, chart, get_summary(data)
+
+
+def get_conditions(filters):
+    values = {
+        "from_date": filters.get("from_date") or add_months(today(), -3),
+        "to_date": filters.get("to_date") or today(),
+    }
+    conditions = "d.posting_date BETWEEN %(from_date)s AND %(to_date)s"
+    
+    for fieldname in ("publication", "subject", "class", "warehouse"):
+        if filters.get(fieldname):
+            conditions += f" AND d.`{fieldname}` = %({fieldname})s"
+            values[fieldname] = filters.get(fieldname)
+    
+    return conditions, values
+
+
+def get_columns(group_by):
+    fieldname, options = GROUP_FIELDS[group_by]
+    
+    return [
+        {"label": _(group_by), "fieldname": fieldname, "fieldtype": "Link", "options": options, "width": 160},
+        {"label": _("Sold Qty"), "fieldname": "sold_qty", "fieldtype": "Float", "width": 100},
+        {"label": _("Received Qty"), "fieldname": "received_qty", "fieldtype": "Float", "width": 110},
+        {"label": _("On Hand"), "fieldname": "on_hand", "fieldtype": "Float", "width": 100},
+        {"label": _("Cost of Sales"), "fieldname": "cost_of_sales", "fieldtype": "Currency", "width": 120},
+        {"label": _("Sell-Through"), "fieldname": "sell_through", "fieldtype": "Percent", "width": 100},
+    ]
+
+
+def get_data(group_by, conditions, values, filters):
+    """Sold and received qty per group from the daily aggregate, with current stock from Bin"""
+    fieldname = GROUP_FIELDS[group_by][0]
+    
+    data = frappe.db.sql(f"""
+        SELECT
+            d.`{fieldname}` as `{fieldname}`,
+            SUM(d.sold_qty) as sold_qty,
+            SUM(d.received_qty) as received_qty,
+            SUM(d.cost_of_sales) as cost_of_sales
+        FROM `tabBook Sales Daily` d
+        WHERE {conditions}
+        GROUP BY d.`{fieldname}`
+        ORDER BY sold_qty DESC
+    """, values, as_dict=True)
+    
+    # Groups with stock but no movement in the period sold nothing of it
+    on_hand = get_on_hand(fieldname, filters)
+    seen = {row[fieldname] for row in data}
+    data += [
+        frappe._dict({fieldname: group, "sold_qty": 0, "received_qty": 0, "cost_of_sales": 0})
+        for group, qty in on_hand.items() if group not in seen and flt(qty) > 0
+    ]
+    
+    for row in data:
+        row.on_hand = on_hand.get(row[fieldname], 0)
+        available = flt(row.sold_qty) + flt(row.on_hand)
+        row.sell_through = flt(row.sold_qty) / available * 100 if available else 0
+    
+    return data
+
+
+def get_on_hand(fieldname, filters):
+    values = {}
+    conditions = ""
+    for key in ("publication", "subject", "class"):
+        if filters.get(key):
+            conditions += f" AND i.custom_{key} = %({key})s"
+            values[key] = filters.get(key)
+    if filters.get("warehouse"):
+        conditions += " AND b.warehouse = %(warehouse)s"
+        values["warehouse"] = filters.warehouse
+    
+    return dict(frappe.db.sql(f"""
+        SELECT i.custom_{fieldname}, SUM(b.actual_qty)
+        FROM `tabBin` b
+        INNER JOIN `tabItem` i ON i.name = b.item_code
+        WHERE i.custom_book_item_creator IS NOT NULL {conditions}
+        GROUP BY i.custom_{fieldname}
+    """, values))
+
+
+def get_chart(data, group_by, period, conditions, values):
+    """Sold qty per period for the best selling groups"""
+    fieldname = GROUP_FIELDS[group_by][0]
+    groups = [row[fieldname] for row in data[:CHART_GROUPS] if flt(row.sold_qty) > 0]
+    if not groups:
+        return None
+    
+    series = frappe.db.sql(f"""
+        SELECT {PERIOD_EXPRESSIONS[period]} as period, d.`{fieldname}` as group_value, SUM(d.sold_qty) as sold_qty
+        FROM `tabBook Sales Daily` d
+        WHERE {conditions} AND d.`{fieldname}` IN %(chart_groups)s
+        GROUP BY period, group_value
+        ORDER BY period
+    """, dict(values, chart_groups=tuple(groups)), as_dict=True)
+    
+    periods = sorted({getdate(row.period) for row in series})
+    sold = {(getdate(row.period), row.group_value): flt(row.sold_qty) for row in series}
+    
+    return {
+        "data": {
+            "labels": [frappe.format_value(p, {"fieldtype": "Date"}) for p in periods],
+            "datasets": [
+                {"name": group or _("Not Set"), "values": [sold.get((p, group), 0) for p in periods]}
+                for group in groups
+            ]
+        },
+        "type": "line",
+        "lineOptions": {"regionFill": 0}
+    }
+
+
+def get_summary(data):
+    sold = sum(flt(row.sold_qty) for row in data)
+    on_hand = sum(flt(row.on_hand) for row in data)
+    
+    return [
+        {"label": _("Sold Qty"), "value": sold, "indicator": "blue"},
+        {"label": _("Received Qty"), "value": sum(flt(row.received_qty) for row in data), "indicator": "green"},
+        {"label": _("Cost of Sales"), "value": frappe.format_value(sum(flt(row.cost_of_sales) for row in data), {"fieldtype": "Currency"}), "indicator": "orange"},
+        {"label": _("Sell-Through"), "value": f"{flt(sold / (sold + on_hand) * 100 if sold + on_hand else 0, 1)}%", "indicator": "green"},
+    ]
@@ -0,0 +1,47 @@
+// Copyright (c) 2024, Trustbit and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Book Stock Matrix"] = {
+    "filters": [
+        {
+            "fieldname": "show",
+            "label": __("Show"),
+            "fieldtype": "Select",
+            "options": "Quantity\nValue\nSell-Through",
+            "default": "Quantity",
+            "reqd": 1
+        },
+        {
+            "fieldname": "warehouse",
+            "label": __("Warehouse"),
+            "fieldtype": "MultiSelectList",
+            "get_data": function(txt) {
+                return frappe.db.get_link_options("Warehouse", txt, { "is_group": 0 });
+            }
+        },
+        {
+            "fieldname": "publication",
+            "label": __("Publication"),
+            "fieldtype": "Link",
+            "options": "Publication"
+        },
+        {
+            "fieldname": "subject",
+            "label": __("Subject"),
+            "fieldtype": "Link",
+            "options": "Subject"
+        },
+        {
+            "fieldname": "from_date",
+            "label": __("Sales From"),
+            "fieldtype": "Date",
+            "default": frappe.datetime.add_months(frappe.datetime.get_today(), -12)
+        },
+        {
+            "fieldname": "to_date",
+            "label": __("Sales To"),
+            "fieldtype": "Date",
+            "default": frappe.datetime.get_today()
+        }
+    ]
+};
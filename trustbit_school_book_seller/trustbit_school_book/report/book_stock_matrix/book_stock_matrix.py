@@ -0,0 +1,186 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import flt, cint
+from trustbit_school_book_seller.trustbit_school_book.report_cache import get_cached_report, get_cache_indicator
+
+
+# Stock Ledger voucher types that count as a sale for sell-through
+SALES_VOUCHER_TYPES = ("Delivery Note", "Sales Invoice", "POS Invoice")
+
+METRIC_FIELDS = {
+    "Quantity": ("qty", "Float"),
+    "Value": ("value", "Currency"),
+    "Sell-Through": ("sell_through", "Percent"),
+}
+
+
+def execute(filters=None):
+    (columns, data, chart, summary), cache_hit = get_cached_report("Book Stock Matrix", filters, build_report)
+    
+    return columns, data, None, chart, summary + [get_cache_indicator(cache_hit)]
+
+
+def build_report(filters):
+    classes = get_classes()
+    grouped = get_grouped_stock(filters)
+    data = pivot(grouped, classes, filters.get("show") or "Quantity")
+    columns = get_columns(classes, filters.get("show") or "Quantity")
+    chart = get_chart(grouped, classes)
+    summary = get_summary(data)
+    
+    return columns, data, chart, summary
+
+
+def get_classes():
+    return frappe.get_all(
+        "Class Master",
+        filters={"disabled": 0},
+        fields=["name", "short_code"],
+        order_by="sort_order"
+    )
+
+
+def get_columns(classes, show):
+    fieldtype = METRIC_FIELDS[show][1]
+    
+    columns = [
+        {"label": _("Publication"), "fieldname": "publication", "fieldtype": "Link", "options": "Publication", "width": 140},
+        {"label": _("Subject"), "fieldname": "subject", "fieldtype": "Link", "options": "Subject", "width": 120},
+    ]
+    columns += [
+        {"label": cls.short_code or cls.name, "fieldname": class_fieldname(cls.name), "fieldtype": fieldtype, "width": 80}
+        for cls in classes
+    ]
+    columns += [
+        {"label": _("Total Qty"), "fieldname": "total_qty", "fieldtype": "Float", "width": 100},
+        {"label": _("Total Value"), "fieldname": "total_value", "fieldtype": "Currency", "width": 120},
+        {"label": _("Sold Qty"), "fieldname": "total_sold", "fieldtype": "Float", "width": 100},
+        {"label": _("Sell-Through"), "fieldname": "total_sell_through", "fieldtype": "Percent", "width": 100},
+    ]
+    
+    return columns
+
+
+def get_grouped_stock(filters):
+    """On-hand qty, value and sold qty per publication, subject and class in one grouped query"""
+    values = {"sales_voucher_types": SALES_VOUCHER_TYPES}
+    item_conditions = ""
+    bin_conditions = ""
+    sle_conditions = ""
+    
+    if filters.get("publication"):
+        item_conditions += " AND i.custom_publication = %(publication)s"
+        values["publication"] = filters.publication
+    if filters.get("subject"):
+        item_conditions += " AND i.custom_subject = %(subject)s"
+        values["subject"] = filters.subject
+    if filters.get("warehouse"):
+        bin_conditions += " AND warehouse IN %(warehouses)s"
+        sle_conditions += " AND warehouse IN %(warehouses)s"
+        values["warehouses"] = filters.warehouse
+    if filters.get("from_date"):
+        sle_conditions += " AND posting_date >= %(from_date)s"
+        values["from_date"] = filters.from_date
+    if filters.get("to_date"):
+        sle_conditions += " AND posting_date <= %(to_date)s"
+        values["to_date"] = filters.to_date
+    
+    return frappe.db.sql(f"""
+        SELECT
+            i.custom_publication as publication,
+            i.custom_subject as subject,
+            i.custom_class as class,
+            SUM(COALESCE(bin.actual_qty, 0)) as qty,
+            SUM(COALESCE(bin.stock_value, 0)) as value,
+            SUM(COALESCE(sales.sold_qty, 0)) as sold_qty
+        FROM `tabItem` i
+        LEFT JOIN (
+            SELECT item_code, SUM(actual_qty) as actual_qty, SUM(stock_value) as stock_value
+            FROM `tabBin`
+            WHERE 1 = 1 {bin_conditions}
+            GROUP BY item_code
+        ) bin ON bin.item_code = i.name
+        LEFT JOIN (
+            SELECT item_code, -SUM(actual_qty) as sold_qty
+            FROM `tabStock Ledger Entry`
+            WHERE is_cancelled = 0 AND voucher_type IN %(sales_voucher_types)s {sle_conditions}
+            GROUP BY item_code
+        ) sales ON sales.item_code = i.name
+        WHERE i.custom_book_item_creator IS NOT NULL {item_conditions}
+        GROUP BY i.custom_publication, i.custom_subject, i.custom_class
+    """, values, as_dict=True)
+
+
+def pivot(grouped, classes, show):
+    """Pivot grouped rows into one row per publication and subject with a cell per class"""
+    metric = METRIC_FIELDS[show][0]
+    known_classes = {cls.name for cls in classes}
+    rows = {}
+    
+    for entry in grouped:
+        key = (entry.publication, entry.subject)
+        row = rows.get(key)
+        if not row:
+            row = rows[key] = frappe._dict({
+                "publication": entry.publication,
+                "subject": entry.subject,
+                "total_qty": 0,
+                "total_value": 0,
+                "total_sold": 0,
+            })
+        
+        entry.sell_through = sell_through(entry.sold_qty, entry.qty)
+        if entry.get("class") in known_classes:
+            row[class_fieldname(entry.get("class"))] = flt(entry[metric])
+        
+        row.total_qty += flt(entry.qty)
+        row.total_value += flt(entry.value)
+        row.total_sold += flt(entry.sold_qty)
+    
+    data = sorted(rows.values(), key=lambda r: (r.publication or "", r.subject or ""))
+    for row in data:
+        row.total_sell_through = sell_through(row.total_sold, row.total_qty)
+    
+    return data
+
+
+def sell_through(sold_qty, on_hand_qty):
+    """Share of the available stock (sold + on hand) that has been sold"""
+    available = flt(sold_qty) + flt(on_hand_qty)
+    return flt(flt(sold_qty) * 100 / available, 1) if available > 0 else 0
+
+
+def class_fieldname(class_name):
+    return "class_" + frappe.scrub(class_name)
+
+
+def get_chart(grouped, classes):
+    # On-hand quantity per class, in class order
+    qty_by_class = {}
+    for entry in grouped:
+        qty_by_class[entry.get("class")] = qty_by_class.get(entry.get("class"), 0) + flt(entry.qty)
+    
+    return {
+        "data": {
+            "labels": [cls.short_code or cls.name for cls in classes],
+            "datasets": [{"name": _("On Hand"), "values": [qty_by_class.get(cls.name, 0) for cls in classes]}]
+        },
+        "type": "bar",
+        "colors": ["#5e64ff"]
+    }
+
+
+def get_summary(data):
+    total_stock = sum(flt(row.total_qty) for row in data)
+    total_value = sum(flt(row.total_value) for row in data)
+    total_sold = sum(flt(row.total_sold) for row in data)
+    
+    return [
+        {"label": _("Publication / Subject Rows"), "value": cint(len(data)), "indicator": "blue"},
+        {"label": _("Total Stock Qty"), "value": total_stock, "indicator": "green"},
+        {"label": _("Total Stock Value"), "value": frappe.format_value(total_value, {"fieldtype": "Currency"}), "indicator": "orange"},
+        {"label": _("Sell-Through"), "value": f"{sell_through(total_sold, total_stock)}%", "indicator": "blue"},
+    ]
@@ -0,0 +1,108 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import flt, cint
+
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    data = get_data(filters)
+    
+    return get_columns(), data, None, get_chart(data), get_summary(data)
+
+
+def get_columns():
+    return [
+        {"label": _("Item"), "fieldname": "item_code", "fieldtype": "Link", "options": "Item", "width": 200},
+        {"label": _("Publication"), "fieldname": "publication", "fieldtype": "Link", "options": "Publication", "width": 130},
+        {"label": _("Subject"), "fieldname": "subject", "fieldtype": "Link", "options": "Subject", "width": 110},
+        {"label": _("Class"), "fieldname": "class", "fieldtype": "Link", "options": "Class Master", "width": 90},
+        {"label": _("Schools"), "fieldname": "schools", "fieldtype": "Int", "width": 80},
+        {"label": _("Ordered by Schools"), "fieldname": "required_qty", "fieldtype": "Float", "width": 130},
+        {"label": _("Shortfall"), "fieldname": "shortfall_qty", "fieldtype": "Float", "width": 100},
+        {"label": _("On Hand"), "fieldname": "actual_qty", "fieldtype": "Float", "width": 90},
+        {"label": _("Reserved"), "fieldname": "reserved_qty", "fieldtype": "Float", "width": 90},
+        {"label": _("On Purchase Order"), "fieldname": "ordered_qty", "fieldtype": "Float", "width": 130},
+        {"label": _("To Purchase"), "fieldname": "to_purchase_qty", "fieldtype": "Float", "width": 110},
+    ]
+
+
+def get_data(filters):
+    """Shortfall of open school orders per item, totalled across classes and schools before comparing with stock
+    
+    Each order worked out its own shortfall against the whole stock, so orders
+    that each fit stock alone could together hide a shortfall. Titles whose
+    Sales Order is submitted are left out, as their quantity is already
+    reserved in Bin and subtracted from stock on hand.
+    """
+    values = {}
+    conditions = ""
+    for fieldname, column in (("customer", "o.customer"), ("company", "o.company"), ("publication", "t.publication")):
+        if filters.get(fieldname):
+            conditions += f" AND {column} = %({fieldname})s"
+            values[fieldname] = filters.get(fieldname)
+    if filters.get("from_date"):
+        conditions += " AND o.transaction_date >= %(from_date)s"
+        values["from_date"] = filters.from_date
+    if filters.get("to_date"):
+        conditions += " AND o.transaction_date <= %(to_date)s"
+        values["to_date"] = filters.to_date
+    company_condition = "AND w.company = %(company)s" if filters.get("company") else ""
+    
+    data = frappe.db.sql(f"""
+        SELECT
+            t.item_code, MAX(t.publication) as publication, MAX(t.subject) as subject,
+            MAX(t.`class`) as `class`,
+            COUNT(DISTINCT o.customer) as schools,
+            SUM(t.required_qty) as required_qty,
+            COALESCE(MAX(bin.actual_qty), 0) as actual_qty,
+            COALESCE(MAX(bin.reserved_qty), 0) as reserved_qty,
+            COALESCE(MAX(bin.ordered_qty), 0) as ordered_qty
+        FROM `tabSchool Book Order Title` t
+        INNER JOIN `tabSchool Book Order` o ON o.name = t.parent
+        LEFT JOIN `tabSales Order` so ON so.name = t.sales_order
+        LEFT JOIN `tabClass Master` cm ON cm.name = t.`class`
+        LEFT JOIN (
+            SELECT b.item_code, SUM(b.actual_qty) as actual_qty, SUM(b.reserved_qty) as reserved_qty,
+                SUM(b.ordered_qty) as ordered_qty
+            FROM `tabBin` b
+            INNER JOIN `tabWarehouse` w ON w.name = b.warehouse {company_condition}
+            GROUP BY b.item_code
+        ) bin ON bin.item_code = t.item_code
+        WHERE o.docstatus = 1 AND t.parenttype = 'School Book Order' AND t.item_code IS NOT NULL
+            AND (so.name IS NULL OR so.docstatus = 0) {conditions}
+        GROUP BY t.item_code
+        ORDER BY publication, MAX(cm.sort_order), subject
+    """, values, as_dict=True)
+    
+    for row in data:
+        row.shortfall_qty = max(flt(row.required_qty) - max(flt(row.actual_qty) - flt(row.reserved_qty), 0), 0)
+        row.to_purchase_qty = max(row.shortfall_qty - flt(row.ordered_qty), 0)
+    
+    return [row for row in data if row.shortfall_qty > 0]
+
+
+def get_chart(data):
+    # Shortfall per publication
+    shortfall = {}
+    for row in data:
+        shortfall[row.publication] = shortfall.get(row.publication, 0) + flt(row.shortfall_qty)
+    
+    return {
+        "data": {
+            "labels": list(shortfall),
+            "datasets": [{"name": _("Shortfall"), "values": list(shortfall.values())}]
+        },
+        "type": "bar",
+        "colors": ["#ff5858"]
+    }
+
+
+def get_summary(data):
+    return [
+        {"label": _("Items Short"), "value": cint(len(data)), "indicator": "red" if data else "green"},
+        {"label": _("Total Shortfall"), "value": sum(flt(row.shortfall_qty) for row in data), "indicator": "orange"},
+        {"label": _("To Purchase"), "value": sum(flt(row.to_purchase_qty) for row in data), "indicator": "blue"},
+    ]
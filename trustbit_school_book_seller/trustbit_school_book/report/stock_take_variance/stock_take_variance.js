@@ -0,0 +1,27 @@
+// Copyright (c) 2024, Trustbit and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Stock Take Variance"] = {
+    "filters": [
+        {
+            "fieldname": "stock_take",
+            "label": __("Stock Take"),
+            "fieldtype": "Link",
+            "options": "Book Stock Take",
+            "reqd": 1
+        },
+        {
+            "fieldname": "warehouse",
+            "label": __("Warehouse"),
+            "fieldtype": "Link",
+            "options": "Warehouse"
+        },
+        {
+            "fieldname": "group_by",
+            "label": __("Group By"),
+            "fieldtype": "Select",
+            "options": "Publication and Class\nItem",
+            "default": "Publication and Class"
+        }
+    ]
+};
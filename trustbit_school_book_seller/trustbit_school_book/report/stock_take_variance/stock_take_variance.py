@@ -0,0 +1,124 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import flt
+from trustbit_school_book_seller.trustbit_school_book.doctype.book_stock_take.book_stock_take import get_variances
+
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    if not filters.get("stock_take"):
+        return get_columns(filters), []
+    
+    doc = frappe.get_doc("Book Stock Take", filters.stock_take)
+    doc.check_permission("read")
+    
+    rows = get_posted_variances(doc) if doc.docstatus == 1 else get_open_variances(doc)
+    if filters.get("warehouse"):
+        rows = [row for row in rows if row.warehouse == filters.warehouse]
+    
+    data = group_rows(rows, filters.get("group_by") or "Publication and Class")
+    
+    return get_columns(filters), data, None, get_chart(data), get_summary(data)
+
+
+def get_columns(filters):
+    columns = [
+        {"label": _("Publication"), "fieldname": "publication", "fieldtype": "Link", "options": "Publication", "width": 140},
+        {"label": _("Class"), "fieldname": "class", "fieldtype": "Link", "options": "Class Master", "width": 100},
+    ]
+    if filters.get("group_by") == "Item":
+        columns += [
+            {"label": _("Item"), "fieldname": "item_code", "fieldtype": "Link", "options": "Item", "width": 200},
+            {"label": _("Warehouse"), "fieldname": "warehouse", "fieldtype": "Link", "options": "Warehouse", "width": 140},
+        ]
+    else:
+        columns.append({"label": _("Items"), "fieldname": "items", "fieldtype": "Int", "width": 80})
+    
+    return columns + [
+        {"label": _("System Qty"), "fieldname": "system_qty", "fieldtype": "Float", "width": 110},
+        {"label": _("Counted Qty"), "fieldname": "counted_qty", "fieldtype": "Float", "width": 110},
+        {"label": _("Variance Qty"), "fieldname": "variance_qty", "fieldtype": "Float", "width": 110},
+        {"label": _("Variance Value"), "fieldname": "variance_value", "fieldtype": "Currency", "width": 130},
+    ]
+
+
+def get_open_variances(doc):
+    """Live comparison of the scans with Bin while the session is still counting"""
+    return [row for row in get_variances(doc) if flt(row.counted_qty) != flt(row.system_qty)]
+
+
+def get_posted_variances(doc):
+    """Quantities as posted, read from the session's Stock Reconciliations since Bin has moved on"""
+    reconciliations = [row.stock_reconciliation for row in doc.warehouses if row.stock_reconciliation]
+    if not reconciliations:
+        return []
+    
+    return frappe.db.sql("""
+        SELECT
+            sri.warehouse, sri.item_code, i.custom_publication as publication, i.custom_class as class,
+            sri.qty as counted_qty, sri.current_qty as system_qty, sri.valuation_rate
+        FROM `tabStock Reconciliation Item` sri
+        INNER JOIN `tabStock Reconciliation` sr ON sr.name = sri.parent
+        INNER JOIN `tabItem` i ON i.name = sri.item_code
+        WHERE sr.name IN %(reconciliations)s AND sr.docstatus = 1
+    """, {"reconciliations": reconciliations}, as_dict=True)
+
+
+def group_rows(rows, group_by):
+    groups = {}
+    for row in rows:
+        if group_by == "Item":
+            key = (row.item_code, row.warehouse)
+        else:
+            key = (row.publication, row.get("class"))
+        
+        group = groups.setdefault(key, frappe._dict({
+            "publication": row.publication,
+            "class": row.get("class"),
+            "item_code": row.item_code,
+            "warehouse": row.warehouse,
+            "items": 0,
+            "system_qty": 0,
+            "counted_qty": 0,
+            "variance_qty": 0,
+            "variance_value": 0
+        }))
+        variance = flt(row.counted_qty) - flt(row.system_qty)
+        group["items"] += 1
+        group["system_qty"] += flt(row.system_qty)
+        group["counted_qty"] += flt(row.counted_qty)
+        group["variance_qty"] += variance
+        group["variance_value"] += variance * flt(row.valuation_rate)
+    
+    return sorted(groups.values(), key=lambda group: (group.publication or "", group.get("class") or "", group.item_code or ""))
+
+
+def get_chart(data):
+    # Net variance per publication
+    variance = {}
+    for row in data:
+        variance[row.publication] = variance.get(row.publication, 0) + flt(row.variance_qty)
+    
+    return {
+        "data": {
+            "labels": list(variance),
+            "datasets": [{"name": _("Variance Qty"), "values": list(variance.values())}]
+        },
+        "type": "bar",
+        "colors": ["#ff5858"]
+    }
+
+
+def get_summary(data):
+    short = sum(flt(row.variance_qty) for row in data if flt(row.variance_qty) < 0)
+    excess = sum(flt(row.variance_qty) for row in data if flt(row.variance_qty) > 0)
+    
+    return [
+        {"label": _("Items with Variance"), "value": sum(row["items"] for row in data), "indicator": "blue"},
+        {"label": _("Short Qty"), "value": -short, "indicator": "red" if short else "green"},
+        {"label": _("Excess Qty"), "value": excess, "indicator": "orange" if excess else "green"},
+        {"label": _("Variance Value"), "value": sum(flt(row.variance_value) for row in data), "indicator": "blue"},
+    ]
@@ -0,0 +1,142 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import hashlib
+import json
+
+import frappe
+from frappe import _
+from frappe.utils import cint
+
+
+# Seconds a cached report result stays valid, override with
+# "book_report_cache_ttl" in site config
+REPORT_CACHE_TTL = 600
+
+CACHE_PREFIX = "book_report_cache"
+
+
+def get_cached_report(report_name, filters, build):
+    """Return (result, cache_hit) for a report, building and caching it on a miss"""
+    filters = normalize_filters(filters)
+    key = get_cache_key(report_name, filters)
+    cache = frappe.cache()
+    
+    result = cache.get_value(key)
+    if result is not None:
+        return result, True
+    
+    result = build(frappe._dict(filters))
+    ttl = cint(frappe.conf.get("book_report_cache_ttl")) or REPORT_CACHE_TTL
+    cache.set_value(key, result, expires_in_sec=ttl)
+    
+    # Tag the entry so it can be dropped when its publication or subject changes
+    for tag in (
+        get_tag_key("publication", filters.get("publication")),
+        get_tag_key("subject", filters.get("subject"))
+    ):
+        cache.sadd(tag, key)
+        cache.expire(cache.make_key(tag), ttl)
+    
+    return result, False
+
+
+def get_cache_indicator(cache_hit):
+    """Summary card showing whether the report came from cache"""
+    return {
+        "label": _("Cache"),
+        "value": _("Hit") if cache_hit else _("Miss"),
+        "indicator": "green" if cache_hit else "grey"
+    }
+
+
+def normalize_filters(filters):
+    """Drop empty filters and make values comparable so equal filters share a key"""
+    normalized = {}
+    for key, value in (filters or {}).items():
+        if value in (None, "", [], 0):
+            continue
+        if isinstance(value, (list, tuple)):
+            value = sorted(str(v) for v in value)
+        else:
+            value = str(value)
+        normalized[key] = value
+    
+    return normalized
+
+
+def get_cache_key(report_name, filters):
+    content = json.dumps({"filters": filters, "lang": frappe.local.lang}, sort_keys=True)
+    return f"{CACHE_PREFIX}:{frappe.scrub(report_name)}:{hashlib.sha1(content.encode()).hexdigest()}"
+
+
+def get_tag_key(fieldname, value):
+    # Results without a publication/subject filter are tagged "*" and
+    # are affected by a change to any of them
+    return f"{CACHE_PREFIX}:tag:{fieldname}:{value or '*'}"
+
+
+def invalidate_report_cache(publication=None, subject=None):
+    """Drop cached results for a publication/subject once the transaction commits"""
+    if frappe.flags.book_report_cache_pending is None:
+        frappe.flags.book_report_cache_pending = set()
+        frappe.db.after_commit.add(flush_report_cache)
+        frappe.db.after_rollback.add(discard_pending_invalidations)
+    
+    frappe.flags.book_report_cache_pending.add((publication, subject))
+
+
+def flush_report_cache():
+    """Delete every cached result whose filters cover a changed publication and subject"""
+    pending = frappe.flags.book_report_cache_pending or set()
+    frappe.flags.book_report_cache_pending = None
+    
+    cache = frappe.cache()
+    members = {}
+    
+    def get_members(tag):
+        if tag not in members:
+            members[tag] = {frappe.safe_decode(key) for key in cache.smembers(tag)}
+        return members[tag]
+    
+    keys = set()
+    for publication, subject in pending:
+        by_publication = get_members(get_tag_key("publication", publication)) | get_members(get_tag_key("publication", None))
+        by_subject = get_members(get_tag_key("subject", subject)) | get_members(get_tag_key("subject", None))
+        keys |= by_publication & by_subject
+    
+    if keys:
+        cache.delete_value(list(keys))
+
+
+def clear_report_cache():
+    """Delete every cached report result, for changes that touch all book items"""
+    frappe.cache().delete_keys(f"{CACHE_PREFIX}:")
+
+
+def discard_pending_invalidations():
+    frappe.flags.book_report_cache_pending = None
+
+
+def on_stock_ledger_entry(doc, method=None):
+    """Invalidate cached reports when stock of a book item moves"""
+    item = frappe.get_cached_value(
+        "Item",
+        doc.item_code,
+        ["custom_book_item_creator", "custom_publication", "custom_subject"],
+        as_dict=True
+    )
+    if item and item.custom_book_item_creator:
+        invalidate_report_cache(item.custom_publication, item.custom_subject)
+
+
+def on_item_price_change(doc, method=None):
+    """Invalidate cached reports when the price of a book item is changed or deleted"""
+    item = frappe.get_cached_value(
+        "Item",
+        doc.item_code,
+        ["custom_book_item_creator", "custom_publication", "custom_subject"],
+        as_dict=True
+    )
+    if item and item.custom_book_item_creator:
+        invalidate_report_cache(item.custom_publication, item.custom_subject)
@@ -0,0 +1,213 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import json
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt, today
+from trustbit_school_book_seller.trustbit_school_book.season import get_season
+
+
+def get_return_plan(filters):
+    """Returnable quantity of every book item per warehouse, matched to the receipts it came in on
+    
+    Stock above the minimum holding (the Item Reorder level of the warehouse, or
+    the Keep Qty filter if higher) is returnable. It is matched to the supplier's
+    receipts of the season, latest first, up to the quantity not yet returned.
+    Quantities on draft returns count as returned, so returns are never raised
+    twice for the same stock.
+    """
+    filters = frappe._dict(filters)
+    filters.from_date = filters.get("from_date") or get_season(filters.get("date")).year_start_date
+    
+    stock = get_returnable_stock(filters)
+    receipts = get_open_receipt_items(filters, stock)
+    
+    lines = []
+    for row in stock:
+        row.returnable_qty = max(
+            flt(row.actual_qty) - flt(row.draft_return_qty) - flt(row.reserved_qty)
+            - max(flt(row.min_qty), flt(filters.get("keep_qty"))), 0
+        )
+        remaining = row.returnable_qty
+        for receipt_item in receipts.get((row.item_code, row.warehouse, row.supplier), []):
+            if remaining <= 0:
+                break
+            qty = min(remaining, flt(receipt_item.open_qty) - flt(receipt_item.allocated_qty))
+            if qty <= 0:
+                continue
+            receipt_item.allocated_qty = flt(receipt_item.allocated_qty) + qty
+            remaining -= qty
+            lines.append(frappe._dict({
+                **row,
+                "return_qty": qty,
+                "purchase_receipt": receipt_item.parent,
+                "purchase_receipt_item": receipt_item.name,
+                "rate": receipt_item.rate,
+                "amount": qty * flt(receipt_item.rate)
+            }))
+        
+        # Stock that did not come in on a receipt of the season stays on the shelf
+        if remaining > 0:
+            lines.append(frappe._dict({**row, "return_qty": 0, "unmatched_qty": remaining, "rate": 0, "amount": 0}))
+    
+    return lines
+
+
+def get_returnable_stock(filters):
+    """Stock, reservations and minimum holding per book item and warehouse, in one grouped query"""
+    values = {"company": filters.company}
+    conditions = ""
+    for fieldname in ("publication", "subject", "class"):
+        if filters.get(fieldname):
+            conditions += f" AND i.custom_{fieldname} = %({fieldname})s"
+            values[fieldname] = filters.get(fieldname)
+    if filters.get("warehouse"):
+        conditions += " AND b.warehouse = %(warehouse)s"
+        values["warehouse"] = filters.warehouse
+    
+    return frappe.db.sql(f"""
+        SELECT
+            b.item_code, b.warehouse, i.item_name, i.stock_uom,
+            i.custom_publication as publication, i.custom_subject as subject,
+            i.custom_class as class, p.supplier,
+            b.actual_qty, b.reserved_qty, COALESCE(reorder.min_qty, 0) as min_qty,
+            COALESCE(drafts.qty, 0) as draft_return_qty
+        FROM `tabBin` b
+        INNER JOIN `tabItem` i ON i.name = b.item_code
+        INNER JOIN `tabWarehouse` w ON w.name = b.warehouse AND w.company = %(company)s
+        LEFT JOIN `tabPublication` p ON p.name = i.custom_publication
+        LEFT JOIN `tabClass Master` cm ON cm.name = i.custom_class
+        LEFT JOIN (
+            SELECT parent, warehouse, MAX(warehouse_reorder_level) as min_qty
+            FROM `tabItem Reorder`
+            WHERE parenttype = 'Item'
+            GROUP BY parent, warehouse
+        ) reorder ON reorder.parent = b.item_code AND reorder.warehouse = b.warehouse
+        LEFT JOIN (
+            SELECT pri.item_code, pri.warehouse, -SUM(pri.stock_qty) as qty
+            FROM `tabPurchase Receipt Item` pri
+            INNER JOIN `tabPurchase Receipt` pr ON pr.name = pri.parent
+            WHERE pr.docstatus = 0 AND pr.is_return = 1 AND pr.company = %(company)s
+            GROUP BY pri.item_code, pri.warehouse
+        ) drafts ON drafts.item_code = b.item_code AND drafts.warehouse = b.warehouse
+        WHERE i.custom_book_item_creator IS NOT NULL AND b.actual_qty > 0 {conditions}
+        ORDER BY i.custom_publication, cm.sort_order, i.custom_subject, i.name, b.warehouse
+    """, values, as_dict=True)
+
+
+def get_open_receipt_items(filters, stock):
+    """Receipt items of the season not yet returned or on a draft return, per item, warehouse and supplier, latest first"""
+    if not stock:
+        return {}
+    
+    receipts = {}
+    for receipt_item in frappe.db.sql("""
+        SELECT
+            pri.name, pri.parent, pri.item_code, pri.warehouse, pr.supplier,
+            pri.stock_qty - COALESCE(pri.returned_qty, 0) - COALESCE(drafts.qty, 0) as open_qty,
+            pri.rate / COALESCE(NULLIF(pri.conversion_factor, 0), 1) as rate
+        FROM `tabPurchase Receipt Item` pri
+        INNER JOIN `tabPurchase Receipt` pr ON pr.name = pri.parent
+        LEFT JOIN (
+            SELECT dri.purchase_receipt_item, -SUM(dri.stock_qty) as qty
+            FROM `tabPurchase Receipt Item` dri
+            INNER JOIN `tabPurchase Receipt` dr ON dr.name = dri.parent
+            WHERE dr.docstatus = 0 AND dr.is_return = 1 AND dri.purchase_receipt_item IS NOT NULL
+            GROUP BY dri.purchase_receipt_item
+        ) drafts ON drafts.purchase_receipt_item = pri.name
+        WHERE pr.docstatus = 1 AND pr.is_return = 0 AND pr.company = %(company)s
+            AND pr.posting_date >= %(from_date)s
+            AND pr.supplier IN %(suppliers)s AND pri.item_code IN %(items)s
+            AND pri.stock_qty > COALESCE(pri.returned_qty, 0) + COALESCE(drafts.qty, 0)
+        ORDER BY pr.posting_date DESC, pr.posting_time DESC, pri.idx
+    """, {
+        "company": filters.company,
+        "from_date": filters.from_date,
+        "suppliers": list({row.supplier for row in stock if row.supplier}) or [""],
+        "items": list({row.item_code for row in stock})
+    }, as_dict=True):
+        receipts.setdefault((receipt_item.item_code, receipt_item.warehouse, receipt_item.supplier), []).append(receipt_item)
+    
+    return receipts
+
+
+@frappe.whitelist()
+def create_publisher_returns(filters):
+    """Queue Purchase Returns, one per publication, for the returnable quantities"""
+    frappe.has_permission("Purchase Receipt", "create", throw=True)
+    
+    if isinstance(filters, str):
+        filters = json.loads(filters)
+    filters = frappe._dict(filters)
+    
+    if not filters.get("company"):
+        frappe.throw(_("Company is required to create Purchase Returns"))
+    
+    frappe.enqueue(
+        "trustbit_school_book_seller.trustbit_school_book.returns.make_publisher_returns",
+        queue="long",
+        timeout=3600,
+        filters=filters
+    )
+    
+    return {"message": _("Purchase Returns are being created in the background")}
+
+
+def make_publisher_returns(filters):
+    """Insert one Purchase Return per publication against the receipts its books came in on"""
+    filters = frappe._dict(filters)
+    by_publication = {}
+    for line in get_return_plan(filters):
+        if line.return_qty > 0:
+            by_publication.setdefault(line.publication, []).append(line)
+    
+    created, skipped, failed = [], [], []
+    total_qty = total_amount = 0
+    
+    for publication, lines in by_publication.items():
+        if not lines[0].supplier:
+            skipped.append(publication)
+            continue
+        
+        # A return covering a single receipt is linked to it as a whole
+        receipts = {line.purchase_receipt for line in lines}
+        
+        frappe.db.savepoint("book_publisher_return")
+        try:
+            purchase_return = frappe.get_doc({
+                "doctype": "Purchase Receipt",
+                "is_return": 1,
+                "return_against": receipts.pop() if len(receipts) == 1 else None,
+                "supplier": lines[0].supplier,
+                "company": filters.company,
+                "posting_date": today(),
+                "items": [{
+                    "item_code": line.item_code,
+                    "qty": -line.return_qty,
+                    "received_qty": -line.return_qty,
+                    "rate": line.rate,
+                    "uom": line.stock_uom,
+                    "conversion_factor": 1,
+                    "warehouse": line.warehouse,
+                    "purchase_receipt_item": line.purchase_receipt_item
+                } for line in lines]
+            })
+            purchase_return.insert()
+            if cint(filters.get("submit")):
+                purchase_return.submit()
+            created.append(purchase_return.name)
+            total_qty += sum(line.return_qty for line in lines)
+            total_amount += sum(line.amount for line in lines)
+        except Exception:
+            frappe.db.rollback(save_point="book_publisher_return")
+            failed.append(publication)
+            frappe.log_error(title=f"Book Publisher Return: {publication}", message=frappe.get_traceback())
+    
+    frappe.db.commit()
+    
+    summary = {"created": created, "skipped": skipped, "failed": failed, "qty": total_qty, "amount": total_amount}
+    frappe.publish_realtime("book_publisher_returns_complete", summary, user=frappe.session.user)
+    
+    return summary
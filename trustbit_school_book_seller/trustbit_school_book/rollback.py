@@ -0,0 +1,181 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from trustbit_school_book_seller.trustbit_school_book.report_cache import invalidate_report_cache
+
+
+# Child doctypes whose rows count as a transaction on an Item
+TRANSACTION_DOCTYPES = (
+    "Quotation Item",
+    "Sales Order Item",
+    "Delivery Note Item",
+    "Sales Invoice Item",
+    "POS Invoice Item",
+    "Material Request Item",
+    "Purchase Order Item",
+    "Purchase Receipt Item",
+    "Purchase Invoice Item",
+    "Stock Entry Detail",
+    "Stock Reconciliation Item",
+)
+
+
+def enqueue_rollback(docname):
+    """Queue the rollback of everything a cancelled Book Item Creator produced"""
+    frappe.enqueue(
+        "trustbit_school_book_seller.trustbit_school_book.rollback.rollback_book_items",
+        queue="long",
+        timeout=3600,
+        enqueue_after_commit=True,
+        docname=docname
+    )
+
+
+def rollback_book_items(docname):
+    """Cancel opening Stock Entries, drop Item Prices and delete or disable created Items"""
+    rows = frappe.get_all(
+        "Book Class Detail",
+        filters={
+            "parenttype": "Book Item Creator",
+            "parent": docname,
+            "creation_status": "Created",
+            "item_link": ["is", "set"]
+        },
+        fields=["name", "item_link", "stock_entry"]
+    )
+
+    outcomes = {}
+    if rows:
+        failed_entries = cancel_stock_entries({row.stock_entry for row in rows if row.stock_entry})
+        item_codes = [row.item_link for row in rows]
+
+        # Prices go for every rolled back item, deleted or disabled
+        delete_item_prices(item_codes)
+
+        in_use = get_items_with_transactions(item_codes)
+        deleted = delete_items([code for code in item_codes if code not in in_use])
+        disable_items([code for code in item_codes if code not in deleted])
+
+        for row in rows:
+            if row.stock_entry in failed_entries:
+                outcomes[row.name] = {
+                    "rollback_status": "Failed",
+                    "remarks": _("Stock Entry {0} could not be cancelled: {1}").format(
+                        row.stock_entry, failed_entries[row.stock_entry]
+                    )[:200]
+                }
+            elif row.item_link in deleted:
+                outcomes[row.name] = {"rollback_status": "Deleted", "remarks": _("Item deleted on cancel")}
+            else:
+                outcomes[row.name] = {
+                    "rollback_status": "Disabled",
+                    "remarks": _("Item disabled on cancel, it has transactions")
+                }
+
+        frappe.db.bulk_update("Book Class Detail", outcomes, update_modified=False)
+
+    frappe.db.set_value("Book Item Creator", docname, "status", "Cancelled", update_modified=False)
+    invalidate_report_cache(*frappe.db.get_value("Book Item Creator", docname, ["publication", "subject"]))
+    frappe.db.commit()
+
+    summary = {
+        "docname": docname,
+        "deleted": len([o for o in outcomes.values() if o["rollback_status"] == "Deleted"]),
+        "disabled": len([o for o in outcomes.values() if o["rollback_status"] == "Disabled"]),
+        "failed": len([o for o in outcomes.values() if o["rollback_status"] == "Failed"])
+    }
+    frappe.publish_realtime("book_item_rollback_complete", summary, user=frappe.session.user)
+
+    return summary
+
+
+def cancel_stock_entries(stock_entries):
+    """Cancel each submitted Stock Entry once, returning the ones that failed"""
+    failed = {}
+    if not stock_entries:
+        return failed
+
+    submitted = frappe.get_all(
+        "Stock Entry",
+        filters={"name": ["in", list(stock_entries)], "docstatus": 1},
+        pluck="name"
+    )
+
+    for name in submitted:
+        frappe.db.savepoint("book_rollback_stock_entry")
+        try:
+            stock_entry = frappe.get_doc("Stock Entry", name)
+            stock_entry.flags.ignore_permissions = True
+            stock_entry.cancel()
+        except Exception as e:
+            frappe.db.rollback(save_point="book_rollback_stock_entry")
+            failed[name] = str(e)
+            frappe.log_error(title=f"Book Rollback: Stock Entry {name}", message=frappe.get_traceback())
+
+    return failed
+
+
+def get_items_with_transactions(item_codes):
+    """Get the subset of items referenced by any live transaction, in one query"""
+    if not item_codes:
+        return set()
+
+    queries = [
+        "SELECT item_code FROM `tabStock Ledger Entry` WHERE item_code IN %(items)s AND is_cancelled = 0"
+    ]
+    queries += [
+        f"SELECT item_code FROM `tab{doctype}` WHERE item_code IN %(items)s AND docstatus < 2"
+        for doctype in TRANSACTION_DOCTYPES
+    ]
+
+    return set(frappe.db.sql_list(" UNION ".join(queries), {"items": item_codes}))
+
+
+def delete_item_prices(item_codes):
+    """Delete the Item Prices of the given items, leaving a Deleted Document for each like delete_doc does"""
+    prices = frappe.get_all("Item Price", filters={"item_code": ["in", item_codes]}, fields=["*"])
+    if not prices:
+        return
+
+    now = frappe.utils.now()
+    user = frappe.session.user
+    frappe.db.bulk_insert(
+        "Deleted Document",
+        ["name", "deleted_name", "deleted_doctype", "data", "restored", "creation", "modified", "owner", "modified_by"],
+        [[
+            frappe.generate_hash(length=10), price.name, "Item Price",
+            frappe.as_json({"doctype": "Item Price", **price}), 0, now, now, user, user
+        ] for price in prices]
+    )
+    frappe.db.delete("Item Price", {"name": ["in", [price.name for price in prices]]})
+
+
+def delete_items(item_codes):
+    """Delete items one by one, skipping any that are still linked elsewhere"""
+    deleted = set()
+    for item_code in item_codes:
+        frappe.db.savepoint("book_rollback_item")
+        try:
+            frappe.delete_doc("Item", item_code, ignore_permissions=True)
+            deleted.add(item_code)
+        except Exception:
+            frappe.db.rollback(save_point="book_rollback_item")
+
+    return deleted
+
+
+def disable_items(item_codes):
+    """Disable all given items in one statement"""
+    if not item_codes:
+        return
+
+    frappe.db.sql("""
+        UPDATE `tabItem`
+        SET disabled = 1, modified = %(now)s, modified_by = %(user)s
+        WHERE name IN %(items)s
+    """, {"items": item_codes, "now": frappe.utils.now(), "user": frappe.session.user})
+
+    for item_code in item_codes:
+        frappe.clear_document_cache("Item", item_code)
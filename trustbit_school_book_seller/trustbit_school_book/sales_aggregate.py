@@ -0,0 +1,144 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import json
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+from trustbit_school_book_seller.trustbit_school_book.report_cache import invalidate_report_cache
+
+
+WATERMARK_KEY = "trustbit_school_book_seller_sales_daily_watermark"
+
+# Ledger rows read per aggregation pass
+AGGREGATE_BATCH_SIZE = 20000
+
+# Rows younger than this are left for the next run, so entries from
+# transactions still open when a batch is read are not skipped
+SAFETY_LAG_SECONDS = 300
+
+EPOCH = ("1900-01-01 00:00:00", "")
+
+SALES_VOUCHER_TYPES = ("Delivery Note", "Sales Invoice", "POS Invoice")
+
+
+def update_sales_daily():
+    """Scheduled job folding Stock Ledger Entries posted since the last run into Book Sales Daily"""
+    cutoff = add_to_date(now_datetime(), seconds=-SAFETY_LAG_SECONDS)
+    batches = 0
+    
+    while True:
+        watermark = get_watermark()
+        boundary = frappe.db.sql("""
+            SELECT creation, name FROM (
+                SELECT creation, name
+                FROM `tabStock Ledger Entry`
+                WHERE (creation > %(creation)s OR (creation = %(creation)s AND name > %(name)s))
+                    AND creation < %(cutoff)s
+                ORDER BY creation, name
+                LIMIT %(batch_size)s
+            ) batch
+            ORDER BY creation DESC, name DESC
+            LIMIT 1
+        """, {
+            "creation": watermark[0],
+            "name": watermark[1],
+            "cutoff": cutoff,
+            "batch_size": AGGREGATE_BATCH_SIZE
+        }, as_dict=True)
+        if not boundary:
+            break
+        
+        aggregate_range(watermark, (str(boundary[0].creation), boundary[0].name))
+        frappe.db.commit()
+        batches += 1
+    
+    return batches
+
+
+def aggregate_range(start, end):
+    """Add ledger rows after start up to and including end into the daily aggregate"""
+    values = {
+        "start_creation": start[0],
+        "start_name": start[1],
+        "end_creation": end[0],
+        "end_name": end[1],
+        "sales_voucher_types": SALES_VOUCHER_TYPES,
+        "now": now_datetime(),
+        "user": frappe.session.user,
+    }
+    
+    # Cancelled entries are included on purpose: a cancellation adds a
+    # reversing row, so summing every row nets the cancelled posting out.
+    # Receipts only count inbound rows, so the reversing row of a receipt,
+    # told apart from a cancelled original by the earlier row it mirrors,
+    # is counted too whatever its sign.
+    # The name is derived from the key, so a day/item/warehouse seen again
+    # hits the primary key and is added to the existing totals.
+    frappe.db.sql("""
+        INSERT INTO `tabBook Sales Daily` (
+            name, posting_date, item_code, warehouse, publication, subject, class,
+            sold_qty, received_qty, cost_of_sales, creation, modified, owner, modified_by
+        )
+        SELECT
+            MD5(CONCAT_WS('|', sle.posting_date, sle.item_code, sle.warehouse)),
+            sle.posting_date, sle.item_code, sle.warehouse,
+            i.custom_publication, i.custom_subject, i.custom_class,
+            SUM(CASE WHEN sle.voucher_type IN %(sales_voucher_types)s THEN -sle.actual_qty ELSE 0 END),
+            SUM(CASE
+                WHEN sle.voucher_type IN %(sales_voucher_types)s THEN 0
+                WHEN sle.is_cancelled = 1 AND EXISTS (
+                    SELECT 1 FROM `tabStock Ledger Entry` original
+                    WHERE original.voucher_type = sle.voucher_type AND original.voucher_no = sle.voucher_no
+                        AND original.voucher_detail_no <=> sle.voucher_detail_no
+                        AND original.item_code = sle.item_code AND original.warehouse = sle.warehouse
+                        AND original.actual_qty = -sle.actual_qty
+                        AND (original.creation < sle.creation OR (original.creation = sle.creation AND original.name < sle.name))
+                ) THEN LEAST(sle.actual_qty, 0)
+                ELSE GREATEST(sle.actual_qty, 0)
+            END),
+            SUM(CASE WHEN sle.voucher_type IN %(sales_voucher_types)s THEN -sle.stock_value_difference ELSE 0 END),
+            %(now)s, %(now)s, %(user)s, %(user)s
+        FROM `tabStock Ledger Entry` sle
+        INNER JOIN `tabItem` i ON i.name = sle.item_code
+        WHERE i.custom_book_item_creator IS NOT NULL
+            AND (sle.creation > %(start_creation)s OR (sle.creation = %(start_creation)s AND sle.name > %(start_name)s))
+            AND (sle.creation < %(end_creation)s OR (sle.creation = %(end_creation)s AND sle.name <= %(end_name)s))
+        GROUP BY sle.posting_date, sle.item_code, sle.warehouse
+        ON DUPLICATE KEY UPDATE
+            sold_qty = sold_qty + VALUES(sold_qty),
+            received_qty = received_qty + VALUES(received_qty),
+            cost_of_sales = cost_of_sales + VALUES(cost_of_sales),
+            modified = VALUES(modified)
+    """, values)
+    
+    touched = frappe.db.sql("""
+        SELECT DISTINCT i.custom_publication, i.custom_subject
+        FROM `tabStock Ledger Entry` sle
+        INNER JOIN `tabItem` i ON i.name = sle.item_code
+        WHERE i.custom_book_item_creator IS NOT NULL
+            AND (sle.creation > %(start_creation)s OR (sle.creation = %(start_creation)s AND sle.name > %(start_name)s))
+            AND (sle.creation < %(end_creation)s OR (sle.creation = %(end_creation)s AND sle.name <= %(end_name)s))
+    """, values)
+    for publication, subject in touched:
+        invalidate_report_cache(publication, subject)
+    
+    set_watermark(end)
+
+
+def get_watermark():
+    watermark = frappe.db.get_global(WATERMARK_KEY)
+    return tuple(json.loads(watermark)) if watermark else EPOCH
+
+
+def set_watermark(position):
+    frappe.db.set_global(WATERMARK_KEY, json.dumps(list(position)))
+
+
+def rebuild_sales_daily():
+    """Drop the aggregate and rebuild it from the whole ledger, e.g. after item masters were re-linked"""
+    frappe.db.delete("Book Sales Daily")
+    set_watermark(EPOCH)
+    frappe.db.commit()
+    
+    return update_sales_daily()
@@ -0,0 +1,199 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import re
+
+import frappe
+from frappe.utils import cint, now_datetime
+from trustbit_school_book_seller.trustbit_school_book.pricing import get_effective_prices
+
+
+DEFAULT_RESULT_LIMIT = 20
+MAX_RESULT_LIMIT = 100
+REBUILD_BATCH_SIZE = 1000
+
+# Query tokens shorter than this only match whole tokens, so "7"
+# finds class 7 without also matching 70, 71...
+MIN_PREFIX_LENGTH = 2
+
+# Indexed tokens at least this long also match longer query words
+# they are a prefix of, so "maths" finds the "math" subject code
+MIN_STEM_LENGTH = 3
+
+# Weight of a token by where it came from; hits are ranked by the sum
+TOKEN_WEIGHTS = {
+    "isbn": 10,
+    "code": 3,
+    "name": 2,
+    "master": 1,
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Master doctypes whose code is a search synonym, with the Item field linking them
+SYNONYM_SOURCES = {
+    "Publication": ("publication_code", "custom_publication"),
+    "Subject": ("short_code", "custom_subject"),
+    "Class Master": ("short_code", "custom_class"),
+}
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or "").lower())
+
+
+def get_item_tokens(item, synonyms):
+    """Map each search token of an item to its weight"""
+    tokens = {}
+    
+    def add(text, weight):
+        for token in tokenize(text):
+            tokens[token[:140]] = max(tokens.get(token[:140], 0), weight)
+    
+    add(item.item_name, TOKEN_WEIGHTS["name"])
+    for doctype, (code_field, item_field) in SYNONYM_SOURCES.items():
+        add(item.get(item_field), TOKEN_WEIGHTS["master"])
+        add(synonyms[doctype].get(item.get(item_field)), TOKEN_WEIGHTS["code"])
+    add(item.custom_isbn_barcode, TOKEN_WEIGHTS["isbn"])
+    
+    return tokens
+
+
+def get_synonyms():
+    """Code of every publication, subject and class, keyed by doctype and name"""
+    return {
+        doctype: dict(frappe.get_all(doctype, fields=["name", code_field], as_list=True))
+        for doctype, (code_field, item_field) in SYNONYM_SOURCES.items()
+    }
+
+
+def index_items(items):
+    """Replace the tokens of the given items in one delete and one bulk insert"""
+    if not items:
+        return
+    
+    synonyms = get_synonyms()
+    now = now_datetime()
+    user = frappe.session.user
+    values = []
+    for item in items:
+        for token, weight in get_item_tokens(item, synonyms).items():
+            values.append([frappe.generate_hash(length=10), token, item.name, weight, now, now, user, user])
+    
+    frappe.db.delete("Book Search Token", {"item_code": ["in", [item.name for item in items]]})
+    frappe.db.bulk_insert(
+        "Book Search Token",
+        ["name", "token", "item_code", "weight", "creation", "modified", "owner", "modified_by"],
+        values
+    )
+
+
+def get_indexable_items(filters):
+    return frappe.get_all(
+        "Item",
+        filters={"custom_book_item_creator": ["is", "set"], **filters},
+        fields=[
+            "name", "item_name", "custom_publication", "custom_subject",
+            "custom_class", "custom_isbn_barcode"
+        ]
+    )
+
+
+def on_item_update(doc, method=None):
+    """Keep the tokens of a book item current as it is created or edited"""
+    if doc.get("custom_book_item_creator"):
+        index_items([doc])
+
+
+def on_item_trash(doc, method=None):
+    frappe.db.delete("Book Search Token", {"item_code": doc.name})
+
+
+def on_master_update(doc, method=None):
+    """Re-index items of a publication, subject or class whose code changed"""
+    code_field, item_field = SYNONYM_SOURCES[doc.doctype]
+    if doc.has_value_changed(code_field) and not doc.is_new():
+        frappe.enqueue(
+            "trustbit_school_book_seller.trustbit_school_book.search_index.rebuild_search_index",
+            queue="long",
+            timeout=3600,
+            enqueue_after_commit=True,
+            filters={item_field: doc.name}
+        )
+
+
+def rebuild_search_index(filters=None):
+    """Rebuild tokens of all book items, or those matching filters, in batches"""
+    item_codes = frappe.get_all(
+        "Item",
+        filters={"custom_book_item_creator": ["is", "set"], **(filters or {})},
+        pluck="name",
+        order_by="name"
+    )
+    if not filters:
+        frappe.db.delete("Book Search Token")
+    
+    for start in range(0, len(item_codes), REBUILD_BATCH_SIZE):
+        batch = item_codes[start:start + REBUILD_BATCH_SIZE]
+        index_items(get_indexable_items({"name": ["in", batch]}))
+        frappe.db.commit()
+    
+    return len(item_codes)
+
+
+@frappe.whitelist()
+def search_books(query, limit=DEFAULT_RESULT_LIMIT, price_list=None, warehouse=None):
+    """Ranked book items matching every word of the query, with the price in effect today and stock"""
+    frappe.has_permission("Item", "read", throw=True)
+    
+    tokens = list(dict.fromkeys(tokenize(query)))[:8]
+    if not tokens:
+        return []
+    
+    limit = min(max(cint(limit), 1), MAX_RESULT_LIMIT)
+    price_list = price_list or frappe.db.get_single_value("Selling Settings", "selling_price_list")
+    values = {"limit": limit, "warehouse": warehouse}
+    
+    # One condition per query token; an item must match all of them.
+    # Tokens are [a-z0-9] only, so they need no LIKE escaping
+    matches = []
+    for i, token in enumerate(tokens):
+        if len(token) < MIN_PREFIX_LENGTH:
+            matches.append(f"s.token = %(token_{i})s")
+            values[f"token_{i}"] = token
+        else:
+            matches.append(f"(s.token LIKE %(token_{i})s OR s.token IN %(stems_{i})s)")
+            values[f"token_{i}"] = token + "%"
+            values[f"stems_{i}"] = [token[:end] for end in range(MIN_STEM_LENGTH, len(token))] or [token]
+    
+    matched_count = " + ".join(f"MAX({match})" for match in matches)
+    warehouse_condition = "AND b.warehouse = %(warehouse)s" if warehouse else ""
+    
+    results = frappe.db.sql(f"""
+        SELECT
+            hits.item_code, i.item_name, i.custom_publication as publication,
+            i.custom_subject as subject, i.custom_class as class,
+            i.custom_isbn_barcode as isbn_barcode, hits.score,
+            (
+                SELECT COALESCE(SUM(b.actual_qty), 0) FROM `tabBin` b
+                WHERE b.item_code = hits.item_code {warehouse_condition}
+            ) as actual_qty
+        FROM (
+            SELECT s.item_code, SUM(s.weight) as score
+            FROM `tabBook Search Token` s
+            INNER JOIN `tabItem` live ON live.name = s.item_code AND live.disabled = 0
+            WHERE {" OR ".join(matches)}
+            GROUP BY s.item_code
+            HAVING {matched_count} = {len(matches)}
+            ORDER BY score DESC, s.item_code
+            LIMIT %(limit)s
+        ) hits
+        INNER JOIN `tabItem` i ON i.name = hits.item_code
+        ORDER BY hits.score DESC, hits.item_code
+    """, values, as_dict=True)
+    
+    prices = get_effective_prices([result.item_code for result in results], price_list)
+    for result in results:
+        result.price = prices.get(result.item_code)
+    
+    return results
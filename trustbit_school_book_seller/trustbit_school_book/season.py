@@ -0,0 +1,45 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import getdate, today
+
+
+# A season is an ERPNext Fiscal Year, which schools and booksellers
+# already align with the academic year
+
+
+def get_season(date=None):
+    """Fiscal Year covering a date"""
+    date = getdate(date or today())
+    season = find_season(date)
+    if not season:
+        frappe.throw(_("No Fiscal Year covers {0}, create one to use seasons").format(date))
+    
+    return season
+
+
+def find_season(date=None):
+    """Fiscal Year covering a date, None when there is none"""
+    season = frappe.db.sql("""
+        SELECT name, year_start_date, year_end_date
+        FROM `tabFiscal Year`
+        WHERE disabled = 0 AND %(date)s BETWEEN year_start_date AND year_end_date
+        ORDER BY year_start_date DESC
+        LIMIT 1
+    """, {"date": getdate(date or today())}, as_dict=True)
+    
+    return season[0] if season else None
+
+
+def get_past_seasons(count, date=None):
+    """The given number of Fiscal Years ended before the season of a date, latest first"""
+    current = get_season(date)
+    return frappe.db.sql("""
+        SELECT name, year_start_date, year_end_date
+        FROM `tabFiscal Year`
+        WHERE disabled = 0 AND year_end_date < %(start)s
+        ORDER BY year_start_date DESC
+        LIMIT %(count)s
+    """, {"start": current.year_start_date, "count": count}, as_dict=True)
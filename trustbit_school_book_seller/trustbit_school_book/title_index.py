@@ -0,0 +1,173 @@
+# Copyright (c) 2024, Trustbit and contributors
+# For license information, please see license.txt
+
+from difflib import SequenceMatcher
+
+import frappe
+from frappe.utils import flt, now_datetime
+from trustbit_school_book_seller.trustbit_school_book.search_index import tokenize, get_indexable_items
+
+
+REBUILD_BATCH_SIZE = 1000
+
+# Titles at least this similar to an existing book of the same publication
+# and class are reported as likely duplicates
+SIMILAR_TITLE_THRESHOLD = 0.85
+
+# Likely duplicates listed per checked title
+MAX_MATCHES_PER_TITLE = 3
+
+# Words that do not tell two books apart
+STOPWORDS = {"a", "an", "and", "the", "of", "for", "to", "in", "with", "book", "new"}
+
+# Masters whose name is part of the item name, with the field holding it and the Item field linking them
+TITLE_SOURCES = {
+    "Publication": ("publication_name", "custom_publication"),
+    "Class Master": ("class_name", "custom_class"),
+}
+
+
+def get_title_key(title, ignore=()):
+    """Words of a title that identify the book, so "Maths Magic" and "Magic of Math" share one key"""
+    words = set()
+    for word in tokenize(title):
+        if word in STOPWORDS or word in ignore:
+            continue
+        # Plural and singular forms are usually the same book: maths, math
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.add(word)
+    
+    return " ".join(sorted(words))[:140]
+
+
+def get_ignored_words(publications=(), classes=()):
+    """Publication and class words per master name; item names repeat them around the title"""
+    ignored = {}
+    for doctype, names in (("Publication", publications), ("Class Master", classes)):
+        names = [name for name in set(names) if name]
+        if not names:
+            continue
+        field = TITLE_SOURCES[doctype][0]
+        for name, label in frappe.get_all(doctype, filters={"name": ["in", names]}, fields=["name", field], as_list=True):
+            ignored[(doctype, name)] = set(tokenize(name)) | set(tokenize(label))
+    
+    return ignored
+
+
+def get_row_ignore(ignored, publication, class_name):
+    return ignored.get(("Publication", publication), set()) | ignored.get(("Class Master", class_name), set())
+
+
+def index_title_keys(items):
+    """Replace the title keys of the given items in one delete and one bulk insert"""
+    if not items:
+        return
+    
+    ignored = get_ignored_words(
+        {item.custom_publication for item in items}, {item.custom_class for item in items}
+    )
+    now = now_datetime()
+    user = frappe.session.user
+    values = []
+    for item in items:
+        title_key = get_title_key(item.item_name, get_row_ignore(ignored, item.custom_publication, item.custom_class))
+        if title_key:
+            values.append([
+                frappe.generate_hash(length=10), title_key, item.name, item.custom_publication,
+                item.custom_subject, item.custom_class, now, now, user, user
+            ])
+    
+    frappe.db.delete("Book Title Key", {"item_code": ["in", [item.name for item in items]]})
+    frappe.db.bulk_insert(
+        "Book Title Key",
+        ["name", "title_key", "item_code", "publication", "subject", "class", "creation", "modified", "owner", "modified_by"],
+        values
+    )
+
+
+def find_similar_titles(rows, exclude=()):
+    """Likely duplicates of each row among existing book items, read for all rows in one query
+    
+    Rows need publication, class and title, and may set subject to narrow the match.
+    Returns the matches of each row in the order of the rows, best first.
+    """
+    rows = [frappe._dict(row) for row in rows]
+    checked = [row for row in rows if row.publication and row.get("class") and row.title]
+    if not checked:
+        return [[] for row in rows]
+    
+    ignored = get_ignored_words({row.publication for row in checked}, {row.get("class") for row in checked})
+    
+    candidates = {}
+    for key in frappe.db.sql("""
+        SELECT k.title_key, k.item_code, k.publication, k.subject, k.`class`, i.item_name
+        FROM `tabBook Title Key` k
+        INNER JOIN `tabItem` i ON i.name = k.item_code AND i.disabled = 0
+        WHERE k.publication IN %(publications)s AND k.`class` IN %(classes)s
+    """, {
+        "publications": list({row.publication for row in checked}),
+        "classes": list({row.get("class") for row in checked})
+    }, as_dict=True):
+        if key.item_code not in exclude:
+            candidates.setdefault((key.publication, key.get("class")), []).append(key)
+    
+    threshold = flt(frappe.conf.get("book_similar_title_threshold")) or SIMILAR_TITLE_THRESHOLD
+    results = []
+    for row in rows:
+        matches = []
+        title_key = get_title_key(row.title, get_row_ignore(ignored, row.publication, row.get("class")))
+        for key in candidates.get((row.publication, row.get("class")), []) if title_key else []:
+            if row.subject and key.subject != row.subject:
+                continue
+            score = SequenceMatcher(None, title_key, key.title_key).ratio()
+            if score >= threshold:
+                matches.append({"item_code": key.item_code, "item_name": key.item_name, "score": round(score, 2)})
+        
+        results.append(sorted(matches, key=lambda match: -match["score"])[:MAX_MATCHES_PER_TITLE])
+    
+    return results
+
+
+def on_item_update(doc, method=None):
+    """Keep the title key of a book item current as it is created or renamed"""
+    if not doc.get("custom_book_item_creator"):
+        return
+    if any(doc.has_value_changed(field) for field in ("item_name", "custom_publication", "custom_subject", "custom_class")):
+        index_title_keys([doc])
+
+
+def on_item_trash(doc, method=None):
+    frappe.db.delete("Book Title Key", {"item_code": doc.name})
+
+
+def on_master_update(doc, method=None):
+    """Re-key items of a publication or class whose name changed"""
+    name_field, item_field = TITLE_SOURCES[doc.doctype]
+    if doc.has_value_changed(name_field) and not doc.is_new():
+        frappe.enqueue(
+            "trustbit_school_book_seller.trustbit_school_book.title_index.rebuild_title_index",
+            queue="long",
+            timeout=3600,
+            enqueue_after_commit=True,
+            filters={item_field: doc.name}
+        )
+
+
+def rebuild_title_index(filters=None):
+    """Rebuild title keys of all book items, or those matching filters, in batches"""
+    item_codes = frappe.get_all(
+        "Item",
+        filters={"custom_book_item_creator": ["is", "set"], **(filters or {})},
+        pluck="name",
+        order_by="name"
+    )
+    if not filters:
+        frappe.db.delete("Book Title Key")
+    
+    for start in range(0, len(item_codes), REBUILD_BATCH_SIZE):
+        batch = item_codes[start:start + REBUILD_BATCH_SIZE]
+        index_title_keys(get_indexable_items({"name": ["in", batch]}))
+        frappe.db.commit()
+    
+    return len(item_codes)